@@ -0,0 +1,82 @@
+"""
+Benchmarks extract_infobox against the regexes cities.py used before.
+
+Runs both over the HTML fixtures, padded with --padding bytes of article text
+after the infobox (real articles are a few hundred kilobytes), or over a
+directory of saved pages such as the fetcher's cache:
+
+    python benchmark_infobox.py [--pages .cache] [--repeat 20]
+"""
+import argparse
+import glob
+import os
+import re
+import time
+from infobox import extract_infobox
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PARAGRAPH = (
+    '<p>The city is home to <a href="/wiki/Some_Place" title="Some Place">'
+    "several landmarks</a> and a population of about 10,000.</p>\n"
+)
+
+
+def legacy_extract(html):
+    """County and website extraction from cities.py before infobox.py."""
+    county_value = None
+    for match in re.findall(
+        r"<td class=\"infobox-data\"><a href=\"/wiki/(.+?)\"", html
+    ):
+        if ("County" or "Parish") in match:
+            county_value = match.split(",")[0].replace("_", " ")
+    w = re.findall(
+        r"<th scope=\"row\" class=\"infobox-label\">Website</th>.+</a>", html
+    )
+    url = None
+    if w:
+        url = re.search(r"href=\"(.+?)\"", w[0]).group().replace("href=", "")
+        url = url.replace('"', "")
+    return county_value, url
+
+
+def load_pages(directory, padding):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        if padding:
+            html = html.replace(
+                "</table>\n<p>",
+                "</table>\n" + PARAGRAPH * (padding // len(PARAGRAPH)) + "<p>",
+                1,
+            )
+        pages.append(html)
+    return pages
+
+
+def bench(extract, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            extract(html)
+    return (time.perf_counter() - start) / (repeat * len(pages)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", help="directory of saved article HTML")
+    parser.add_argument("--padding", type=int, default=300000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages or FIXTURES, 0 if args.pages else args.padding)
+    size = sum(len(p) for p in pages) / len(pages)
+    print("%d pages, %.0f KB on average" % (len(pages), size / 1024))
+    print("legacy regexes   %10.1f us/page" % bench(legacy_extract, pages, args.repeat))
+    print(
+        "extract_infobox  %10.1f us/page" % bench(extract_infobox, pages, args.repeat)
+    )
+
+
+if __name__ == "__main__":
+    main()
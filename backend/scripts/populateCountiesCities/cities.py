@@ -1,10 +1,15 @@
-import pandas as pd
-import requests
 from bs4 import BeautifulSoup
-import time
 import re
 import json
 from urllib.parse import unquote
+from fetch import Fetcher
+from incremental_csv import IncrementalCsvWriter
+from infobox import extract_infobox
+
+OUTPUT_PATH = "United_States_Cities_with_URLs.csv"
+
+# Links to counties and county equivalents, rather than cities.
+COUNTY_TITLE = re.compile(r" (County|Parish|Borough|Census Area),")
 
 
 def title_parse(title):
@@ -12,95 +17,98 @@ def title_parse(title):
     return title
 
 
-def pull_cities():
+def normalize_city(row):
+    """Drops county entries and removes URL escapes (like %27) from a city row."""
+    if " County" in row["City"]:
+        return None
+    return dict(
+        row,
+        State=title_parse(row["State"]),
+        City=title_parse(row["City"]),
+        County=title_parse(row["County"]),
+    )
+
+
+def city_links(html, entry):
+    """Returns the links to city articles in a state's list of cities."""
+    # parse data from the html into a beautifulsoup object
+    soup = BeautifulSoup(html, "html.parser")
+
+    # DEAL WITH VERMONT'S NON-COMPLIANT WIKIPEDIA PAGE, WHICH SPLITS
+    # ITS MUNICIPALITIES ACROSS SEVERAL TABLES
+    if entry["name"] == "Vermont":
+        tables = soup.find_all("table", {"class": entry["table_type"]})
+    else:
+        tables = [soup.find("table", {"class": entry["table_type"]})]
+
+    return [
+        link
+        for table in tables
+        if table is not None
+        for link in table.select("a")
+        if "," in (link.get("title") or "")
+        and link.get("href")
+        and not COUNTY_TITLE.search(link.get("title"))
+    ]
+
+
+def pull_cities(fetcher=None, resume=True):
     print("Processing Cities...")
+    fetcher = fetcher or Fetcher()
     with open("wikipedia_US_cities.json") as f:
         wikipedia_us_city_data = json.load(f)
 
-    holding_pen = []
+    # Rows are appended to the CSV after each state. An interrupted run
+    # resumes at the next state that wasn't written.
+    writer = IncrementalCsvWriter(
+        OUTPUT_PATH,
+        ["State", "County", "City", "URL"],
+        resume=resume,
+        normalize=normalize_city,
+    )
 
     for entry in wikipedia_us_city_data:
+        if writer.is_done(entry["name"]):
+            continue
         print(entry["name"])
         # get the response in the form of html
         wikiurl = "https://en.wikipedia.org/wiki/" + entry["url"]
-        response = requests.get(wikiurl)
-
-        # parse data from the html into a beautifulsoup object
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # DEAL WITH VERMONT'S NON-COMPLIANT WIKIPEDIA PAGE
-        if entry["name"] == "Vermont":
-            countytable = soup.find_all(
-                "table",
-                {"class": entry["table_type"]},
-            )
-            vermont_special = ""
-            for thing in countytable:
-                vermont_special = vermont_special + "\n" + str(thing)
-            soup_special = BeautifulSoup(vermont_special, "html.parser")
-            countytable = soup_special
-        else:
-            countytable = soup.find(
-                "table",
-                {"class": entry["table_type"]},
-            )
-
-        links = countytable.select("a")
-        for link in links:
-            if "County" or "Parish" not in link.get("title"):
-                try:
-                    if "," in link.get("title"):
-                        county_pieces = link.get("title").split(",")
-                        # OPEN WIKIPEDIA PAGE UP
-                        x = requests.get("https://en.wikipedia.org/" + link.get("href"))
-
-                        # PULL COUNTY OR PARISH FROM WIKIPEDIA PAGE
-                        county_parish_matches = re.findall(
-                            r"<td class=\"infobox-data\"><a href=\"/wiki/(.+?)\"",
-                            x.text,
-                        )
-
-                        for match in county_parish_matches:
-                            if ("County" or "Parish") in match:
-                                county_value = match
-                                county_value = county_value.split(",")
-                                county_value = county_value[0].replace("_", " ")
-
-                        # PULL WEBSITE FROM WIKIPEDIA PAGE
-                        w = re.findall(
-                            r"<th scope=\"row\" class=\"infobox-label\">Website</th>.+</a>",
-                            x.text,
-                        )
-                        # PULL URL OUT OF FOUND TEXT
-                        url = re.search(r"href=\"(.+?)\"", w[0])
-                        url = url.group()
-                        url = url.replace("href=", "").replace('"', "")
-
-                        holding_pen.append(
-                            {
-                                "City": county_pieces[0],
-                                "State": entry["name"],
-                                "URL": url,
-                                "County": county_value,
-                            }
-                        )
-                    time.sleep(1)
-                except:
-                    pass
-
-        df = pd.DataFrame(holding_pen, columns=["State", "County", "City", "URL"])
-
-        df.drop_duplicates(inplace=True)
-
-        # DROP COUNTIES FROM CITY ENTRIES
-        df = df[~df.City.str.contains(" County", na=False)]
-
-        # REMOVE HTML ENTITIES (LIKE %27)
-        df["State"] = df.State.apply(title_parse)
-        df["City"] = df.City.apply(title_parse)
-        df["County"] = df.County.apply(title_parse)
-
-        df.to_csv("United_States_Cities_with_URLs.csv", index=False, encoding="utf-8")
+        response_text = fetcher.get(wikiurl)
+        if response_text is None:
+            continue
+
+        links = city_links(response_text, entry)
+        # OPEN WIKIPEDIA PAGES UP
+        pages = fetcher.map(
+            "https://en.wikipedia.org/" + link.get("href") for link in links
+        )
+        try:
+            for link, (_, page_text) in zip(links, pages):
+                if page_text is None:
+                    continue
+                # PULL COUNTY OR PARISH AND WEBSITE FROM THE INFOBOX
+                infobox = extract_infobox(page_text)
+                if not infobox["website"]:
+                    continue
+                writer.add(
+                    {
+                        "City": link.get("title").split(",")[0],
+                        "State": entry["name"],
+                        "URL": infobox["website"],
+                        "County": infobox["county"] or "",
+                    }
+                )
+        except Exception as e:
+            # Leave the state out of the CSV so the next run retries it.
+            print("Failed to process %s: %s" % (entry["name"], e))
+            writer.rollback()
+            continue
+        writer.commit(entry["name"])
+
+    if all(writer.is_done(entry["name"]) for entry in wikipedia_us_city_data):
+        writer.finish()
+    else:
+        print("Some states failed; run again to retry them.")
 
 
 if __name__ == "__main__":
@@ -1,40 +1,44 @@
 import pandas as pd
-import requests
 from bs4 import BeautifulSoup
-import time
-import re
+from fetch import Fetcher
+from infobox import extract_infobox
 
 
-def pull_counties():
+def pull_counties(fetcher=None):
     print("Processing Counties...")
+    fetcher = fetcher or Fetcher()
     # get the response in the form of html
     wikiurl = "https://en.wikipedia.org/wiki/List_of_United_States_counties_and_county_equivalents"
     table_class = "wikitable sortable jquery-tablesorter"
-    response = requests.get(wikiurl)
+    response_text = fetcher.get(wikiurl)
+    if response_text is None:
+        print("Could not fetch the list of counties; nothing was written.")
+        return
 
     # parse data from the html into a beautifulsoup object
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = BeautifulSoup(response_text, "html.parser")
     countytable = soup.find("table", {"class": "wikitable"})
 
     links = countytable.select("a")
 
     holding_pen = []
 
-    for link in links:
-        try:
-            county_pieces = link.get("title").split(", ")
-            # OPEN WIKIPEDIA PAGE UP
-            x = requests.get("https://en.wikipedia.org/" + link.get("href"))
-
-            # PULL WEBSITE FROM WIKIPEDIA PAGE
-            w = re.findall(
-                r"<th scope=\"row\" class=\"infobox-label\">Website</th>.+</a>", x.text
-            )
-            # PULL URL OUT OF FOUND TEXT
-            url = re.search(r"href=\"(.+?)\"", w[0])
-            url = url.group()
-            url = url.replace("href=", "")
-
+    links = [link for link in links if link.get("title") and link.get("href")]
+    # OPEN WIKIPEDIA PAGES UP
+    pages = fetcher.map(
+        "https://en.wikipedia.org/" + link.get("href") for link in links
+    )
+    for link, (_, page_text) in zip(links, pages):
+        county_pieces = link.get("title").split(", ")
+        if len(county_pieces) < 2:
+            continue
+        if page_text is None:
+            print("Skipping %s: its page could not be fetched." % link.get("title"))
+            continue
+
+        # PULL WEBSITE FROM THE INFOBOX
+        url = extract_infobox(page_text)["website"]
+        if url:
             holding_pen.append(
                 {
                     "County": county_pieces[0],
@@ -42,10 +46,6 @@ def pull_counties():
                     "URL": url,
                 }
             )
-        except Exception as e:
-            pass
-
-        time.sleep(1)
 
     df = pd.DataFrame(holding_pen, columns=["County", "State", "URL"])
 
@@ -0,0 +1,165 @@
+"""
+Shared Wikipedia fetch layer for cities.py and counties.py.
+
+Fetcher downloads pages with a pooled requests session, at most `concurrency`
+at a time and no faster than `rate` requests per second (a token bucket, so
+short bursts are allowed). Successful responses are cached on disk for
+`ttl` seconds, so reruns and runs that failed halfway only fetch pages that
+are missing from the cache.
+
+To run offline, pass a FixtureSession, which serves saved HTML files named
+after the last path segment of each URL (e.g. "Vermont.html"):
+
+    Fetcher(session=FixtureSession("fixtures"), cache_dir=None)
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = (
+    "CrossfeedPopulateCountiesCities/1.0 (https://github.com/cisagov/crossfeed)"
+)
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """Stores response bodies on disk by URL, expiring them after `ttl` seconds."""
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        return os.path.join(
+            self.directory, hashlib.sha256(url.encode()).hexdigest() + ".html"
+        )
+
+    def get(self, url):
+        path = self.path(url)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, url, text):
+        path = self.path(url)
+        tmp_path = "%s.%d.tmp" % (path, threading.get_ident())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+class FixtureResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("%d fixture response" % self.status_code)
+
+
+class FixtureSession:
+    """Stand-in for requests.Session that serves pages from a directory of HTML files."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.requested = []
+
+    def get(self, url, **kwargs):
+        self.requested.append(url)
+        name = unquote(urlparse(url).path.rstrip("/").rsplit("/", 1)[-1])
+        path = os.path.join(self.directory, name.replace("/", "_") + ".html")
+        if not os.path.exists(path):
+            return FixtureResponse(404, "")
+        with open(path, encoding="utf-8") as f:
+            return FixtureResponse(200, f.read())
+
+
+def make_session(concurrency):
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=concurrency,
+        max_retries=Retry(
+            total=3, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504)
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class Fetcher:
+    def __init__(
+        self,
+        session=None,
+        cache_dir=".cache",
+        ttl=30 * 24 * 3600,
+        rate=5,
+        concurrency=8,
+        timeout=30,
+    ):
+        self.session = session or make_session(concurrency)
+        self.cache = ResponseCache(cache_dir, ttl) if cache_dir else None
+        self.bucket = TokenBucket(rate, burst=concurrency)
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def get(self, url):
+        """Returns the text of the page at url, or None if it can't be fetched."""
+        if self.cache:
+            text = self.cache.get(url)
+            if text is not None:
+                return text
+        self.bucket.acquire()
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print("Failed to fetch %s: %s" % (url, e))
+            return None
+        if self.cache:
+            self.cache.set(url, response.text)
+        return response.text
+
+    def map(self, urls):
+        """Yields (url, text) for each URL, in order, fetching them concurrently."""
+        urls = list(urls)
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            yield from zip(urls, pool.map(self.get, urls))
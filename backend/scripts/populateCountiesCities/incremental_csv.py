@@ -0,0 +1,75 @@
+"""
+Append-only CSV writer with deduplication and a resumable checkpoint.
+
+Rows are buffered per group (e.g. per state) and appended to the CSV when the
+group is committed, after which the group is recorded in a checkpoint file
+next to the CSV. A group that fails part way is rolled back instead, so that
+it's retried in full by the next run. If a run is interrupted, the next run
+with resume=True keeps the rows already written, skips the committed groups
+and continues with the next one. The checkpoint is removed once the run
+finishes, and ignored if the CSV it belongs to is gone.
+"""
+import csv
+import json
+import os
+
+
+class IncrementalCsvWriter:
+    def __init__(self, path, columns, resume=True, normalize=None):
+        self.path = path
+        self.columns = columns
+        self.normalize = normalize
+        self.checkpoint_path = path + ".checkpoint"
+        self.done = set()
+        self.seen = set()
+        # Buffered rows, as a dict to keep their order.
+        self.pending = {}
+
+        if resume and os.path.exists(self.checkpoint_path) and os.path.exists(path):
+            with open(self.checkpoint_path) as f:
+                self.done = set(json.load(f)["done"])
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    self.seen.add(tuple(row[c] for c in columns))
+        else:
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow(columns)
+            self._save_checkpoint()
+
+    def is_done(self, group):
+        return group in self.done
+
+    def add(self, row):
+        """Buffers a row, unless it's a duplicate. Returns whether it was added."""
+        if self.normalize:
+            row = self.normalize(row)
+            if row is None:
+                return False
+        key = tuple("" if row.get(c) is None else str(row[c]) for c in self.columns)
+        if key in self.seen or key in self.pending:
+            return False
+        self.pending[key] = None
+        return True
+
+    def commit(self, group):
+        """Appends the buffered rows to the CSV and marks the group as done."""
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(self.pending)
+            f.flush()
+            os.fsync(f.fileno())
+        self.seen.update(self.pending)
+        self.pending = {}
+        self.done.add(group)
+        self._save_checkpoint()
+
+    def rollback(self):
+        """Discards the buffered rows of a group that failed."""
+        self.pending = {}
+
+    def _save_checkpoint(self):
+        with open(self.checkpoint_path + ".tmp", "w") as f:
+            json.dump({"done": sorted(self.done)}, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def finish(self):
+        os.remove(self.checkpoint_path)
@@ -0,0 +1,108 @@
+"""
+Extracts fields from the infobox of a Wikipedia article.
+
+Articles are several hundred kilobytes of HTML, but the infobox is a small
+table near the top. extract_infobox finds it once and walks its rows with a
+few precompiled patterns, returning every labeled field in one pass, along with
+the county (or parish, borough or census area) and official website.
+"""
+import re
+from html import unescape
+from urllib.parse import unquote
+
+INFOBOX_START = re.compile(r"<table[^>]*\bclass=\"[^\"]*\binfobox\b")
+TABLE_TAG = re.compile(r"<(/?)table\b[^>]*>", re.I)
+ROW = re.compile(r"<tr\b[^>]*>(.*?)</tr>", re.S)
+LABEL = re.compile(r"<th\b[^>]*\bclass=\"[^\"]*\binfobox-label\b[^>]*>(.*?)</th>", re.S)
+DATA = re.compile(r"<td\b[^>]*\bclass=\"[^\"]*\binfobox-data\b[^>]*>(.*?)</td>", re.S)
+HREF = re.compile(r"<a\b[^>]*?\bhref=\"([^\"]*)\"")
+TAG = re.compile(r"<[^>]+>")
+SPACE = re.compile(r"\s+")
+
+# Infobox labels of the county-level division a place is in, and the words
+# that the article names of those divisions end with.
+COUNTY_LABELS = {
+    "county",
+    "counties",
+    "parish",
+    "parishes",
+    "borough",
+    "boroughs",
+    "census area",
+    "municipality",
+}
+COUNTY_WORD = re.compile(r"_(County|Parish|Borough|Census_Area|Municipality)(?:,|$)")
+
+
+def infobox_fragment(html):
+    """Returns the HTML of the first infobox table in html, or None."""
+    start = INFOBOX_START.search(html)
+    if not start:
+        return None
+    # Infoboxes can contain nested tables, so match up the table tags.
+    depth = 0
+    for tag in TABLE_TAG.finditer(html, start.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return html[start.start() : tag.end()]
+    return html[start.start() :]
+
+
+def text(fragment):
+    return SPACE.sub(" ", unescape(TAG.sub("", fragment))).strip()
+
+
+def wiki_title(href):
+    """Returns the article title a /wiki/ link points to, or None."""
+    if href and href.startswith("/wiki/"):
+        return unquote(href[len("/wiki/") :])
+    return None
+
+
+def county_name(title):
+    """Returns "Lake County" for a title like "Lake_County,_Ohio"."""
+    return title.split(",")[0].replace("_", " ")
+
+
+def extract_infobox(html):
+    """Returns a dict of the infobox's fields.
+
+    "fields" maps each row label to {"text": ..., "hrefs": [...]}, and
+    "county" and "website" are the county-level division and official website,
+    or None if the infobox doesn't have them.
+    """
+    result = {"fields": {}, "county": None, "website": None}
+    fragment = infobox_fragment(html)
+    if fragment is None:
+        return result
+    linked_county = None
+    for row in ROW.finditer(fragment):
+        row_html = row.group(1)
+        data = DATA.search(row_html)
+        if not data:
+            continue
+        hrefs = HREF.findall(data.group(1))
+        label = LABEL.search(row_html)
+        label = text(label.group(1)) if label else ""
+        if label:
+            result["fields"].setdefault(
+                label, {"text": text(data.group(1)), "hrefs": hrefs}
+            )
+
+        titles = [wiki_title(href) for href in hrefs]
+        if result["county"] is None and label.lower() in COUNTY_LABELS:
+            for title in titles:
+                if title:
+                    result["county"] = county_name(title)
+                    break
+        if linked_county is None:
+            # Fall back to the first link to a county anywhere in the infobox.
+            for title in titles:
+                if title and COUNTY_WORD.search(title):
+                    linked_county = county_name(title)
+                    break
+        if label == "Website" and hrefs and result["website"] is None:
+            result["website"] = unescape(hrefs[0])
+    if result["county"] is None:
+        result["county"] = linked_county
+    return result
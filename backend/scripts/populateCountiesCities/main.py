@@ -1,24 +1,59 @@
 import typer
 import cities
 import counties
+from fetch import Fetcher, FixtureSession
 
 app = typer.Typer()
 
+fetch_options = {}
+
+
+@app.callback()
+def main(
+    cache_dir: str = typer.Option(".cache", help="On-disk cache of fetched pages"),
+    cache_ttl: int = typer.Option(30 * 24 * 3600, help="Cache TTL in seconds"),
+    rate: float = typer.Option(5, help="Maximum requests per second"),
+    concurrency: int = typer.Option(8, help="Maximum concurrent requests"),
+    fixtures: str = typer.Option(
+        None, help="Serve pages from this directory of saved HTML files (offline)"
+    ),
+):
+    fetch_options.update(
+        session=FixtureSession(fixtures) if fixtures else None,
+        cache_dir=None if fixtures else cache_dir,
+        ttl=cache_ttl,
+        rate=rate,
+        concurrency=concurrency,
+    )
+
+
+def make_fetcher():
+    return Fetcher(**fetch_options)
+
 
 @app.command()
-def process_cities():
-    cities.pull_cities()
+def process_cities(
+    resume: bool = typer.Option(
+        True, "--resume/--restart", help="Resume an interrupted run at the next state"
+    )
+):
+    cities.pull_cities(make_fetcher(), resume=resume)
 
 
 @app.command()
 def process_counties():
-    counties.pull_counties()
+    counties.pull_counties(make_fetcher())
 
 
 @app.command()
-def process_both():
-    counties.pull_counties()
-    cities.pull_cities()
+def process_both(
+    resume: bool = typer.Option(
+        True, "--resume/--restart", help="Resume an interrupted run at the next state"
+    )
+):
+    fetcher = make_fetcher()
+    counties.pull_counties(fetcher)
+    cities.pull_cities(fetcher, resume=resume)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+import csv
+import json
+import os
+import threading
+import time
+import pytest
+from fetch import Fetcher, FixtureSession, TokenBucket
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PAGE_URL = "https://en.wikipedia.org//wiki/Springfield,_Testland"
+
+
+def test_fixture_session_and_cache(tmp_path):
+    session = FixtureSession(FIXTURES)
+    fetcher = Fetcher(session=session, cache_dir=str(tmp_path))
+    assert "www.springfield.gov" in fetcher.get(PAGE_URL)
+    assert "www.springfield.gov" in fetcher.get(PAGE_URL)
+    assert fetcher.get("https://en.wikipedia.org/wiki/Missing") is None
+    assert fetcher.get("https://en.wikipedia.org/wiki/Missing") is None
+    # Cached pages aren't fetched again, but failures are retried.
+    assert (
+        session.requested == [PAGE_URL] + ["https://en.wikipedia.org/wiki/Missing"] * 2
+    )
+
+    # A new run reuses the cache.
+    session = FixtureSession(FIXTURES)
+    Fetcher(session=session, cache_dir=str(tmp_path)).get(PAGE_URL)
+    assert session.requested == []
+
+
+def test_cache_ttl(tmp_path):
+    session = FixtureSession(FIXTURES)
+    fetcher = Fetcher(session=session, cache_dir=str(tmp_path), ttl=60)
+    fetcher.get(PAGE_URL)
+    path = fetcher.cache.path(PAGE_URL)
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    fetcher.get(PAGE_URL)
+    assert len(session.requested) == 2
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.19
+
+
+class SlowSession:
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        return FixtureSession(FIXTURES).get(url)
+
+
+def test_map_is_concurrent_and_ordered():
+    session = SlowSession()
+    fetcher = Fetcher(session=session, cache_dir=None, rate=1000, concurrency=3)
+    urls = ["https://en.wikipedia.org/wiki/Page_%d" % i for i in range(12)]
+    assert [url for url, _ in fetcher.map(urls)] == urls
+    assert session.max_active == 3
+
+
+def test_pull_cities_offline(tmp_path, monkeypatch):
+    pytest.importorskip("bs4")
+    import cities
+
+    monkeypatch.chdir(tmp_path)
+    with open("wikipedia_US_cities.json", "w") as f:
+        json.dump(
+            [
+                {
+                    "name": "Testland",
+                    "url": "List_of_municipalities_in_Testland",
+                    "table_type": "wikitable sortable",
+                }
+            ],
+            f,
+        )
+    cities.pull_cities(Fetcher(session=FixtureSession(FIXTURES), cache_dir=None))
+    with open("United_States_Cities_with_URLs.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(rows, key=lambda r: r["City"]) == [
+        {
+            "State": "Testland",
+            "County": "Lake County",
+            "City": "Ogdenville",
+            "URL": "http://www.ogdenville.org",
+        },
+        {
+            "State": "Testland",
+            "County": "Shelby County",
+            "City": "Shelbyville",
+            "URL": "https://shelbyville.gov/",
+        },
+        {
+            "State": "Testland",
+            "County": "Lake County",
+            "City": "Springfield",
+            "URL": "https://www.springfield.gov",
+        },
+    ]
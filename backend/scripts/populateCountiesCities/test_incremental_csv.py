@@ -0,0 +1,85 @@
+import csv
+import os
+from incremental_csv import IncrementalCsvWriter
+
+COLUMNS = ["State", "City"]
+
+
+def read(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_dedupes_and_appends_per_group(tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = IncrementalCsvWriter(path, COLUMNS)
+    assert writer.add({"State": "Ohio", "City": "Akron"})
+    assert not writer.add({"State": "Ohio", "City": "Akron"})
+    assert read(path) == [COLUMNS]
+    writer.commit("Ohio")
+    writer.add({"State": "Utah", "City": "Provo"})
+    writer.commit("Utah")
+    assert read(path) == [COLUMNS, ["Ohio", "Akron"], ["Utah", "Provo"]]
+    writer.finish()
+    assert not os.path.exists(path + ".checkpoint")
+
+
+def test_normalize(tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = IncrementalCsvWriter(
+        path,
+        COLUMNS,
+        normalize=lambda row: None
+        if row["City"] == "Skip"
+        else dict(row, City=row["City"].upper()),
+    )
+    assert not writer.add({"State": "Ohio", "City": "Skip"})
+    writer.add({"State": "Ohio", "City": "Akron"})
+    assert not writer.add({"State": "Ohio", "City": "AKRON"})
+    writer.commit("Ohio")
+    assert read(path)[1:] == [["Ohio", "AKRON"]]
+
+
+def test_resume_after_interruption(tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = IncrementalCsvWriter(path, COLUMNS)
+    writer.add({"State": "Ohio", "City": "Akron"})
+    writer.commit("Ohio")
+    writer.add({"State": "Utah", "City": "Provo"})
+    # Interrupted before Utah was committed.
+
+    writer = IncrementalCsvWriter(path, COLUMNS)
+    assert writer.is_done("Ohio")
+    assert not writer.is_done("Utah")
+    assert not writer.add({"State": "Ohio", "City": "Akron"})
+    writer.add({"State": "Utah", "City": "Provo"})
+    writer.commit("Utah")
+    writer.finish()
+    assert read(path) == [COLUMNS, ["Ohio", "Akron"], ["Utah", "Provo"]]
+
+    # Without a checkpoint, or with resume=False, the CSV is rewritten.
+    writer = IncrementalCsvWriter(path, COLUMNS)
+    assert not writer.is_done("Ohio")
+    assert read(path) == [COLUMNS]
+
+
+def test_rollback_discards_rows(tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = IncrementalCsvWriter(path, COLUMNS)
+    writer.add({"State": "Ohio", "City": "Akron"})
+    writer.rollback()
+    assert writer.add({"State": "Ohio", "City": "Akron"})
+    writer.commit("Ohio")
+    assert read(path) == [COLUMNS, ["Ohio", "Akron"]]
+
+
+def test_checkpoint_without_csv_starts_fresh(tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = IncrementalCsvWriter(path, COLUMNS)
+    writer.add({"State": "Ohio", "City": "Akron"})
+    writer.commit("Ohio")
+    os.remove(path)
+
+    writer = IncrementalCsvWriter(path, COLUMNS)
+    assert not writer.is_done("Ohio")
+    assert read(path) == [COLUMNS]
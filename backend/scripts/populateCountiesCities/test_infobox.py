@@ -0,0 +1,78 @@
+import os
+import pytest
+from infobox import extract_infobox, infobox_fragment
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name + ".html"), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize(
+    "name,county,website",
+    [
+        ("Springfield,_Testland", "Lake County", "https://www.springfield.gov"),
+        (
+            "Lafayette,_Louisiana",
+            "Lafayette Parish",
+            "https://www.lafayettela.gov/?a=1&b=2",
+        ),
+        ("Palmer,_Alaska", "Matanuska-Susitna Borough", "http://www.palmerak.org"),
+        ("Montpelier,_Vermont", "Washington County", "https://www.montpelier-vt.org"),
+        # No County row, so the first county link in the infobox is used.
+        ("Burlington,_Vermont", "Chittenden County", "https://www.burlingtonvt.gov"),
+    ],
+)
+def test_extract_infobox(name, county, website):
+    infobox = extract_infobox(fixture(name))
+    assert infobox["county"] == county
+    assert infobox["website"] == website
+
+
+def test_fields_in_one_pass():
+    fields = extract_infobox(fixture("Lafayette,_Louisiana"))["fields"]
+    assert fields["Country"] == {
+        "text": "United States",
+        "hrefs": ["/wiki/United_States"],
+    }
+    assert fields["Parish"]["text"] == "Lafayette"
+    assert fields["Website"]["text"] == "www.lafayettela.gov"
+
+
+def test_nested_tables_and_links_outside_the_infobox():
+    html = fixture("Lafayette,_Louisiana")
+    fragment = infobox_fragment(html)
+    assert fragment.endswith("</table>")
+    assert "Website" in fragment
+    assert "Other_Parish" not in fragment
+
+
+def test_no_infobox():
+    assert extract_infobox("<html><body>No infobox</body></html>") == {
+        "fields": {},
+        "county": None,
+        "website": None,
+    }
+
+
+@pytest.mark.parametrize(
+    "state,page,titles",
+    [
+        (
+            "Vermont",
+            "List_of_towns_in_Vermont",
+            ["Burlington, Vermont", "Montpelier, Vermont"],
+        ),
+        ("Louisiana", "List_of_municipalities_in_Louisiana", ["Lafayette, Louisiana"]),
+    ],
+)
+def test_city_links(state, page, titles):
+    pytest.importorskip("bs4")
+    from cities import city_links
+
+    entry = {"name": state, "url": page, "table_type": "wikitable sortable"}
+    links = city_links(fixture(page), entry)
+    # County and parish links are skipped, and all of Vermont's tables are read.
+    assert [link.get("title") for link in links] == titles
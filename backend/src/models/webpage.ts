@@ -76,4 +76,11 @@ export class Webpage extends BaseEntity {
     default: []
   })
   headers: { name: string; value: string }[];
+
+  /** URL of an earlier page on the same domain that this one nearly duplicates. */
+  @Column({
+    nullable: true,
+    type: 'varchar'
+  })
+  nearDuplicateOf: string | null;
 }
@@ -19,7 +19,9 @@ export interface WebpageRecord {
   webpage_domainId: string;
   webpage_discoveredById: string;
   webpage_responseSize: number | null;
-  webpage_headers: { name: string; value: string }[];
+  webpage_headers?: { name: string; value: string }[];
+  webpage_s3Key?: string | null;
+  webpage_nearDuplicateOf?: string | null;
 
   // Added before elasticsearch insertion (not present in the database):
   suggest?: { input: string | string[]; weight: number }[];
@@ -28,6 +30,7 @@ export interface WebpageRecord {
     parent: string;
   };
   webpage_body?: string;
+  webpage_bodySize?: number;
 }
 
 /**
@@ -0,0 +1,165 @@
+import { Readable } from 'stream';
+import { gunzipSync } from 'zlib';
+
+// Sync this with backend/worker/webscraper/webscraper/output.py
+const COMPRESSION_NONE = 0;
+const COMPRESSION_GZIP = 1;
+const COMPRESSION_ZSTD = 2;
+
+/** Decodes a msgpack value, as written by msgpack.packb(use_bin_type=True).
+ * Only the types that scraped items use are supported (no extension types).
+ */
+export const decodeMsgpack = (buffer: Buffer): any => {
+  let offset = 0;
+  const read = (length: number) => {
+    if (offset + length > buffer.length) {
+      throw new Error('Truncated msgpack value');
+    }
+    offset += length;
+    return buffer.subarray(offset - length, offset);
+  };
+  const readArray = (length: number) => {
+    const array: any[] = [];
+    for (let i = 0; i < length; i++) array.push(readValue());
+    return array;
+  };
+  const readMap = (length: number) => {
+    const map: { [key: string]: any } = {};
+    for (let i = 0; i < length; i++) {
+      const key = readValue();
+      map[key] = readValue();
+    }
+    return map;
+  };
+  const readValue = (): any => {
+    const type = read(1)[0];
+    if (type <= 0x7f) return type;
+    if (type <= 0x8f) return readMap(type & 0x0f);
+    if (type <= 0x9f) return readArray(type & 0x0f);
+    if (type <= 0xbf) return read(type & 0x1f).toString('utf8');
+    if (type >= 0xe0) return type - 0x100;
+    switch (type) {
+      case 0xc0:
+        return null;
+      case 0xc2:
+        return false;
+      case 0xc3:
+        return true;
+      case 0xc4:
+        return Buffer.from(read(read(1).readUInt8(0)));
+      case 0xc5:
+        return Buffer.from(read(read(2).readUInt16BE(0)));
+      case 0xc6:
+        return Buffer.from(read(read(4).readUInt32BE(0)));
+      case 0xca:
+        return read(4).readFloatBE(0);
+      case 0xcb:
+        return read(8).readDoubleBE(0);
+      case 0xcc:
+        return read(1).readUInt8(0);
+      case 0xcd:
+        return read(2).readUInt16BE(0);
+      case 0xce:
+        return read(4).readUInt32BE(0);
+      case 0xcf:
+        return Number(read(8).readBigUInt64BE(0));
+      case 0xd0:
+        return read(1).readInt8(0);
+      case 0xd1:
+        return read(2).readInt16BE(0);
+      case 0xd2:
+        return read(4).readInt32BE(0);
+      case 0xd3:
+        return Number(read(8).readBigInt64BE(0));
+      case 0xd9:
+        return read(read(1).readUInt8(0)).toString('utf8');
+      case 0xda:
+        return read(read(2).readUInt16BE(0)).toString('utf8');
+      case 0xdb:
+        return read(read(4).readUInt32BE(0)).toString('utf8');
+      case 0xdc:
+        return readArray(read(2).readUInt16BE(0));
+      case 0xdd:
+        return readArray(read(4).readUInt32BE(0));
+      case 0xde:
+        return readMap(read(2).readUInt16BE(0));
+      case 0xdf:
+        return readMap(read(4).readUInt32BE(0));
+    }
+    throw new Error(`Unsupported msgpack type 0x${type.toString(16)}`);
+  };
+  return readValue();
+};
+
+/** Reads the items written as length-prefixed msgpack frames by the
+ * webscraper's FrameOutput (OUTPUT_MODE = "frames") and calls onItem with
+ * each one, in order. Each frame is a 4-byte big-endian length, a
+ * compression byte and the msgpack payload, where the length covers the
+ * compression byte and the payload. The stream is paused while onItem runs.
+ *
+ * zlib can't decompress zstd frames, so the webscraper must be run with
+ * OUTPUT_COMPRESSION unset or "gzip".
+ */
+export default (stream: Readable, onItem: (item: any) => Promise<void>) =>
+  new Promise<void>((resolve, reject) => {
+    let buffer = Buffer.alloc(0);
+    // Chunks received since the last frame was read, and their total length.
+    let chunks: Buffer[] = [];
+    let buffered = 0;
+    let needed = 4;
+    // The stream can end while the last chunk's items are being handled.
+    let handling = false;
+    let ended = false;
+    const finish = () => {
+      if (buffered) return reject(new Error('Truncated frame'));
+      resolve();
+    };
+    const readFrame = () => {
+      const length = buffer.readUInt32BE(0);
+      const compression = buffer[4];
+      let payload = buffer.subarray(5, 4 + length);
+      buffer = buffer.subarray(4 + length);
+      if (compression === COMPRESSION_GZIP) {
+        payload = gunzipSync(payload);
+      } else if (compression === COMPRESSION_ZSTD) {
+        throw new Error(
+          'zstd frames are not supported, unset OUTPUT_COMPRESSION'
+        );
+      } else if (compression !== COMPRESSION_NONE) {
+        throw new Error(`Unknown frame compression ${compression}`);
+      }
+      return decodeMsgpack(payload);
+    };
+    stream.on('data', async (chunk: Buffer) => {
+      chunks.push(chunk);
+      buffered += chunk.length;
+      // Large frames span many chunks, which are only joined once the
+      // whole frame has arrived.
+      if (buffered < needed) return;
+      stream.pause();
+      handling = true;
+      try {
+        buffer = Buffer.concat(chunks, buffered);
+        while (
+          buffer.length >= 4 &&
+          buffer.length >= 4 + buffer.readUInt32BE(0)
+        ) {
+          await onItem(readFrame());
+        }
+      } catch (e) {
+        stream.destroy();
+        return reject(e);
+      }
+      handling = false;
+      chunks = [buffer];
+      buffered = buffer.length;
+      needed = buffer.length >= 4 ? 4 + buffer.readUInt32BE(0) : 4;
+      if (ended) return finish();
+      stream.resume();
+    });
+    stream.on('end', () => {
+      ended = true;
+      if (!handling) finish();
+    });
+    stream.on('error', reject);
+  });
@@ -1,15 +1,16 @@
 import { plainToClass } from 'class-transformer';
 import pRetry from 'p-retry';
+import { In } from 'typeorm';
 import { connectToDatabase, Webpage } from '../../models';
 import ESClient, { WebpageRecord } from '../es-client';
 import { ScraperItem } from '../webscraper';
 
-/** Saves scraped webpages to the database, and also syncs them
- * with Elasticsearch.
+/** Whether the webscraper saves webpages to the database itself
+ * (WEBSCRAPER_DB_SINK, see worker/webscraper/webscraper/dbsink.py).
  */
-export default async (scrapedWebpages: ScraperItem[]): Promise<void> => {
-  await connectToDatabase();
+export const dbSinkEnabled = () => !!process.env.WEBSCRAPER_DB_SINK;
 
+const upsertWebpages = async (scrapedWebpages: ScraperItem[]) => {
   const urlToInsertedWebpage: { [x: string]: Webpage } = {};
   for (const scrapedWebpage of scrapedWebpages) {
     const result = await Webpage.createQueryBuilder()
@@ -23,16 +24,22 @@ export default async (scrapedWebpages: ScraperItem[]): Promise<void> => {
           url: scrapedWebpage.url,
           status: scrapedWebpage.status,
           responseSize: scrapedWebpage.response_size,
+          s3Key: scrapedWebpage.s3_key || null,
+          nearDuplicateOf: scrapedWebpage.near_duplicate_of || null,
           headers: []
         })
       )
       .onConflict(
-        `
+        scrapedWebpage.unchanged
+          ? `("domainId","url") DO UPDATE SET "lastSeen" = excluded."lastSeen"`
+          : `
         ("domainId","url") DO UPDATE
         SET "lastSeen" = excluded."lastSeen",
             "syncedAt" = excluded."syncedAt",
             "status" = excluded."status",
             "responseSize" = excluded."responseSize",
+            "s3Key" = COALESCE(excluded."s3Key", webpage."s3Key"),
+            "nearDuplicateOf" = excluded."nearDuplicateOf",
             "headers" = excluded."headers",
             "updatedAt" = now()
       `
@@ -42,16 +49,69 @@ export default async (scrapedWebpages: ScraperItem[]): Promise<void> => {
     urlToInsertedWebpage[scrapedWebpage.url] = result
       .generatedMaps[0] as Webpage;
   }
+  return urlToInsertedWebpage;
+};
+
+/** Looks up webpages saved by the webscraper's database sink, and marks
+ * them as synced.
+ */
+const findWebpages = async (scrapedWebpages: ScraperItem[]) => {
+  const urlToInsertedWebpage: { [x: string]: Webpage } = {};
+  if (scrapedWebpages.length === 0) {
+    return urlToInsertedWebpage;
+  }
+  const webpages = await Webpage.find({
+    where: scrapedWebpages.map((e) => ({ url: e.url, domain: e.domain }))
+  });
+  const syncedAt = new Date(Date.now());
+  if (webpages.length > 0) {
+    await Webpage.update({ id: In(webpages.map((e) => e.id)) }, { syncedAt });
+  }
+  for (const webpage of webpages) {
+    webpage.syncedAt = syncedAt;
+    urlToInsertedWebpage[webpage.url] = webpage;
+  }
+  return urlToInsertedWebpage;
+};
+
+/** Saves scraped webpages to the database, and also syncs them
+ * with Elasticsearch. Webpages that haven't changed since the last
+ * crawl only have their lastSeen date updated.
+ *
+ * When the webscraper saves webpages to the database itself
+ * (dbSinkEnabled()), they are only synced with Elasticsearch, and the
+ * webpages that aren't in the database yet are returned so that they
+ * can be synced later.
+ */
+export default async (
+  scrapedWebpages: ScraperItem[]
+): Promise<ScraperItem[]> => {
+  await connectToDatabase();
+
+  const sinkEnabled = dbSinkEnabled();
+  const changedWebpages = scrapedWebpages.filter((e) => !e.unchanged);
+  const urlToInsertedWebpage = sinkEnabled
+    ? await findWebpages(changedWebpages)
+    : await upsertWebpages(scrapedWebpages);
+  const missingWebpages = changedWebpages.filter(
+    (e) => !urlToInsertedWebpage[e.url]
+  );
+  const unsyncedWebpages = sinkEnabled ? missingWebpages : [];
+  if (missingWebpages.length === changedWebpages.length) {
+    return unsyncedWebpages;
+  }
   console.log('Saving webpages to elasticsearch...');
   const client = new ESClient();
   await pRetry(
     () =>
       client.updateWebpages(
-        scrapedWebpages
+        changedWebpages
           .map((e) => {
             const insertedWebpage = urlToInsertedWebpage[e.url];
             if (!insertedWebpage) {
-              console.log(`Inserted webpage not found for URL: ${e.url}`);
+              if (!sinkEnabled) {
+                console.log(`Inserted webpage not found for URL: ${e.url}`);
+              }
               return undefined;
             }
             return {
@@ -65,8 +125,13 @@ export default async (scrapedWebpages: ScraperItem[]): Promise<void> => {
               webpage_domainId: e.domain!.id,
               webpage_discoveredById: e.discoveredBy!.id,
               webpage_responseSize: insertedWebpage.responseSize,
-              webpage_headers: e.headers || [],
-              webpage_body: e.body
+              webpage_s3Key: insertedWebpage.s3Key,
+              webpage_nearDuplicateOf: insertedWebpage.nearDuplicateOf,
+              // Items without headers or a body keep the indexed ones.
+              webpage_headers: e.headers,
+              // Bodies moved to the body store are indexed by their preview.
+              webpage_body: e.body ?? e.body_preview,
+              webpage_bodySize: e.body_size
             };
           })
           .filter((e) => e) as WebpageRecord[]
@@ -76,4 +141,5 @@ export default async (scrapedWebpages: ScraperItem[]): Promise<void> => {
       randomize: true
     }
   );
+  return unsyncedWebpages;
 };
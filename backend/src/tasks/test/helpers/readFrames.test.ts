@@ -0,0 +1,76 @@
+import { Readable } from 'stream';
+import readFrames from '../../helpers/readFrames';
+
+// Written by encode_frame() in backend/worker/webscraper/webscraper/output.py:
+// an uncompressed frame, then a gzip-compressed one.
+const FRAMES = Buffer.from(
+  'AAAAtACLo3VybLVodHRwczovL3d3dy5jaXNhLmdvdi+mc3RhdHVzzMirZG9tYWluX25hbWWsd3d3LmNpc2EuZ292rXJlc3BvbnNlX3NpemXOAAERcKdoZWFkZXJzkYKkbmFtZaZzZXJ2ZXKldmFsdWWlbmdpbnikYm9kecCpdW5jaGFuZ2Vkw6VyYXRpb8s/4AAAAAAAAKZvZmZzZXTR/tSldG90YWzPAAABAAAAAACjcmF3xAIAAQAAAFwBH4sIAHpG1WoE/2tZXFqUsyujpKSg2Epfv7y8XC85szhRLz2/TD8xKb+0ZFlxSWJJafFZximrU/JzEzPz4vMSc1PXICtckpSfUnmLUadiFBAdAgBjobPidwEAAA==',
+  'base64'
+);
+const ZSTD_FRAME = Buffer.from(
+  'AAAAJQIotS/9IBvZAACBo3VybLVodHRwczovL3d3dy5jaXNhLmdvdi8=',
+  'base64'
+);
+
+const chunks = (buffer: Buffer, size: number) => {
+  const result: Buffer[] = [];
+  for (let i = 0; i < buffer.length; i += size) {
+    result.push(buffer.subarray(i, i + size));
+  }
+  return result;
+};
+
+const read = async (stream: Readable) => {
+  const items: any[] = [];
+  await readFrames(stream, async (item) => {
+    items.push(item);
+  });
+  return items;
+};
+
+describe('readFrames', () => {
+  test('reads uncompressed and gzip frames split across chunks', async () => {
+    for (const size of [1, 7, FRAMES.length]) {
+      expect(await read(Readable.from(chunks(FRAMES, size)))).toEqual([
+        {
+          url: 'https://www.cisa.gov/',
+          status: 200,
+          domain_name: 'www.cisa.gov',
+          response_size: 70000,
+          headers: [{ name: 'server', value: 'nginx' }],
+          body: null,
+          unchanged: true,
+          ratio: 0.5,
+          offset: -300,
+          total: 2 ** 40,
+          raw: Buffer.from([0, 1])
+        },
+        {
+          url: 'https://www.cisa.gov/about',
+          status: 404,
+          domain_name: 'www.cisa.gov',
+          body: 'x'.repeat(300)
+        }
+      ]);
+    }
+  });
+  test('waits for each item to be handled', async () => {
+    const handled: string[] = [];
+    await readFrames(Readable.from(chunks(FRAMES, 7)), async (item) => {
+      await new Promise((resolve) => setTimeout(resolve, 10));
+      handled.push(item.url);
+    });
+    expect(handled).toEqual([
+      'https://www.cisa.gov/',
+      'https://www.cisa.gov/about'
+    ]);
+  });
+  test('rejects truncated and zstd frames', async () => {
+    await expect(
+      read(Readable.from([FRAMES.subarray(0, FRAMES.length - 1)]))
+    ).rejects.toThrow('Truncated frame');
+    await expect(read(Readable.from([ZSTD_FRAME]))).rejects.toThrow(
+      'zstd frames are not supported'
+    );
+  });
+});
@@ -1,4 +1,4 @@
-import { handler as webscraper } from '../webscraper';
+import { decodeBody, handler as webscraper } from '../webscraper';
 import {
   connectToDatabase,
   Organization,
@@ -10,6 +10,7 @@ import {
 import { spawn } from 'child_process';
 import { writeFileSync } from 'fs';
 import { Readable } from 'stream';
+import { gzipSync } from 'zlib';
 jest.mock('../es-client');
 
 const updateWebpages = require('../es-client').updateWebpages as jest.Mock;
@@ -113,4 +114,267 @@ describe('webscraper', () => {
       }))
     ).toMatchSnapshot();
   });
+  const createLiveDomain = async () => {
+    const domain = await Domain.create({
+      organization,
+      name: 'docs.crossfeed.cyber.dhs.gov',
+      ip: '0.0.0.0'
+    }).save();
+    await Service.create({
+      service: 'https',
+      port: 443,
+      domain
+    }).save();
+    return domain;
+  };
+  const runWebscraper = async (scanId: string, env = {}) => {
+    Object.assign(process.env, env);
+    try {
+      await webscraper({
+        organizationId: organization.id,
+        organizationName: 'organizationName',
+        scanId,
+        scanName: 'scanName',
+        scanTaskId: 'scanTaskId',
+        chunkNumber: 0,
+        numChunks: 1
+      });
+    } finally {
+      for (const key of Object.keys(env)) delete process.env[key];
+    }
+  };
+  test('runs the sharded launcher when WEBSCRAPER_WORKERS is set', async () => {
+    (spawn as jest.Mock).mockImplementationOnce(() => ({
+      stderr: Readable.from([]),
+      stdout: Readable.from([])
+    }));
+    await createLiveDomain();
+    await runWebscraper('scanId', { WEBSCRAPER_WORKERS: '4' });
+    const calls = (spawn as jest.Mock).mock.calls;
+    expect(calls[calls.length - 1].slice(0, 2)).toEqual([
+      'python',
+      [
+        '-m',
+        'webscraper.launcher',
+        '--domains-file',
+        '/app/worker/webscraper/domains.txt',
+        '--workers',
+        '4'
+      ]
+    ]);
+  });
+  test('reads frames when WEBSCRAPER_OUTPUT_MODE is frames', async () => {
+    // Written by encode_frame() in worker/webscraper/webscraper/output.py:
+    // an uncompressed frame, then a gzip-compressed one.
+    const frames = Buffer.from(
+      'AAAAiQCFpGJvZHmjYWJjp2hlYWRlcnORgqRuYW1loWGldmFsdWWhYqZzdGF0dXPMyKN1cmzZLWh0dHBzOi8vZG9jcy5jcm9zc2ZlZWQuY3liZXIuZGhzLmdvdi9mcmFtZXMvMatkb21haW5fbmFtZbxkb2NzLmNyb3NzZmVlZC5jeWJlci5kaHMuZ292AAAAdAEfiwgAqEbVagT/a12SlJ9SuTglNW15RmpiSmpR8YRlxSWJJaXFZxmnLC4tyrmpm1FSUlBspa+fkp9crJdclF9cnJaamqKXXJmUWqSXklGsl55fpp9WlJibWqxvtDolPzcxMy8+D8jdg08HAA6gVMR5AAAA',
+      'base64'
+    );
+    (spawn as jest.Mock).mockImplementationOnce(() => ({
+      stderr: Readable.from([]),
+      // Lines on stdout are only logged in this mode.
+      stdout: Readable.from([
+        'database_output: {"status": 200, "url": "https://docs.crossfeed.cyber.dhs.gov/stdout", "domain_name": "docs.crossfeed.cyber.dhs.gov"}\n'
+      ]),
+      stdio: [
+        null,
+        null,
+        null,
+        Readable.from([frames.subarray(0, 100), frames.subarray(100)])
+      ]
+    }));
+    const scan = await Scan.create({
+      name: 'webscraper',
+      arguments: {},
+      frequency: 999
+    }).save();
+    const domain = await createLiveDomain();
+    await runWebscraper(scan.id, { WEBSCRAPER_OUTPUT_MODE: 'frames' });
+    const calls = (spawn as jest.Mock).mock.calls;
+    expect(calls[calls.length - 1][2].stdio).toEqual([
+      'pipe',
+      'pipe',
+      'pipe',
+      'pipe'
+    ]);
+    const webpages = await Webpage.find({
+      where: { domain },
+      order: { url: 'ASC' }
+    });
+    expect(webpages.map((e) => [e.url, e.status])).toEqual([
+      ['https://docs.crossfeed.cyber.dhs.gov/frames/1', '200'],
+      ['https://docs.crossfeed.cyber.dhs.gov/frames/2', '404']
+    ]);
+    const records = updateWebpages.mock.calls[0][0];
+    expect(records.map((e) => [e.webpage_url, e.webpage_body])).toEqual([
+      ['https://docs.crossfeed.cyber.dhs.gov/frames/1', 'abc'],
+      ['https://docs.crossfeed.cyber.dhs.gov/frames/2', 'def']
+    ]);
+  });
+  test('only updates lastSeen for unchanged webpages', async () => {
+    (spawn as jest.Mock).mockImplementationOnce(() => ({
+      stderr: Readable.from([]),
+      stdout: Readable.from([
+        `
+database_output: {"status": 304, "url": "https://docs.crossfeed.cyber.dhs.gov/unchanged", "domain_name": "docs.crossfeed.cyber.dhs.gov", "response_size": 0, "unchanged": true}
+database_output: {"body": "new", "headers": [], "status": 200, "url": "https://docs.crossfeed.cyber.dhs.gov/changed", "domain_name": "docs.crossfeed.cyber.dhs.gov", "response_size": 3}
+`
+      ])
+    }));
+    const scan = await Scan.create({
+      name: 'webscraper',
+      arguments: {},
+      frequency: 999
+    }).save();
+    const domain = await createLiveDomain();
+    const lastSeen = new Date('2020-01-01');
+    const webpage = await Webpage.create({
+      domain,
+      discoveredBy: scan,
+      url: 'https://docs.crossfeed.cyber.dhs.gov/unchanged',
+      status: 200,
+      responseSize: 1234,
+      headers: [{ name: 'server', value: 'nginx' }],
+      lastSeen
+    }).save();
+    await runWebscraper(scan.id);
+    const updated = (await Webpage.findOne(webpage.id))!;
+    expect(updated.status).toEqual('200');
+    expect(updated.responseSize).toEqual('1234');
+    expect(updated.headers).toEqual([{ name: 'server', value: 'nginx' }]);
+    expect(updated.updatedAt).toEqual(webpage.updatedAt);
+    expect(updated.lastSeen!.getTime()).toBeGreaterThan(lastSeen.getTime());
+    // Its indexed body and headers are kept by leaving it out of the update.
+    expect(updateWebpages).toHaveBeenCalledTimes(1);
+    expect(updateWebpages.mock.calls[0][0].map((e) => e.webpage_url)).toEqual([
+      'https://docs.crossfeed.cyber.dhs.gov/changed'
+    ]);
+  });
+  test('only syncs webpages written by the database sink', async () => {
+    (spawn as jest.Mock).mockImplementationOnce(() => ({
+      stderr: Readable.from([]),
+      stdout: Readable.from([
+        `
+database_output: {"body": "present", "headers": [], "status": 500, "url": "https://docs.crossfeed.cyber.dhs.gov/present", "domain_name": "docs.crossfeed.cyber.dhs.gov", "response_size": 3}
+database_output: {"body": "late", "headers": [], "status": 404, "url": "https://docs.crossfeed.cyber.dhs.gov/late", "domain_name": "docs.crossfeed.cyber.dhs.gov", "response_size": 4}
+`
+      ])
+    }));
+    const scan = await Scan.create({
+      name: 'webscraper',
+      arguments: {},
+      frequency: 999
+    }).save();
+    const domain = await createLiveDomain();
+    const lastSeen = new Date('2020-01-01');
+    const webpage = await Webpage.create({
+      domain,
+      discoveredBy: scan,
+      url: 'https://docs.crossfeed.cyber.dhs.gov/present',
+      status: 200,
+      responseSize: 1234,
+      lastSeen
+    }).save();
+    // The sink writes the second webpage while the first batch is synced.
+    updateWebpages.mockImplementationOnce(async () => {
+      await Webpage.create({
+        domain,
+        discoveredBy: scan,
+        url: 'https://docs.crossfeed.cyber.dhs.gov/late',
+        status: 404,
+        responseSize: 4,
+        lastSeen
+      }).save();
+      return {};
+    });
+    await runWebscraper(scan.id, { WEBSCRAPER_DB_SINK: '1' });
+
+    const updated = (await Webpage.findOne(webpage.id))!;
+    expect(updated.syncedAt).toBeTruthy();
+    expect(updated.status).toEqual('200');
+    expect(updated.responseSize).toEqual('1234');
+    expect(updated.lastSeen).toEqual(lastSeen);
+    expect(updated.updatedAt).toEqual(webpage.updatedAt);
+    const late = (await Webpage.findOne({
+      where: { domain, url: 'https://docs.crossfeed.cyber.dhs.gov/late' }
+    }))!;
+    expect(late.syncedAt).toBeTruthy();
+
+    // The missing webpage is synced again once the crawl has finished.
+    expect(updateWebpages).toHaveBeenCalledTimes(2);
+    expect(
+      updateWebpages.mock.calls.map((call) =>
+        call[0].map((e) => [e.webpage_url, e.webpage_status, e.webpage_body])
+      )
+    ).toEqual([
+      [['https://docs.crossfeed.cyber.dhs.gov/present', '200', 'present']],
+      [['https://docs.crossfeed.cyber.dhs.gov/late', '404', 'late']]
+    ]);
+  });
+});
+
+describe('decodeBody', () => {
+  test('decodes a body compressed by BodyPolicyPipeline', () => {
+    // BodyPolicyPipeline(compression='gzip') in
+    // worker/webscraper/webscraper/bodypolicy.py, with compresslevel 6.
+    const item = {
+      url: 'https://docs.crossfeed.cyber.dhs.gov/',
+      status: 200,
+      domain_name: 'docs.crossfeed.cyber.dhs.gov',
+      response_size: 3000,
+      body: 'H4sIAN1G1WoA/7MpsEtOTDu8UuHRnMk2+gV2NqP8Uf4of5Q/yh/lj/JH+aP8Uf4of5RPIz4A+TAQC4AMAAA=',
+      body_encoding: 'gzip+base64'
+    };
+    expect(decodeBody(item)).toEqual({
+      url: 'https://docs.crossfeed.cyber.dhs.gov/',
+      status: 200,
+      domain_name: 'docs.crossfeed.cyber.dhs.gov',
+      response_size: 3000,
+      body: '<p>café ✓</p>'.repeat(200)
+    });
+  });
+  test('round-trips gzip and base64 encoded bodies', () => {
+    const body = '<html>' + 'crossfeed é '.repeat(10000) + '</html>';
+    const item = {
+      url: 'https://docs.crossfeed.cyber.dhs.gov/',
+      status: 200,
+      domain_name: 'docs.crossfeed.cyber.dhs.gov',
+      response_size: body.length,
+      body: gzipSync(Buffer.from(body), { level: 6 }).toString('base64'),
+      body_encoding: 'gzip+base64'
+    };
+    const decoded = decodeBody(item);
+    expect(decoded.body).toEqual(body);
+    expect(decoded.body_encoding).toBeUndefined();
+    expect(item.body_encoding).toEqual('gzip+base64');
+  });
+  test('returns items without an encoded body unchanged', () => {
+    const item = {
+      url: 'https://docs.crossfeed.cyber.dhs.gov/',
+      status: 200,
+      domain_name: 'docs.crossfeed.cyber.dhs.gov',
+      response_size: 3,
+      body: 'abc'
+    };
+    expect(decodeBody(item)).toBe(item);
+  });
+  test('logs an error for unknown encodings', () => {
+    const error = jest.spyOn(console, 'error').mockImplementation(() => {});
+    const item = {
+      url: 'https://docs.crossfeed.cyber.dhs.gov/',
+      status: 200,
+      domain_name: 'docs.crossfeed.cyber.dhs.gov',
+      response_size: 3,
+      body: 'KLUv/QBYGQAAYWJj',
+      body_encoding: 'zstd+base64'
+    };
+    try {
+      expect(decodeBody(item)).toBe(item);
+      expect(error).toHaveBeenCalledWith(
+        'Unsupported body_encoding zstd+base64 for item with url https://docs.crossfeed.cyber.dhs.gov/.'
+      );
+    } finally {
+      error.mockRestore();
+    }
+  });
 });
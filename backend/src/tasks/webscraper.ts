@@ -10,7 +10,10 @@ import { getLiveWebsites } from './helpers/getLiveWebsites';
 import { spawn } from 'child_process';
 import * as path from 'path';
 import { writeFileSync } from 'fs';
+import { Readable } from 'stream';
+import { gunzipSync } from 'zlib';
 import saveWebpagesToDb from './helpers/saveWebpagesToDb';
+import readFrames from './helpers/readFrames';
 import * as readline from 'readline';
 import PQueue from 'p-queue';
 import { chunk } from 'lodash';
@@ -28,13 +31,44 @@ export interface ScraperItem {
   domain_name: string;
   response_size: number;
 
-  body: string;
-  headers: { name: string; value: string }[];
+  // Replaced by s3_key, body_size and body_preview when a body store is
+  // configured (bodystore.py).
+  body?: string;
+  s3_key?: string;
+  body_size?: number;
+  body_preview?: string;
+  // Set by BodyPolicyPipeline (bodypolicy.py) for large or compressed bodies.
+  body_encoding?: string;
+  body_truncated?: boolean;
+  headers?: { name: string; value: string }[];
+  // Set instead of body and headers for pages that haven't changed since the
+  // last crawl (incremental.py).
+  unchanged?: boolean;
+  // Set for near-duplicate pages (neardup.py), which have no body or headers
+  // when NEARDUP_ACTION is "metadata".
+  near_duplicate_of?: string;
 
   domain?: { id: string };
   discoveredBy?: { id: string };
 }
 
+/** Decodes the body of an item compressed by BodyPolicyPipeline. */
+export const decodeBody = (item: ScraperItem): ScraperItem => {
+  if (!item.body_encoding || item.body === undefined) return item;
+  if (item.body_encoding !== 'gzip+base64') {
+    console.error(
+      `Unsupported body_encoding ${item.body_encoding} for item with url ${item.url}.`
+    );
+    return item;
+  }
+  const decoded = {
+    ...item,
+    body: gunzipSync(Buffer.from(item.body, 'base64')).toString('utf8')
+  };
+  delete decoded.body_encoding;
+  return decoded;
+};
+
 export const handler = async (commandOptions: CommandOptions) => {
   const { chunkNumber, numChunks, organizationId, scanId } = commandOptions;
 
@@ -77,17 +111,34 @@ export const handler = async (commandOptions: CommandOptions) => {
   let totalNumWebpages = 0;
   const queue = new PQueue({ concurrency: 1 });
 
+  // With WEBSCRAPER_WORKERS set, the crawl is sharded across that many
+  // scrapy processes by worker/webscraper/webscraper/launcher.py, which
+  // prints the same output as a single `scrapy crawl main`.
+  const workers = parseInt(process.env.WEBSCRAPER_WORKERS || '0');
+  const outputFrames = process.env.WEBSCRAPER_OUTPUT_MODE === 'frames';
   const scrapyProcess = spawn(
-    'scrapy',
-    ['crawl', 'main', '-a', `domains_file=${INPUT_PATH}`],
+    workers > 0 ? 'python' : 'scrapy',
+    workers > 0
+      ? [
+          '-m',
+          'webscraper.launcher',
+          '--domains-file',
+          INPUT_PATH,
+          '--workers',
+          String(workers)
+        ]
+      : ['crawl', 'main', '-a', `domains_file=${INPUT_PATH}`],
     {
       cwd: WEBSCRAPER_DIRECTORY,
       env: {
         ...process.env,
         HTTP_PROXY: process.env.GLOBAL_AGENT_HTTP_PROXY,
-        HTTPS_PROXY: process.env.GLOBAL_AGENT_HTTP_PROXY
+        HTTPS_PROXY: process.env.GLOBAL_AGENT_HTTP_PROXY,
+        // Lets the crawl resume from its checkpoint if restarted.
+        WEBSCRAPER_SCAN_ID: scanId
       },
-      stdio: 'pipe'
+      // Frames are written to fd 3, see helpers/readFrames.ts.
+      stdio: outputFrames ? ['pipe', 'pipe', 'pipe', 'pipe'] : 'pipe'
     }
   );
 
@@ -100,62 +151,102 @@ export const handler = async (commandOptions: CommandOptions) => {
     input: scrapyProcess.stderr
   });
 
+  let scrapedWebpages: ScraperItem[] = [];
+  // With the webscraper's database sink, webpages that it hadn't written
+  // yet when their batch was saved (see saveWebpagesToDb).
+  let unsyncedWebpages: ScraperItem[] = [];
+
+  const saveItem = async (item: ScraperItem) => {
+    const domain = liveWebsitesMap[item.domain_name];
+    if (!domain) {
+      console.error(
+        `No corresponding domain found for item with domain_name ${item.domain_name}.`
+      );
+      return;
+    }
+    scrapedWebpages.push({
+      ...item,
+      domain: { id: domain.id },
+      discoveredBy: { id: scanId }
+    });
+    if (scrapedWebpages.length >= WEBPAGE_DB_BATCH_LENGTH) {
+      await queue.onIdle();
+      queue.add(async () => {
+        if (scrapedWebpages.length === 0) {
+          return;
+        }
+        console.log(
+          `Saving ${scrapedWebpages.length} webpages, starting with ${scrapedWebpages[0].url}...`
+        );
+        unsyncedWebpages = unsyncedWebpages.concat(
+          await saveWebpagesToDb(scrapedWebpages)
+        );
+        totalNumWebpages += scrapedWebpages.length;
+        scrapedWebpages = [];
+      });
+    }
+  };
+
+  const saveRemainingItems = async () => {
+    await queue.onIdle();
+    if (scrapedWebpages.length > 0) {
+      console.log(
+        `Saving ${scrapedWebpages.length} webpages to the database...`
+      );
+      unsyncedWebpages = unsyncedWebpages.concat(
+        await saveWebpagesToDb(scrapedWebpages)
+      );
+      totalNumWebpages += scrapedWebpages.length;
+      scrapedWebpages = [];
+    }
+    if (unsyncedWebpages.length > 0) {
+      // The database sink has been flushed by the time scrapy exits.
+      console.log(
+        `Saving ${unsyncedWebpages.length} webpages written late by the webscraper to elasticsearch...`
+      );
+      for (const e of await saveWebpagesToDb(unsyncedWebpages)) {
+        console.error(`Webpage not found in the database for URL: ${e.url}`);
+      }
+    }
+  };
+
   await new Promise((resolve, reject) => {
     console.log('Going to save webpages to the database...');
-    let scrapedWebpages: ScraperItem[] = [];
     readInterfaceStderr.on('line', (line) =>
       console.error(line?.substring(0, 999))
     );
     readInterface.on('line', async (line) => {
-      if (!line?.trim() || line.indexOf('database_output: ') === -1) {
+      if (
+        outputFrames ||
+        !line?.trim() ||
+        line.indexOf('database_output: ') === -1
+      ) {
         console.log(line);
         return;
       }
-      const item: ScraperItem = JSON.parse(
-        line.slice(
-          line.indexOf('database_output: ') + 'database_output: '.length
+      await saveItem(
+        decodeBody(
+          JSON.parse(
+            line.slice(
+              line.indexOf('database_output: ') + 'database_output: '.length
+            )
+          )
         )
       );
-      const domain = liveWebsitesMap[item.domain_name];
-      if (!domain) {
-        console.error(
-          `No corresponding domain found for item with domain_name ${item.domain_name}.`
-        );
-        return;
-      }
-      scrapedWebpages.push({
-        ...item,
-        domain: { id: domain.id },
-        discoveredBy: { id: scanId }
-      });
-      if (scrapedWebpages.length >= WEBPAGE_DB_BATCH_LENGTH) {
-        await queue.onIdle();
-        queue.add(async () => {
-          if (scrapedWebpages.length === 0) {
-            return;
-          }
-          console.log(
-            `Saving ${scrapedWebpages.length} webpages, starting with ${scrapedWebpages[0].url}...`
-          );
-          await saveWebpagesToDb(scrapedWebpages);
-          totalNumWebpages += scrapedWebpages.length;
-          scrapedWebpages = [];
-        });
-      }
     });
 
-    readInterface.on('close', async () => {
-      await queue.onIdle();
-      if (scrapedWebpages.length > 0) {
-        console.log(
-          `Saving ${scrapedWebpages.length} webpages to the database...`
-        );
-        await saveWebpagesToDb(scrapedWebpages);
-        totalNumWebpages += scrapedWebpages.length;
-        scrapedWebpages = [];
-      }
-      resolve(undefined);
-    });
+    if (outputFrames) {
+      readFrames(scrapyProcess.stdio[3] as Readable, (item) =>
+        saveItem(decodeBody(item))
+      )
+        .then(saveRemainingItems)
+        .then(resolve, reject);
+    } else {
+      readInterface.on('close', async () => {
+        await saveRemainingItems();
+        resolve(undefined);
+      });
+    }
     readInterface.on('SIGINT', reject);
     readInterface.on('SIGCONT', reject);
     readInterface.on('SIGTSTP', reject);
@@ -0,0 +1,119 @@
+"""
+Requests-per-second benchmark of the mitmproxy SignRequests addon.
+
+Compares the previous signing path (building and preparing a requests.Request
+and signing it with HTTPSignatureHeaderAuth, which re-parses the private key
+every time) with SigningEngine inline and in thread and process pools. Each
+run signs --requests distinct URLs concurrently through SignRequests.request;
+the "repeated" run signs only --unique URLs to show the signature cache. The
+previous path is much slower, so it only signs --legacy-requests URLs.
+
+    python -m worker.benchmarks.sign_requests --requests 5000 --workers 4
+"""
+import argparse
+import asyncio
+import time
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from mitmproxy.test import tflow
+from requests_http_signature import HTTPSignatureHeaderAuth
+from ..mitmproxy_sign_requests import SignRequests
+
+
+def generate_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+def make_flows(n, unique):
+    flows = []
+    for i in range(n):
+        flow = tflow.tflow()
+        flow.request.url = "https://www.example.gov/page/%d?q=%d" % (
+            i % unique,
+            i % unique,
+        )
+        flows.append(flow)
+    return flows
+
+
+def legacy_request(signature_auth, flow):
+    """SignRequests.request before SigningEngine, for comparison."""
+    signed_request = requests.Request(
+        method=flow.request.method, url=flow.request.url, headers={}, data=None
+    ).prepare()
+    signature_auth(signed_request)
+    flow.request.headers["Signature"] = signed_request.headers["Signature"]
+    flow.request.headers["Date"] = signed_request.headers["Date"]
+
+
+def bench_legacy(private_key, flows):
+    auth = HTTPSignatureHeaderAuth(
+        key=private_key.encode(), key_id="crossfeed", algorithm="rsa-sha256"
+    )
+    start = time.perf_counter()
+    for flow in flows:
+        legacy_request(auth, flow)
+    return len(flows) / (time.perf_counter() - start)
+
+
+def bench_addon(private_key, flows, pool=None, workers=None):
+    addon = SignRequests(
+        key_id="crossfeed",
+        private_key=private_key,
+        signing_pool=pool,
+        signing_workers=workers,
+    )
+
+    async def run():
+        await asyncio.gather(*(addon.request(flow) for flow in flows))
+
+    # Warm up the pool so worker startup isn't counted.
+    asyncio.run(addon.request(tflow.tflow()))
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    addon.done()
+    return len(flows) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--unique", type=int, default=100)
+    parser.add_argument("--legacy-requests", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    private_key = generate_key()
+    flows = make_flows(args.requests, args.requests)
+    results = [
+        ("legacy", bench_legacy(private_key, flows[: args.legacy_requests])),
+        (
+            "engine inline",
+            bench_addon(private_key, make_flows(args.requests, args.requests)),
+        ),
+        (
+            "engine inline, repeated",
+            bench_addon(private_key, make_flows(args.requests, args.unique)),
+        ),
+        (
+            "engine thread pool",
+            bench_addon(private_key, flows, "thread", args.workers),
+        ),
+        (
+            "engine process pool",
+            bench_addon(private_key, flows, "process", args.workers),
+        ),
+    ]
+    for name, rps in results:
+        print("%-28s %10.0f requests/s" % (name, rps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+mitmproxy addon that serves repeated GET requests from a response cache.
+
+Scans in the same task often fetch the same pages of the same websites. When
+loaded before mitmproxy_sign_requests.py (see worker-entry.sh), this addon
+answers repeated GETs from a cache instead of going upstream again, so only
+requests that actually go upstream are signed.
+
+Responses are cached for WORKER_RESPONSE_CACHE_TTL seconds, keyed by the
+method, URL and the request headers named in the response's Vary header.
+Requests with an Authorization or Cookie header aren't cached, nor are
+responses with "Vary: *", a Set-Cookie header, "Cache-Control: no-store",
+"no-cache", "private" or a max-age of 0, or larger than
+WORKER_RESPONSE_CACHE_MAX_ENTRY_BYTES. The least recently used responses are evicted once the cache
+holds more than WORKER_RESPONSE_CACHE_MAX_BYTES of bodies, which are kept in
+memory, or in WORKER_RESPONSE_CACHE_DIR if set. The hit rate is logged every
+WORKER_RESPONSE_CACHE_LOG_EVERY lookups and when mitmproxy exits.
+
+Streamed responses can't be cached, so worker-entry.sh only streams bodies
+larger than WORKER_RESPONSE_CACHE_MAX_ENTRY_BYTES while the cache is enabled.
+
+This file is loaded as a separate mitmproxy script, so it doesn't import
+anything from the rest of the worker.
+"""
+from mitmproxy import http
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
+CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+UNCACHEABLE_DIRECTIVES = {"no-store", "no-cache", "private"}
+
+
+class CacheEntry:
+    __slots__ = ("status_code", "reason", "fields", "body", "path", "size", "expires")
+
+    def __init__(self, response, body, path, expires):
+        self.status_code = response.status_code
+        self.reason = response.reason
+        self.fields = response.headers.fields
+        self.body = body
+        self.path = path
+        self.size = len(response.raw_content)
+        self.expires = expires
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_bytes=256 * 1024 * 1024,
+        max_entry_bytes=8 * 1024 * 1024,
+        ttl=3600,
+        directory=None,
+        log_every=1000,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.ttl = ttl
+        self.directory = directory
+        self.log_every = log_every
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.entries = OrderedDict()
+        # Names of the Vary headers of the last response for each (method, URL).
+        self.vary = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    # Cache keys
+
+    def base_key(self, request):
+        return (request.method, request.url)
+
+    def key(self, request, names):
+        return self.base_key(request) + tuple(
+            request.headers.get(name, "") for name in names
+        )
+
+    def cacheable_request(self, request):
+        return (
+            request.method == "GET"
+            and "Authorization" not in request.headers
+            and "Cookie" not in request.headers
+        )
+
+    def cacheable_response(self, response):
+        directives = {}
+        for directive in response.headers.get("Cache-Control", "").split(","):
+            name, _, value = directive.partition("=")
+            directives[name.strip().lower()] = value.strip().strip('"')
+        return (
+            response.status_code in CACHEABLE_STATUSES
+            and not UNCACHEABLE_DIRECTIVES & directives.keys()
+            and directives.get("max-age") != "0"
+            and directives.get("s-maxage") != "0"
+            and "Set-Cookie" not in response.headers
+            and response.headers.get("Vary", "").strip() != "*"
+        )
+
+    # Storage
+
+    def get(self, request):
+        names = self.vary.get(self.base_key(request))
+        entry = None
+        if names is not None:
+            key = self.key(request, names)
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                self.remove(key)
+                entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        if self.log_every and (self.hits + self.misses) % self.log_every == 0:
+            self.log_stats()
+        return entry
+
+    def put(self, request, response):
+        raw = response.raw_content
+        if raw is None or len(raw) > self.max_entry_bytes:
+            return
+        names = tuple(
+            name.strip().lower()
+            for name in response.headers.get("Vary", "").split(",")
+            if name.strip()
+        )
+        self.vary[self.base_key(request)] = names
+        key = self.key(request, names)
+        self.remove(key)
+        path = None
+        body = raw
+        if self.directory:
+            path = os.path.join(
+                self.directory, hashlib.sha256(repr(key).encode()).hexdigest()
+            )
+            with open(path + ".tmp", "wb") as f:
+                f.write(raw)
+            os.replace(path + ".tmp", path)
+            body = None
+        entry = CacheEntry(response, body, path, time.monotonic() + self.ttl)
+        self.entries[key] = entry
+        self.size += entry.size
+        self.stores += 1
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        if entry.path:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def make_response(self, entry):
+        """Returns a new response with the contents of a cache entry."""
+        if entry.path:
+            with open(entry.path, "rb") as f:
+                body = f.read()
+        else:
+            body = entry.body
+        now = time.time()
+        # Not Response.make, which would recompute Content-Length from the
+        # (possibly compressed) body.
+        return http.Response(
+            b"HTTP/1.1",
+            entry.status_code,
+            entry.reason,
+            http.Headers(entry.fields),
+            body,
+            None,
+            now,
+            now,
+        )
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+    def log_stats(self):
+        logging.info(
+            "Response cache: %s" % " ".join("%s=%s" % kv for kv in self.stats().items())
+        )
+
+    def clear(self):
+        for key in list(self.entries):
+            self.remove(key)
+        self.vary.clear()
+
+    # mitmproxy hooks
+
+    def request(self, flow):
+        if flow.response or not self.cacheable_request(flow.request):
+            return
+        entry = self.get(flow.request)
+        if entry is not None:
+            flow.response = self.make_response(entry)
+            flow.metadata["response_cache"] = "hit"
+
+    def response(self, flow):
+        if (
+            flow.metadata.get("response_cache") != "hit"
+            and not flow.response.stream
+            and self.cacheable_request(flow.request)
+            and self.cacheable_response(flow.response)
+        ):
+            self.put(flow.request, flow.response)
+
+    def done(self):
+        self.log_stats()
+        self.clear()
+
+
+addons = []
+
+if os.getenv("WORKER_RESPONSE_CACHE"):
+    addons = [
+        ResponseCache(
+            max_bytes=int(
+                os.getenv("WORKER_RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+            ),
+            max_entry_bytes=int(
+                os.getenv("WORKER_RESPONSE_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)
+            ),
+            ttl=float(os.getenv("WORKER_RESPONSE_CACHE_TTL", 3600)),
+            directory=os.getenv("WORKER_RESPONSE_CACHE_DIR") or None,
+            log_every=int(os.getenv("WORKER_RESPONSE_CACHE_LOG_EVERY", 1000)),
+        )
+    ]
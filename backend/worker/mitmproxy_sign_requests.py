@@ -1,23 +1,166 @@
 """
 mitmproxy addon that signs requests and adds a Crossfeed-specific user agent.
+
+Requests are signed with an HTTP Signature header (draft-cavage-http-signatures)
+over the request target and Date header. Signing is done by SigningEngine,
+which parses the private key once, caches signatures by (method, target, Date)
+and signs in a pool of WORKER_SIGNING_WORKERS threads (or processes, if
+WORKER_SIGNING_POOL is "process") so the proxy's event loop isn't blocked.
 """
 from mitmproxy import http, ctx
+import asyncio
+import base64
+import email.utils
 import os
 import requests
 import json
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
 from requests_http_signature import HTTPSignatureHeaderAuth
 
+SIGNED_HEADERS = "(request-target) date"
+
+# Private key of the current signing process, set by _load_key.
+_private_key = None
+
+
+def _load_key(private_key):
+    global _private_key
+    _private_key = serialization.load_pem_private_key(private_key, password=None)
+
+
+def _sign(string_to_sign, key=None):
+    return (key or _private_key).sign(
+        string_to_sign, padding.PKCS1v15(), hashes.SHA256()
+    )
+
+
+def request_target(url):
+    """Returns the path and query of a URL, as used in "(request-target)"."""
+    parts = urlsplit(url)
+    return (parts.path or "/") + ("?" + parts.query if parts.query else "")
+
+
+def string_to_sign(method, target, date):
+    """Returns the signed string for the "(request-target) date" headers."""
+    return (
+        "(request-target): %s %s\ndate: %s" % (method.lower(), target, date)
+    ).encode()
+
+
+class SigningEngine:
+    """Signs requests with RSA-SHA256, caching signatures by (method, target, Date).
+
+    With pool="thread" or "process", signatures are computed by a pool of
+    `workers` threads or processes; otherwise they are computed inline.
+    """
+
+    def __init__(self, private_key, key_id, pool=None, workers=None, cache_size=4096):
+        if isinstance(private_key, str):
+            private_key = private_key.encode()
+        self.key_id = key_id
+        self.key = serialization.load_pem_private_key(private_key, password=None)
+        if pool == "process":
+            self.executor = ProcessPoolExecutor(
+                workers, initializer=_load_key, initargs=(private_key,)
+            )
+        elif pool == "thread":
+            self.executor = ThreadPoolExecutor(workers)
+        else:
+            self.executor = None
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    def header(self, signature, created):
+        return (
+            'keyId="%s",algorithm="rsa-sha256",headers="%s",signature="%s",created="%d"'
+            % (
+                self.key_id,
+                SIGNED_HEADERS,
+                base64.b64encode(signature).decode(),
+                created,
+            )
+        )
+
+    def submit(self, method, target, timestamp=None):
+        """Returns (Date header, Future of the Signature header) for a request."""
+        created = int(time.time() if timestamp is None else timestamp)
+        date = email.utils.formatdate(created, usegmt=True)
+        key = (method, target, date)
+        with self.lock:
+            future = self.cache.get(key)
+            if future is not None:
+                self.cache.move_to_end(key)
+                return date, future
+            future = self.cache[key] = Future()
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        sts = string_to_sign(method, target, date)
+        if self.executor is None:
+            self._resolve(key, future, created, lambda: _sign(sts, self.key))
+        elif isinstance(self.executor, ProcessPoolExecutor):
+            self.executor.submit(_sign, sts).add_done_callback(
+                lambda f: self._resolve(key, future, created, f.result)
+            )
+        else:
+            self.executor.submit(_sign, sts, self.key).add_done_callback(
+                lambda f: self._resolve(key, future, created, f.result)
+            )
+        return date, future
+
+    def _resolve(self, key, future, created, sign):
+        try:
+            future.set_result(self.header(sign(), created))
+        except Exception as e:
+            with self.lock:
+                self.cache.pop(key, None)
+            future.set_exception(e)
+
+    def sign(self, method, target, timestamp=None):
+        """Returns the Date and Signature headers for a request, blocking until signed."""
+        date, future = self.submit(method, target, timestamp)
+        return date, future.result()
+
+    async def sign_async(self, method, target, timestamp=None):
+        date, future = self.submit(method, target, timestamp)
+        return date, await asyncio.wrap_future(future)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
 
 class SignRequests:
-    def __init__(self, key_id="", public_key="", private_key="", user_agent=""):
+    def __init__(
+        self,
+        key_id="",
+        public_key="",
+        private_key="",
+        user_agent="",
+        signing_pool=None,
+        signing_workers=None,
+    ):
         self.key_id = key_id
         self.private_key = private_key
         self.public_key = public_key
         self.user_agent = user_agent
-        self.signature_auth = HTTPSignatureHeaderAuth(
-            key=self.private_key.encode(), key_id=key_id, algorithm="rsa-sha256"
-        )
+        self.signing_engine = None
+        if private_key:
+            self.signing_engine = SigningEngine(
+                private_key, key_id, pool=signing_pool, workers=signing_workers
+            )
+
+    def done(self):
+        if self.signing_engine:
+            self.signing_engine.close()
 
     def key_resolver(self, key_id, algorithm):
         return self.public_key.encode()
@@ -25,30 +168,30 @@ class SignRequests:
     def verify_signature(self, method, url, date, signature):
         HTTPSignatureHeaderAuth.verify(
             requests.Request(
-                method=url, url=url, headers={"date": date, "Signature": signature}
+                method=method, url=url, headers={"date": date, "Signature": signature}
             ),
             self.key_resolver,
             "Signature",
         )
 
-    def request(self, flow):
+    async def request(self, flow):
+        if flow.response:
+            # Already answered, e.g. by mitmproxy_response_cache.py, so the
+            # request won't go upstream.
+            return
         try:
             if self.user_agent:
                 flow.request.headers["User-Agent"] = self.user_agent
 
-            if self.private_key:
+            if self.signing_engine:
                 # For ease of verification, only sign the minimum attributes required: URL, date, and method.
-                signed_request = requests.Request(
-                    method=flow.request.method,
-                    url=flow.request.url,
-                    headers={},
-                    data=None,
-                ).prepare()
-                self.signature_auth.__call__(signed_request)
-                flow.request.headers["Signature"] = signed_request.headers["Signature"]
-                flow.request.headers["Date"] = signed_request.headers["Date"]
-
-                # ctx.log.info("Sent HTTP request with signature " + signed_request.headers["Signature"])
+                date, signature = await self.signing_engine.sign_async(
+                    flow.request.method, request_target(flow.request.url)
+                )
+                flow.request.headers["Signature"] = signature
+                flow.request.headers["Date"] = date
+
+                # ctx.log.info("Sent HTTP request with signature " + signature)
         except Exception as e:
             flow.response = http.HTTPResponse.make(
                 500,
@@ -99,5 +242,7 @@ else:
             public_key=os.getenv("WORKER_SIGNATURE_PUBLIC_KEY", ""),
             private_key=os.getenv("WORKER_SIGNATURE_PRIVATE_KEY", ""),
             user_agent=os.getenv("WORKER_USER_AGENT", ""),
+            signing_pool=os.getenv("WORKER_SIGNING_POOL", "thread"),
+            signing_workers=int(os.getenv("WORKER_SIGNING_WORKERS", 0)) or None,
         )
     ]
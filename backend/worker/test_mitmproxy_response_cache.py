@@ -0,0 +1,146 @@
+import asyncio
+import time
+from mitmproxy.test import taddons, tflow, tutils
+from .mitmproxy_response_cache import ResponseCache
+from .test_mitmproxy_sign_requests import private_key, public_key
+from .mitmproxy_sign_requests import SignRequests
+
+
+def fetch(cache, path="/page", headers=(), response=None):
+    """Runs a GET through the cache's hooks. Returns the flow."""
+    flow = tflow.tflow(req=tutils.treq(path=path.encode()))
+    for name, value in headers:
+        flow.request.headers[name] = value
+    cache.request(flow)
+    if flow.response is None:
+        if response is None:
+            response = tutils.tresp()
+            response.content = b"body of " + path.encode()
+        flow.response = response
+    cache.response(flow)
+    return flow
+
+
+def test_repeated_gets_are_served_from_cache():
+    cache = ResponseCache()
+    with taddons.context(cache):
+        first = fetch(cache)
+        second = fetch(cache)
+        assert "response_cache" not in first.metadata
+        assert second.metadata["response_cache"] == "hit"
+        assert second.response.content == b"body of /page"
+        assert second.response.status_code == 200
+        assert second.response.headers["header-response"] == "svalue"
+        assert second.response.headers["content-length"] == "13"
+        assert fetch(cache, "/other").metadata == {}
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 2
+        assert cache.stats()["hit_rate"] == 1 / 3
+
+
+def test_uncacheable_requests_and_responses():
+    cache = ResponseCache()
+    with taddons.context(cache):
+        fetch(cache, headers=[("Authorization", "Bearer x")])
+        assert fetch(cache, headers=[("Authorization", "Bearer x")]).metadata == {}
+
+        no_store = tutils.tresp()
+        no_store.headers["Cache-Control"] = "no-store"
+        fetch(cache, "/no-store", response=no_store)
+        assert fetch(cache, "/no-store").metadata == {}
+
+        fetch(cache, "/cookie", headers=[("Cookie", "session=x")])
+        assert fetch(cache, "/cookie", headers=[("Cookie", "session=x")]).metadata == {}
+
+        for i, (name, value) in enumerate(
+            [
+                ("Cache-Control", "private"),
+                ("Cache-Control", "public, no-cache"),
+                ("Cache-Control", "max-age=0"),
+                ("Cache-Control", 'private="Set-Cookie", max-age=60'),
+                ("Set-Cookie", "session=x"),
+            ]
+        ):
+            response = tutils.tresp()
+            response.headers[name] = value
+            fetch(cache, "/uncacheable/%d" % i, response=response)
+            assert fetch(cache, "/uncacheable/%d" % i).metadata == {}
+
+        max_age = tutils.tresp()
+        max_age.headers["Cache-Control"] = "public, max-age=60"
+        fetch(cache, "/max-age", response=max_age)
+        assert fetch(cache, "/max-age").metadata["response_cache"] == "hit"
+
+        fetch(cache, "/error", response=tutils.tresp(status_code=500))
+        assert fetch(cache, "/error").metadata == {}
+
+        post = tflow.tflow(req=tutils.treq(method=b"POST"), resp=True)
+        cache.request(post)
+        cache.response(post)
+        assert all(method == "GET" for method, *_ in cache.entries)
+
+
+def test_vary_headers_are_part_of_the_key():
+    cache = ResponseCache()
+    response = tutils.tresp(content=b"english")
+    response.headers["Vary"] = "Accept-Language"
+    with taddons.context(cache):
+        fetch(cache, headers=[("Accept-Language", "en")], response=response)
+        assert (
+            fetch(cache, headers=[("Accept-Language", "en")]).response.content
+            == b"english"
+        )
+        other = fetch(cache, headers=[("Accept-Language", "fr")])
+        assert other.metadata == {}
+        assert other.response.content == b"body of /page"
+
+
+def test_size_based_eviction(tmp_path):
+    cache = ResponseCache(max_bytes=250, max_entry_bytes=100, directory=str(tmp_path))
+    with taddons.context(cache):
+        for i in range(3):
+            fetch(cache, "/%d" % i, response=tutils.tresp(content=b"x" * 100))
+        fetch(cache, "/big", response=tutils.tresp(content=b"x" * 101))
+        assert cache.stats()["evictions"] == 1
+        assert cache.size == 200
+        assert len(list(tmp_path.iterdir())) == 2
+        assert fetch(cache, "/0").metadata == {}
+        assert fetch(cache, "/2").metadata["response_cache"] == "hit"
+        assert fetch(cache, "/big").metadata == {}
+        cache.done()
+        assert list(tmp_path.iterdir()) == []
+
+
+def test_streamed_responses_are_not_cached():
+    cache = ResponseCache()
+    with taddons.context(cache):
+        flow = tflow.tflow(resp=True)
+        flow.response.stream = True
+        cache.request(flow)
+        cache.response(flow)
+        assert not cache.entries
+
+
+def test_ttl(monkeypatch):
+    cache = ResponseCache(ttl=60)
+    with taddons.context(cache):
+        fetch(cache)
+        now = time.monotonic()
+        monkeypatch.setattr("time.monotonic", lambda: now + 61)
+        assert fetch(cache).metadata == {}
+
+
+def test_only_requests_going_upstream_are_signed():
+    cache = ResponseCache()
+    sr = SignRequests(
+        key_id="crossfeed", public_key=public_key, private_key=private_key
+    )
+    with taddons.context(cache, sr):
+        for expected in (True, False):
+            flow = tflow.tflow()
+            cache.request(flow)
+            asyncio.run(sr.request(flow))
+            assert ("Signature" in flow.request.headers) == expected
+            if flow.response is None:
+                flow.response = tutils.tresp()
+            cache.response(flow)
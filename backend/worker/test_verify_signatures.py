@@ -0,0 +1,76 @@
+import io
+import json
+import pytest
+from .mitmproxy_sign_requests import SigningEngine
+from .test_mitmproxy_sign_requests import private_key, public_key
+from .verify_signatures import (
+    KeyResolver,
+    VerificationError,
+    main,
+    read_records,
+    verify,
+    verify_records,
+)
+
+URL = "https://www.cisa.gov/page?q=1"
+
+
+@pytest.fixture(scope="module")
+def signed():
+    engine = SigningEngine(private_key, "crossfeed")
+    date, signature = engine.sign("GET", "/page?q=1")
+    return date, signature
+
+
+def test_verify(signed):
+    resolver = KeyResolver({"crossfeed": public_key})
+    verify(resolver, "GET", URL, *signed)
+    with pytest.raises(VerificationError, match="Invalid signature"):
+        verify(resolver, "GET", URL + "&r=2", *signed)
+    with pytest.raises(VerificationError, match="Invalid signature"):
+        verify(resolver, "GET", URL, "Sun, 18 Oct 2020 00:08:03 GMT", signed[1])
+    with pytest.raises(VerificationError, match="Unknown key ID"):
+        verify(KeyResolver({}), "GET", URL, *signed)
+    with pytest.raises(VerificationError, match="Malformed"):
+        verify(resolver, "GET", URL, signed[0], "garbage")
+
+
+def test_key_resolver_loads_keys_once():
+    resolver = KeyResolver({"crossfeed": public_key})
+    assert resolver("crossfeed") is resolver("crossfeed")
+
+
+def test_read_records_csv_and_json_lines(signed):
+    date, signature = signed
+    csv_stream = io.StringIO(
+        'method,url,date,signature\nGET,%s,"%s","%s"\n'
+        % (URL, date, signature.replace('"', '""'))
+    )
+    json_stream = io.StringIO(
+        json.dumps(dict(method="GET", url=URL, date=date, signature=signature)) + "\n"
+    )
+    assert list(read_records(csv_stream)) == [("GET", URL, date, signature)]
+    assert list(read_records(json_stream)) == [("GET", URL, date, signature)]
+
+
+def test_verify_records_in_order(signed):
+    records = [("GET", URL, *signed), ("POST", URL, *signed)] * 3
+    results = list(
+        verify_records(records, {"crossfeed": public_key}, workers=2, batch_size=2)
+    )
+    assert [record for record, _ in results] == records
+    assert [error for _, error in results] == [None, "Invalid signature"] * 3
+
+
+def test_cli(signed, tmp_path, capsys):
+    records = tmp_path / "records.jsonl"
+    key = tmp_path / "public.pem"
+    key.write_text(public_key)
+    records.write_text(
+        json.dumps(dict(method="GET", url=URL, date=signed[0], signature=signed[1]))
+        + "\n"
+    )
+    assert main([str(records), "--key", "crossfeed=%s" % key]) == 0
+    out, err = capsys.readouterr()
+    assert json.loads(out) == dict(method="GET", url=URL, date=signed[0], valid=True)
+    assert "1 valid" in err
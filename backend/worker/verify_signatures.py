@@ -0,0 +1,223 @@
+"""
+Verifies HTTP Signature headers added to requests by mitmproxy_sign_requests.py.
+
+Site owners who audit our traffic can send access-log records of requests that
+claim to come from Crossfeed. Each record has the request method, URL, Date
+header and Signature header, either as a CSV file with those columns
+(method,url,date,signature) or as JSON lines with those keys. Records are
+verified in parallel with a process pool, and each worker loads the public keys
+once:
+
+    python -m worker.verify_signatures records.csv --key crossfeed=public.pem
+
+Prints one JSON result per record, in order, and the throughput to stderr.
+If no --key is given, the "crossfeed" key is read from
+WORKER_SIGNATURE_PUBLIC_KEY.
+"""
+import argparse
+import base64
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+HASHES = {
+    "rsa-sha1": hashes.SHA1,
+    "rsa-sha256": hashes.SHA256,
+    "rsa-sha512": hashes.SHA512,
+}
+FIELDS = ("method", "url", "date", "signature")
+
+
+class VerificationError(Exception):
+    pass
+
+
+class KeyResolver:
+    """Loads public keys once and caches them by key ID."""
+
+    def __init__(self, pems):
+        self.pems = {
+            key_id: pem.encode() if isinstance(pem, str) else pem
+            for key_id, pem in pems.items()
+        }
+        self.keys = {}
+
+    def __call__(self, key_id):
+        key = self.keys.get(key_id)
+        if key is None:
+            if key_id not in self.pems:
+                raise VerificationError("Unknown key ID %r" % key_id)
+            key = self.keys[key_id] = serialization.load_pem_public_key(
+                self.pems[key_id]
+            )
+        return key
+
+
+def parse_signature(signature):
+    """Parses a Signature header into a dict of its parameters."""
+    params = {}
+    for part in signature.split(","):
+        name, sep, value = part.strip().partition("=")
+        if not sep:
+            raise VerificationError("Malformed Signature header")
+        params[name] = value.strip('"')
+    for name in ("keyId", "algorithm", "signature"):
+        if name not in params:
+            raise VerificationError("Signature header has no %s" % name)
+    return params
+
+
+def string_to_sign(params, method, url, date):
+    """Returns the string signed for a request, per the Signature's headers."""
+    lines = []
+    for header in params.get("headers", "date").split(" "):
+        if header == "(request-target)":
+            parts = urlsplit(url)
+            target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+            lines.append("(request-target): %s %s" % (method.lower(), target))
+        elif header == "(created)":
+            lines.append("(created): %s" % params.get("created"))
+        elif header == "date":
+            lines.append("date: %s" % date)
+        else:
+            raise VerificationError("Can't verify signed header %r" % header)
+    return "\n".join(lines).encode()
+
+
+def verify(resolver, method, url, date, signature):
+    """Raises VerificationError unless the signature is valid for the request."""
+    params = parse_signature(signature)
+    algorithm = HASHES.get(params["algorithm"])
+    if algorithm is None:
+        raise VerificationError("Unsupported algorithm %r" % params["algorithm"])
+    key = resolver(params["keyId"])
+    try:
+        key.verify(
+            base64.b64decode(params["signature"]),
+            string_to_sign(params, method, url, date),
+            padding.PKCS1v15(),
+            algorithm(),
+        )
+    except (InvalidSignature, ValueError):
+        raise VerificationError("Invalid signature")
+
+
+def read_records(stream):
+    """Yields (method, url, date, signature) tuples from a CSV or JSON lines stream."""
+    first = stream.readline()
+    lines = itertools.chain([first], stream)
+    if first.lstrip().startswith("{"):
+        for line in lines:
+            if line.strip():
+                record = json.loads(line)
+                yield tuple(record.get(f, "") for f in FIELDS)
+    else:
+        for row in csv.DictReader(lines):
+            yield tuple(row.get(f) or "" for f in FIELDS)
+
+
+# Key resolver of the current verifier process, set by _init_worker.
+_resolver = None
+
+
+def _init_worker(pems):
+    global _resolver
+    _resolver = KeyResolver(pems)
+
+
+def verify_batch(records):
+    """Verifies a batch of records with the worker's resolver."""
+    results = []
+    for record in records:
+        try:
+            verify(_resolver, *record)
+            results.append(None)
+        except VerificationError as e:
+            results.append(str(e))
+        except Exception as e:
+            results.append("Malformed record: %s" % e)
+    return results
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def verify_records(records, pems, workers=None, batch_size=500):
+    """Yields (record, error) for each record, in order; error is None if valid."""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(pems,)
+    ) as pool:
+        pending = []
+        # Keep a bounded number of batches in flight, so large files stream.
+        for batch in batches(records, batch_size):
+            pending.append((batch, pool.submit(verify_batch, batch)))
+            if len(pending) >= 2 * workers:
+                batch, future = pending.pop(0)
+                yield from zip(batch, future.result())
+        for batch, future in pending:
+            yield from zip(batch, future.result())
+
+
+def load_keys(specs):
+    """Returns {key ID: PEM} from "key_id=path" specs."""
+    if not specs:
+        return {"crossfeed": os.getenv("WORKER_SIGNATURE_PUBLIC_KEY", "")}
+    pems = {}
+    for spec in specs:
+        key_id, _, path = spec.partition("=")
+        with open(path, "rb") as f:
+            pems[key_id] = f.read()
+    return pems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Verify Crossfeed request signatures from access-log records."
+    )
+    parser.add_argument("records", help="CSV or JSON lines file, or - for stdin")
+    parser.add_argument(
+        "--key", action="append", help="public key as key_id=path.pem (repeatable)"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    stream = sys.stdin if args.records == "-" else open(args.records, newline="")
+    start = time.perf_counter()
+    total = valid = 0
+    with stream:
+        for record, error in verify_records(
+            read_records(stream), load_keys(args.key), args.workers, args.batch_size
+        ):
+            total += 1
+            valid += error is None
+            result = dict(zip(FIELDS[:3], record), valid=error is None)
+            if error:
+                result["error"] = error
+            print(json.dumps(result))
+    elapsed = time.perf_counter() - start
+    print(
+        "Verified %d records (%d valid, %d invalid) in %.2fs, %.0f records/s"
+        % (total, valid, total - valid, elapsed, total / elapsed if elapsed else 0),
+        file=sys.stderr,
+    )
+    return 0 if valid == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
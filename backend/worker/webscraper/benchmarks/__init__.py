@@ -0,0 +1,5 @@
+"""
+Benchmarks for the webscraper. Run them from backend/worker/webscraper, e.g.:
+
+    python -m benchmarks.dedup
+"""
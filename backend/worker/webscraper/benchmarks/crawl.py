@@ -0,0 +1,240 @@
+"""
+End-to-end throughput and memory benchmark of a crawl.
+
+Serves a generated site (see benchmarks/site.py) from a child process and
+crawls it with MainSpider, ExportFilePipeline and the configured item output,
+using the project settings (override them with -s NAME=VALUE). Reports
+items/s, bytes/s, peak RSS of the crawl process and latency histograms of
+each stage:
+
+    download    time from sending the request to receiving the response
+    parse       MainSpider.parse_item
+    pipeline    ExportFilePipeline.process_item, including serialization
+    serialize   writing the item to the output channel
+
+    python -m benchmarks.crawl --pages 2000 --fanout 20 --body-size 50000
+
+With --min-items-per-sec and --max-rss-mb, exits with status 1 if the crawl
+is slower or uses more memory than that, so it can be run as a CI check.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from webscraper.dedup import build_dedup
+from webscraper.metrics import Histogram
+from webscraper.output import build_output
+from webscraper.pipelines import ExportFilePipeline
+from webscraper.spiders.main_spider import MainSpider
+from benchmarks.site import add_arguments, site_from_args, start_in_process
+
+PIPELINE = "webscraper.pipelines.ExportFilePipeline"
+
+
+# Power-of-two bucket bounds, from 1us to about 18 minutes.
+BUCKETS = tuple(2**i / 1e6 for i in range(31))
+
+
+def summarize(histogram):
+    """Summarizes a metrics.Histogram of latencies.
+
+    Percentiles and the maximum are the upper bounds of their buckets, so they
+    are at most twice the actual latencies.
+    """
+    if not histogram.count:
+        return {"count": 0}
+    upper_bounds = histogram.bounds + histogram.bounds[-1:]
+
+    def percentile(p):
+        rank = min(histogram.count - 1, int(histogram.count * p))
+        cumulative = 0
+        for bound, count in zip(upper_bounds, histogram.counts):
+            cumulative += count
+            if cumulative > rank:
+                return bound
+
+    last = max(i for i, count in enumerate(histogram.counts) if count)
+    return {
+        "count": histogram.count,
+        "mean_ms": histogram.sum / histogram.count * 1000,
+        "p50_ms": percentile(0.5) * 1000,
+        "p90_ms": percentile(0.9) * 1000,
+        "p99_ms": percentile(0.99) * 1000,
+        "max_ms": upper_bounds[last] * 1000,
+        "buckets_us": {
+            round(bound * 1e6): count
+            for bound, count in zip(upper_bounds, histogram.counts)
+            if count
+        },
+    }
+
+
+STAGES = {
+    name: Histogram(BUCKETS) for name in ("download", "parse", "pipeline", "serialize")
+}
+
+
+class BenchSpider(MainSpider):
+    name = "bench"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # OffsiteMiddleware ignores allowed domains with a port, and the
+        # generated site isn't on port 80.
+        self.allowed_domains = [urlparse(url).hostname for url in self.start_urls]
+
+    def parse_item(self, response):
+        if "download_latency" in response.meta:
+            STAGES["download"].observe(response.meta["download_latency"])
+        start = time.perf_counter()
+        items = list(super().parse_item(response))
+        STAGES["parse"].observe(time.perf_counter() - start)
+        return items
+
+
+class TimedOutput:
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, item):
+        start = time.perf_counter()
+        self.output.write(item)
+        STAGES["serialize"].observe(time.perf_counter() - start)
+
+    def close(self):
+        self.output.close()
+
+
+class BenchExportFilePipeline(ExportFilePipeline):
+    @classmethod
+    def from_crawler(cls, crawler):
+        # jsonlines items are still serialized, just not printed.
+        output = build_output(crawler.settings, print=lambda line: None)
+        return cls(urls_seen=build_dedup(crawler.settings), output=TimedOutput(output))
+
+    def process_item(self, item, spider=None):
+        start = time.perf_counter()
+        try:
+            return super().process_item(item, spider)
+        finally:
+            STAGES["pipeline"].observe(time.perf_counter() - start)
+
+
+def bench_settings(overrides):
+    settings = get_project_settings()
+    settings.set("LOG_LEVEL", "WARNING")
+    settings.set("AUTOTHROTTLE_ENABLED", False)
+    settings.set("OUTPUT_TARGET", "fifo:" + os.devnull)
+    pipelines = dict(settings.getdict("ITEM_PIPELINES"))
+    pipelines["benchmarks.crawl.BenchExportFilePipeline"] = pipelines.pop(PIPELINE, 300)
+    settings.set("ITEM_PIPELINES", pipelines)
+    for override in overrides:
+        name, _, value = override.partition("=")
+        settings.set(name, value)
+    return settings
+
+
+def run(site, settings, port=0):
+    process, port = start_in_process(site, port)
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("http://127.0.0.1:%d/" % port)
+    try:
+        crawler_process = CrawlerProcess(settings, install_root_handler=False)
+        crawler = crawler_process.create_crawler(BenchSpider)
+        crawler_process.crawl(crawler, domains_file=f.name)
+        start = time.perf_counter()
+        crawler_process.start()
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        os.unlink(f.name)
+
+    stats = crawler.stats.get_stats()
+    items = stats.get("item_scraped_count", 0)
+    response_bytes = stats.get("downloader/response_bytes", 0)
+    return {
+        "pages": site.pages,
+        "items": items,
+        "seconds": elapsed,
+        "items_per_sec": items / elapsed,
+        "bytes_per_sec": response_bytes / elapsed,
+        "response_bytes": response_bytes,
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": {name: summarize(h) for name, h in STAGES.items()},
+    }
+
+
+def print_report(report):
+    print(
+        "%d/%d items in %.2fs: %.0f items/s, %.2f MB/s, peak RSS %.1f MB"
+        % (
+            report["items"],
+            report["pages"],
+            report["seconds"],
+            report["items_per_sec"],
+            report["bytes_per_sec"] / 1e6,
+            report["peak_rss_mb"],
+        )
+    )
+    print(
+        "%-10s %8s %10s %10s %10s %10s"
+        % ("stage", "count", "p50 ms", "p90 ms", "p99 ms", "max ms")
+    )
+    for name, s in report["stages"].items():
+        if not s["count"]:
+            continue
+        print(
+            "%-10s %8d %10.3f %10.3f %10.3f %10.3f"
+            % (name, s["count"], s["p50_ms"], s["p90_ms"], s["p99_ms"], s["max_ms"])
+        )
+        print(
+            "%-10s %s"
+            % ("", " ".join("<%dus:%d" % b for b in sorted(s["buckets_us"].items())))
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    parser.add_argument("-s", dest="settings", action="append", default=[])
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=0,
+        help="Serve the site on this port, e.g. to replay a crawl recorded with "
+        "WEBSCRAPER_WARC_RECORD_DIR using WEBSCRAPER_WARC_REPLAY_DIR",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--min-items-per-sec", type=float, default=0)
+    parser.add_argument("--max-rss-mb", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    report = run(site_from_args(args), bench_settings(args.settings), args.port)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+
+    failures = []
+    if args.min_items_per_sec and report["items_per_sec"] < args.min_items_per_sec:
+        failures.append("items/s below %s" % args.min_items_per_sec)
+    if args.max_rss_mb and report["peak_rss_mb"] > args.max_rss_mb:
+        failures.append("peak RSS above %s MB" % args.max_rss_mb)
+    for failure in failures:
+        print("FAIL: " + failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    # Run the imported module, so that Scrapy loads BenchExportFilePipeline
+    # from the same module that the report is read from.
+    from benchmarks import crawl
+
+    sys.exit(crawl.main())
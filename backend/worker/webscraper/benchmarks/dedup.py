@@ -0,0 +1,88 @@
+"""
+Measures memory per URL and throughput of each URL deduplication backend.
+
+    python -m benchmarks.dedup --urls 1000000
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from webscraper.dedup import (
+    DiskDedup,
+    FingerprintDedup,
+    ScalableBloomDedup,
+    SetDedup,
+)
+
+BACKENDS = {
+    "set": SetDedup,
+    "fingerprint": FingerprintDedup,
+    "bloom": ScalableBloomDedup,
+    "disk": lambda: DiskDedup(memory_entries=1 << 16),
+}
+
+
+def generate_urls(count):
+    for i in range(count):
+        yield "https://subdomain%d.example.gov/path/to/page-%d?query=%d" % (
+            i % 1000,
+            i,
+            i * 7,
+        )
+
+
+def run(name, count):
+    tracemalloc.start()
+    dedup = BACKENDS[name]()
+    start = time.perf_counter()
+    for url in generate_urls(count):
+        if url not in dedup:
+            dedup.add(url)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    disk = os.path.getsize(dedup.path) if isinstance(dedup, DiskDedup) else 0
+    dedup.close()
+    return {
+        "backend": name,
+        "urls": count,
+        "bytes_per_url": current / count,
+        "peak_bytes_per_url": peak / count,
+        "disk_bytes_per_url": disk / count,
+        "urls_per_sec": count / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--urls", type=int, default=200000)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    args = parser.parse_args()
+    print(
+        "%-12s %10s %14s %14s %14s %12s"
+        % (
+            "backend",
+            "urls",
+            "bytes/url",
+            "peak bytes/url",
+            "disk bytes/url",
+            "urls/sec",
+        )
+    )
+    for name in args.backends:
+        r = run(name, args.urls)
+        print(
+            "%-12s %10d %14.1f %14.1f %14.1f %12.0f"
+            % (
+                r["backend"],
+                r["urls"],
+                r["bytes_per_url"],
+                r["peak_bytes_per_url"],
+                r["disk_bytes_per_url"],
+                r["urls_per_sec"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
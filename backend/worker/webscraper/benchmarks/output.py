@@ -0,0 +1,99 @@
+"""
+Compares the throughput of the "jsonlines" and "frames" item output modes,
+including the cost of decoding the items again on the consumer side.
+
+    python -m benchmarks.output --items 20000 --body-size 50000
+"""
+import argparse
+import json
+import time
+from io import BytesIO
+from webscraper.output import FrameOutput, JsonLinesOutput, read_frames
+
+
+class UnclosableBytesIO(BytesIO):
+    def close(self):
+        pass
+
+
+def generate_items(count, body_size):
+    body = ("<p>Lorem ipsum dolor sit amet %d</p>\n" * (body_size // 36 + 1))[
+        :body_size
+    ]
+    for i in range(count):
+        yield {
+            "status": 200,
+            "url": "https://www.example.gov/page/%d" % i,
+            "domain_name": "www.example.gov",
+            "body": body,
+            "response_size": body_size,
+            "headers": [
+                {"name": "Content-Type", "value": "text/html; charset=UTF-8"},
+                {"name": "Server", "value": "Apache"},
+            ],
+        }
+
+
+def bench_jsonlines(items):
+    stream = UnclosableBytesIO()
+    output = JsonLinesOutput(lambda line: stream.write((line + "\n").encode()))
+    start = time.perf_counter()
+    for item in items:
+        output.write(item)
+    encoded = time.perf_counter()
+    stream.seek(0)
+    prefix = "database_output: "
+    for line in stream:
+        line = line.decode()
+        if prefix in line:
+            json.loads(line[line.index(prefix) + len(prefix) :])
+    decoded = time.perf_counter()
+    return encoded - start, decoded - encoded, len(stream.getvalue())
+
+
+def bench_frames(items, compression):
+    stream = UnclosableBytesIO()
+    output = FrameOutput(stream, compression=compression)
+    start = time.perf_counter()
+    for item in items:
+        output.write(item)
+    encoded = time.perf_counter()
+    stream.seek(0)
+    for _ in read_frames(stream):
+        pass
+    decoded = time.perf_counter()
+    return encoded - start, decoded - encoded, len(stream.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--body-size", type=int, default=20000)
+    args = parser.parse_args()
+    items = list(generate_items(args.items, args.body_size))
+    modes = {
+        "jsonlines": lambda: bench_jsonlines(items),
+        "frames": lambda: bench_frames(items, None),
+        "frames+gzip": lambda: bench_frames(items, "gzip"),
+        "frames+zstd": lambda: bench_frames(items, "zstd"),
+    }
+    print(
+        "%-12s %14s %14s %14s %12s"
+        % ("mode", "encode items/s", "decode items/s", "total items/s", "MB written")
+    )
+    for name, bench in modes.items():
+        encode, decode, size = bench()
+        print(
+            "%-12s %14.0f %14.0f %14.0f %12.1f"
+            % (
+                name,
+                args.items / encode,
+                args.items / decode,
+                args.items / (encode + decode),
+                size / 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
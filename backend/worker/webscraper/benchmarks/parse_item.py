@@ -0,0 +1,136 @@
+"""
+Micro-benchmark of MainSpider.parse_item over a corpus of responses.
+
+By default a synthetic corpus of HTML, JSON, non-UTF-8 and binary responses is
+used. Pass --corpus with a directory of recorded raw HTTP responses (status
+line, headers, blank line, body) to benchmark real pages instead. The previous
+implementation of parse_item is timed alongside for comparison; note that it
+returns "<binary>" for text in encodings other than UTF-8, so it is faster but
+wrong on those responses.
+
+    python -m benchmarks.parse_item --corpus path/to/responses --repeat 20
+"""
+import argparse
+import os
+import time
+from tempfile import NamedTemporaryFile
+from urllib.parse import urlparse
+from scrapy.http import Headers, Request
+from scrapy.responsetypes import responsetypes
+from webscraper.spiders.main_spider import MainSpider
+
+HEADERS = {
+    "Server": "Apache",
+    "X-Content-Type-Options": "nosniff",
+    "Cache-Control": "private, no-cache, must-revalidate",
+    "Date": "Sun, 18 Oct 2020 00:08:03 GMT",
+    "Strict-Transport-Security": "max-age=31536000 ; includeSubDomains",
+    "Vary": "Accept-Encoding",
+    "Set-Cookie": ["a=1; path=/", "b=2; path=/"],
+}
+
+
+def make_response(url, headers, body):
+    headers = Headers(headers)
+    cls = responsetypes.from_args(headers=headers, url=url, body=body)
+    return cls(url=url, headers=headers, body=body, request=Request(url))
+
+
+def synthetic_corpus():
+    html = ("<p>Lorem ipsum <a href='/page'>dolor</a> sit amet</p>\n" * 2000).encode()
+    yield make_response(
+        "https://www.example.gov/",
+        dict(HEADERS, **{"Content-Type": "text/html; charset=UTF-8"}),
+        html,
+    )
+    yield make_response(
+        "https://www.example.gov/latin1",
+        dict(HEADERS, **{"Content-Type": "text/html; charset=ISO-8859-1"}),
+        html.replace(b"Lorem", b"Lor\xe9m"),
+    )
+    yield make_response(
+        "https://www.example.gov/api",
+        dict(HEADERS, **{"Content-Type": "application/json"}),
+        b'{"items": [' + b",".join(b'{"id": %d}' % i for i in range(5000)) + b"]}",
+    )
+    yield make_response(
+        "https://www.example.gov/report.pdf",
+        dict(HEADERS, **{"Content-Type": "application/pdf"}),
+        b"%PDF-1.4\n" + os.urandom(200000),
+    )
+
+
+def load_corpus(directory):
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as f:
+            raw = f.read()
+        head, _, body = raw.partition(b"\r\n\r\n")
+        lines = head.split(b"\r\n")
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(b":")
+            headers.setdefault(key.strip(), []).append(value.strip())
+        yield make_response("https://recorded.example.gov/" + name, headers, body)
+
+
+def legacy_parse_item(response):
+    """parse_item before content-type-aware decoding, for comparison."""
+    try:
+        body_decoded = response.body.decode()
+    except UnicodeDecodeError:
+        body_decoded = "<binary>"
+
+    headers = []
+    for name, values in response.headers.items():
+        for value in values:
+            headers.append({"name": name.decode(), "value": value.decode()})
+
+    return dict(
+        status=response.status,
+        url=response.url,
+        domain_name=urlparse(response.url).netloc,
+        body=body_decoded,
+        response_size=len(response.body),
+        headers=headers,
+    )
+
+
+def bench(parse, response, repeat):
+    """Returns the average time in microseconds to parse the given response."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse(response)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", help="directory of recorded raw HTTP responses")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with NamedTemporaryFile() as f:
+        spider = MainSpider(domains_file=f.name)
+    corpus = list(load_corpus(args.corpus) if args.corpus else synthetic_corpus())
+
+    def current(response):
+        # Copy the response so the decoded body cached by TextResponse isn't reused.
+        return list(spider.parse_item(response.replace()))
+
+    def legacy(response):
+        return legacy_parse_item(response.replace())
+
+    print("%-48s %12s %12s" % ("response", "legacy us", "current us"))
+    totals = [0, 0]
+    for response in corpus:
+        times = [
+            bench(legacy, response, args.repeat),
+            bench(current, response, args.repeat),
+        ]
+        totals = [t + u for t, u in zip(totals, times)]
+        print("%-48s %12.1f %12.1f" % (response.url[:48], *times))
+    print("%-48s %12.1f %12.1f" % ("total", *totals))
+
+
+if __name__ == "__main__":
+    main()
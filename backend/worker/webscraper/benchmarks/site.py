@@ -0,0 +1,136 @@
+"""
+Local stand-in website for crawl benchmarks.
+
+Serves a deterministic site of `pages` pages on 127.0.0.1, as a tree rooted at
+/ (page 0) in which every HTML page links to `fanout` more pages. About
+`binary_ratio` of the pages are binary downloads (application/octet-stream,
+without a file extension, so that the link extractor doesn't skip them)
+instead of HTML, and every page body is about `body_size` bytes. robots.txt
+returns 404.
+
+    python -m benchmarks.site --pages 1000 --fanout 10 --port 8000
+"""
+import argparse
+import multiprocessing
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER = "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n"
+
+
+class Site:
+    def __init__(
+        self, pages=1000, fanout=10, body_size=20000, binary_ratio=0.1, seed=0
+    ):
+        self.pages = pages
+        self.fanout = fanout
+        self.body_size = body_size
+        rng = random.Random(seed)
+        # The root page is always HTML, so the crawl can start.
+        self.binary = {i for i in range(1, pages) if rng.random() < binary_ratio}
+        # Binary pages have no links, so the kth HTML page links to pages
+        # k * fanout + 1 ... k * fanout + fanout.
+        self.html_index = {}
+        for i in range(pages):
+            if i not in self.binary:
+                self.html_index[i] = len(self.html_index)
+        self.binary_body = bytes(rng.getrandbits(8) for _ in range(body_size))
+        self.filler = (FILLER * (body_size // len(FILLER) + 1))[:body_size]
+
+    def path(self, i):
+        if i == 0:
+            return "/"
+        return "/file/%d" % i if i in self.binary else "/page/%d.html" % i
+
+    def render(self, path):
+        """Returns (status, content type, body) for a path."""
+        if path == "/":
+            i = 0
+        else:
+            try:
+                kind, name = path.strip("/").split("/")
+                i = int(name.split(".")[0])
+            except ValueError:
+                return 404, "text/plain", b"Not found"
+            if not 0 < i < self.pages or path != self.path(i):
+                return 404, "text/plain", b"Not found"
+        if i in self.binary:
+            return 200, "application/octet-stream", self.binary_body
+        k = self.html_index[i]
+        children = range(
+            k * self.fanout + 1, min((k + 1) * self.fanout + 1, self.pages)
+        )
+        links = "".join(
+            '<a href="%s">page %d</a>\n' % (self.path(c), c) for c in children
+        )
+        body = "<html><head><title>Page %d</title></head><body>\n%s%s</body></html>" % (
+            i,
+            links,
+            self.filler,
+        )
+        return 200, "text/html; charset=utf-8", body.encode()
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            status, content_type, body = site.render(self.path)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The crawler stops binary downloads once the headers arrive.
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(site, port=0, ready=None):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(site))
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_in_process(site, port=0):
+    """Serves the site from a child process. Returns (process, port)."""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve, args=(site, port, ready), daemon=True
+    )
+    process.start()
+    return process, ready.get(timeout=10)
+
+
+def add_arguments(parser):
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--body-size", type=int, default=20000)
+    parser.add_argument("--binary-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def site_from_args(args):
+    return Site(args.pages, args.fanout, args.body_size, args.binary_ratio, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    print("Serving on http://127.0.0.1:%d/" % args.port)
+    serve(site_from_args(args), args.port)
+
+
+if __name__ == "__main__":
+    main()
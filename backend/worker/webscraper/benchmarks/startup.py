@@ -0,0 +1,171 @@
+"""
+Per-chunk startup cost of `scrapy crawl main` compared to the crawl daemon.
+
+Serves a generated site (see benchmarks/site.py) from a child process, splits
+its pages into chunks of --urls-per-chunk start URLs, and crawls each chunk:
+
+    cold    in a new `scrapy crawl main` process, as webscraper.ts does
+    warm    as a job of a single `python -m webscraper.daemon` process,
+            started once before the first chunk
+
+Chunks are crawled one after the other in both modes. Since the site isn't on
+port 80, OffsiteMiddleware drops the links between its pages, so each chunk
+crawls exactly its start URLs. Also reports how long Python takes to start
+and import the crawl stack, which is part of the cost of every cold chunk:
+
+    python -m benchmarks.startup --chunks 5 --urls-per-chunk 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.site import Site, start_in_process
+
+WEBSCRAPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTS = "import scrapy.crawler, webscraper.daemon"
+
+
+def timed(command):
+    start = time.perf_counter()
+    result = subprocess.run(
+        command,
+        cwd=WEBSCRAPER_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - start, result.stdout
+
+
+def setting_args(settings):
+    return [arg for setting in settings for arg in ("-s", setting)]
+
+
+def crawl_cold(chunks, settings, directory):
+    times, items = [], 0
+    for i, urls in enumerate(chunks):
+        path = "%s/domains-%d.txt" % (directory, i)
+        with open(path, "w") as f:
+            f.write("\n".join(urls))
+        seconds, output = timed(
+            [sys.executable, "-m", "scrapy", "crawl", "main"]
+            + ["-a", "domains_file=%s" % path]
+            + setting_args(settings)
+        )
+        times.append(seconds)
+        items += output.count(b"database_output: ")
+    return times, items
+
+
+def crawl_warm(chunks, settings):
+    start = time.perf_counter()
+    daemon = subprocess.Popen(
+        [sys.executable, "-m", "webscraper.daemon"] + setting_args(settings),
+        cwd=WEBSCRAPER_DIR,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    messages = (json.loads(line) for line in daemon.stdout)
+    assert next(messages)["type"] == "ready"
+    startup = time.perf_counter() - start
+
+    times, items = [], 0
+    for i, urls in enumerate(chunks):
+        start = time.perf_counter()
+        job = {"type": "crawl", "job_id": str(i), "domains": urls}
+        daemon.stdin.write(json.dumps(job).encode() + b"\n")
+        daemon.stdin.flush()
+        for message in messages:
+            if message["type"] == "item":
+                items += 1
+            elif message["type"] == "error":
+                raise RuntimeError(message["error"])
+            elif message["type"] == "done":
+                break
+        times.append(time.perf_counter() - start)
+    daemon.stdin.close()
+    daemon.wait()
+    return startup, times, items
+
+
+def run(chunks, settings, directory):
+    python, _ = timed([sys.executable, "-c", "pass"])
+    imports, _ = timed([sys.executable, "-c", IMPORTS])
+    cold, cold_items = crawl_cold(chunks, settings, directory)
+    daemon_startup, warm, warm_items = crawl_warm(chunks, settings)
+    cold_mean = sum(cold) / len(cold)
+    warm_mean = sum(warm) / len(warm)
+    return {
+        "chunks": len(chunks),
+        "urls_per_chunk": len(chunks[0]),
+        "python_seconds": python,
+        "import_seconds": imports - python,
+        "daemon_startup_seconds": daemon_startup,
+        "cold_items": cold_items,
+        "warm_items": warm_items,
+        "cold_seconds_per_chunk": cold_mean,
+        "warm_seconds_per_chunk": warm_mean,
+        "saved_seconds_per_chunk": cold_mean - warm_mean,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=5)
+    parser.add_argument("--urls-per-chunk", type=int, default=20)
+    parser.add_argument("--body-size", type=int, default=20000)
+    parser.add_argument("-s", dest="settings", action="append", default=[])
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    pages = args.chunks * args.urls_per_chunk
+    site = Site(pages=pages + 1, fanout=1, body_size=args.body_size, binary_ratio=0)
+    process, port = start_in_process(site)
+    chunks = [
+        [
+            "http://127.0.0.1:%d%s" % (port, site.path(i))
+            for i in range(start, start + args.urls_per_chunk)
+        ]
+        for start in range(1, pages + 1, args.urls_per_chunk)
+    ]
+    settings = ["LOG_LEVEL=WARNING", "AUTOTHROTTLE_ENABLED=False"] + args.settings
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            report = run(chunks, settings, directory)
+    finally:
+        process.terminate()
+
+    if args.json:
+        print(json.dumps(report))
+        return 0
+    print(
+        "Python startup %.3fs, imports %.3fs, daemon startup %.3fs"
+        % (
+            report["python_seconds"],
+            report["import_seconds"],
+            report["daemon_startup_seconds"],
+        )
+    )
+    print(
+        "%d chunks of %d URLs: %.3fs per chunk cold (%d items), "
+        "%.3fs warm (%d items), %.3fs saved per chunk"
+        % (
+            report["chunks"],
+            report["urls_per_chunk"],
+            report["cold_seconds_per_chunk"],
+            report["cold_items"],
+            report["warm_seconds_per_chunk"],
+            report["warm_items"],
+            report["saved_seconds_per_chunk"],
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from benchmarks.site import Site
+
+WEBSCRAPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_site_pages_are_reachable():
+    site = Site(pages=200, fanout=3, body_size=1000, binary_ratio=0.3)
+    seen, queue = set(), ["/"]
+    while queue:
+        path = queue.pop()
+        status, content_type, body = site.render(path)
+        assert status == 200
+        seen.add(path)
+        if content_type.startswith("text/html"):
+            assert len(body) > 1000
+            queue.extend(re.findall(r'href="([^"]+)"', body.decode()))
+    assert seen == {site.path(i) for i in range(200)}
+    assert site.render("/page/1000.html")[0] == 404
+    assert site.render("/page/%d.html" % min(site.binary))[0] == 404
+
+
+def test_crawl_benchmark_smoke():
+    # Twisted's reactor can only be started once per process.
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.crawl",
+            "--pages=40",
+            "--fanout=5",
+            "--body-size=2000",
+            "--json",
+            "--max-rss-mb=4096",
+        ],
+        cwd=WEBSCRAPER_DIR,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report["items"] == 40
+    assert report["items_per_sec"] > 0
+    assert report["peak_rss_mb"] > 0
+    for stage in ("download", "parse", "pipeline", "serialize"):
+        assert report["stages"][stage]["count"] == 40
@@ -0,0 +1,27 @@
+import json
+import subprocess
+import sys
+from benchmarks.startup import WEBSCRAPER_DIR
+
+
+def test_startup_benchmark_smoke():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.startup",
+            "--chunks=2",
+            "--urls-per-chunk=3",
+            "--body-size=1000",
+            "--json",
+        ],
+        cwd=WEBSCRAPER_DIR,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report["cold_items"] == report["warm_items"] == 6
+    assert report["cold_seconds_per_chunk"] > 0
+    assert report["warm_seconds_per_chunk"] > 0
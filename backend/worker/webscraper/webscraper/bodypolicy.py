@@ -0,0 +1,133 @@
+"""
+Size limits and encoding for the page bodies that go out with items.
+
+Without a limit, a 50 MB page becomes a 50 MB output line that webscraper.ts
+has to buffer, and ends up in an Elasticsearch bulk request. BodyPolicyPipeline
+runs after BodyStorePipeline, so it only sees bodies that are sent inline, and:
+
+- truncates bodies larger than BODY_MAX_SIZE bytes (UTF-8 encoded) to their
+  first and last bytes, keeping BODY_TRUNCATE_TAIL bytes from the end, joined
+  by a marker that says how many bytes were removed, and sets
+  `body_truncated`;
+- if BODY_COMPRESSION is "gzip", compresses bodies of at least
+  BODY_COMPRESSION_MIN_SIZE bytes and base64 encodes them, and sets
+  `body_encoding` to "gzip+base64", which webscraper.ts decodes. Bodies
+  without `body_encoding` are plain text.
+
+`response_size` is left alone, so it's always the size of the real response.
+
+The sizes of all bodies seen, including those replaced by BodyStorePipeline,
+are counted in the "bodypolicy/size/<=<bytes>" stats, and logged when the
+spider closes.
+"""
+import base64
+import gzip
+import logging
+from bisect import bisect_left
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+SIZE_BUCKETS = tuple(1024 * 4**i for i in range(9))  # 1 KiB ... 64 MiB
+TRUNCATION_MARKER = "\n<!-- crossfeed: truncated %d bytes -->\n"
+ENCODINGS = {"gzip": "gzip+base64"}
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return "%d%s" % (size, unit)
+        size //= 1024
+    return "%dGiB" % size
+
+
+BUCKET_NAMES = ["<=%s" % format_size(b) for b in SIZE_BUCKETS] + ["more"]
+
+
+def truncate(data, max_size, tail_size):
+    """Returns (text, removed bytes) for UTF-8 data cut down to about max_size bytes."""
+    # The marker for len(data) is at least as long as the one actually used.
+    marker_size = len(TRUNCATION_MARKER % len(data))
+    tail_size = min(tail_size, max_size // 2)
+    head_size = max(0, max_size - marker_size - tail_size)
+    removed = len(data) - head_size - tail_size
+    head = data[:head_size].decode("utf-8", "ignore")
+    tail = data[len(data) - tail_size :].decode("utf-8", "ignore") if tail_size else ""
+    return head + TRUNCATION_MARKER % removed + tail, removed
+
+
+class BodyPolicyPipeline:
+    def __init__(
+        self,
+        max_size=0,
+        tail_size=65536,
+        compression=None,
+        compression_min_size=1024,
+        stats=None,
+    ):
+        if compression and compression not in ENCODINGS:
+            raise ValueError("Unknown BODY_COMPRESSION: %s" % compression)
+        self.max_size = max_size
+        self.tail_size = tail_size
+        self.compression = compression
+        self.compression_min_size = compression_min_size
+        self.stats = stats
+        self.sizes = [0] * (len(SIZE_BUCKETS) + 1)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("BODY_POLICY_ENABLED"):
+            raise NotConfigured
+        return cls(
+            max_size=settings.getint("BODY_MAX_SIZE", 0),
+            tail_size=settings.getint("BODY_TRUNCATE_TAIL", 65536),
+            compression=settings.get("BODY_COMPRESSION") or None,
+            compression_min_size=settings.getint("BODY_COMPRESSION_MIN_SIZE", 1024),
+            stats=crawler.stats,
+        )
+
+    def process_item(self, item, spider=None):
+        body = item.get("body")
+        if body is None:
+            if "body_size" in item:
+                self.observe(item["body_size"])
+            return item
+        data = body.encode()
+        self.observe(len(data))
+        if self.max_size and len(data) > self.max_size:
+            body, removed = truncate(data, self.max_size, self.tail_size)
+            data = body.encode()
+            item["body_truncated"] = True
+            self._inc_stat("bodypolicy/truncated")
+            self._inc_stat("bodypolicy/truncated_bytes", removed)
+        if self.compression and len(data) >= self.compression_min_size:
+            compressed = gzip.compress(data, compresslevel=6)
+            body = base64.b64encode(compressed).decode("ascii")
+            item["body_encoding"] = ENCODINGS[self.compression]
+            self._inc_stat("bodypolicy/compressed")
+            self._inc_stat("bodypolicy/compression_saved_bytes", len(data) - len(body))
+        item["body"] = body
+        return item
+
+    def observe(self, size):
+        i = bisect_left(SIZE_BUCKETS, size)
+        self.sizes[i] += 1
+        if self.stats:
+            self.stats.inc_value("bodypolicy/size/%s" % BUCKET_NAMES[i])
+            self.stats.max_value("bodypolicy/max_size", size)
+
+    def size_distribution(self):
+        """Returns [(bucket name, count)] for the non-empty buckets."""
+        return [(name, n) for name, n in zip(BUCKET_NAMES, self.sizes) if n]
+
+    def close_spider(self, spider=None):
+        distribution = self.size_distribution()
+        if distribution:
+            logger.info(
+                "Body sizes: %s", " ".join("%s:%d" % bucket for bucket in distribution)
+            )
+
+    def _inc_stat(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count)
@@ -0,0 +1,149 @@
+"""
+Content-addressed storage for page bodies.
+
+BodyStorePipeline writes each item's body to a store keyed by its SHA-256 and
+replaces the body with a reference, so that multi-MB pages don't have to go
+through stdout, Node and Elasticsearch. Identical bodies, across URLs and
+across scans, are stored once.
+
+The store is given by BODY_STORE_URI, one of:
+
+    file:///path/to/dir       a local directory
+    s3://bucket/prefix        an S3-compatible bucket (minio when running locally)
+"""
+import hashlib
+import os
+import tempfile
+from urllib.parse import urlparse
+from scrapy.exceptions import NotConfigured
+
+
+class LocalBodyStore:
+    """Stores bodies as files in a local directory, sharded by key prefix."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so that readers never see partial bodies.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+
+class S3BodyStore:
+    """Stores bodies as objects in an S3-compatible bucket."""
+
+    def __init__(self, bucket, prefix="", client=None, endpoint_url=None):
+        if client is None:
+            import boto3
+
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def object_key(self, key):
+        return "%s/%s" % (self.prefix, key) if self.prefix else key
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except self.client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data)
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))[
+            "Body"
+        ].read()
+
+
+def build_body_store(uri, endpoint_url=None):
+    """Builds the body store for the given BODY_STORE_URI."""
+    parsed = urlparse(uri)
+    if parsed.scheme == "file":
+        return LocalBodyStore(parsed.path)
+    if parsed.scheme == "s3":
+        return S3BodyStore(parsed.netloc, parsed.path, endpoint_url=endpoint_url)
+    raise ValueError("Unknown BODY_STORE_URI: %s" % uri)
+
+
+class BodyStorePipeline:
+    """Replaces item bodies with references to a content-addressed store.
+
+    The body is replaced by `s3_key` (the SHA-256 of the UTF-8 encoded body),
+    `body_size` (its size in bytes) and, if BODY_PREVIEW_LENGTH is set,
+    `body_preview` (its first BODY_PREVIEW_LENGTH characters).
+    """
+
+    def __init__(self, store, preview_length=0, known_keys_limit=100000, stats=None):
+        self.store = store
+        self.stats = stats
+        self.preview_length = preview_length
+        self.known_keys_limit = known_keys_limit
+        # Keys known to be in the store, so repeated bodies skip the existence check.
+        self.known_keys = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        uri = settings.get("BODY_STORE_URI")
+        if not uri:
+            raise NotConfigured
+        store = build_body_store(uri, settings.get("BODY_STORE_S3_ENDPOINT_URL"))
+        return cls(
+            store,
+            preview_length=settings.getint("BODY_PREVIEW_LENGTH", 0),
+            known_keys_limit=settings.getint("BODY_STORE_KNOWN_KEYS_LIMIT", 100000),
+            stats=crawler.stats,
+        )
+
+    def process_item(self, item, spider=None):
+        body = item.get("body")
+        if body is None:
+            return item
+        data = body.encode()
+        key = hashlib.sha256(data).hexdigest()
+        if key not in self.known_keys:
+            if self.store.exists(key):
+                self._inc_stat("bodystore/existing")
+            else:
+                self.store.put(key, data)
+                self._inc_stat("bodystore/stored")
+                self._inc_stat("bodystore/stored_bytes", len(data))
+            if len(self.known_keys) >= self.known_keys_limit:
+                self.known_keys.clear()
+            self.known_keys.add(key)
+        else:
+            self._inc_stat("bodystore/existing")
+
+        del item["body"]
+        item["s3_key"] = key
+        item["body_size"] = len(data)
+        if self.preview_length:
+            item["body_preview"] = body[: self.preview_length]
+        return item
+
+    def _inc_stat(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count)
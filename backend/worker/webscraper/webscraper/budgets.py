@@ -0,0 +1,171 @@
+"""
+Per-domain crawl budgets.
+
+DomainBudgetMiddleware stops crawling a domain from domains_file once it
+reaches any of these limits (0 means no limit):
+
+    DOMAIN_MAX_PAGES     responses downloaded
+    DOMAIN_MAX_DEPTH     link depth from the start URL
+    DOMAIN_MAX_BYTES     response bytes downloaded
+    DOMAIN_MAX_SECONDS   seconds since the domain's first request
+
+Subdomains count towards the domain they were reached from. Per-domain stats
+are logged as JSON when the crawl finishes, and are saved to and restored from
+the crawl checkpoint, if any (see checkpoint.py).
+"""
+import json
+import logging
+import time
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.httpobj import urlparse_cached
+from .checkpoint import CrawlCheckpoint
+
+logger = logging.getLogger(__name__)
+
+
+class SiteResolver:
+    """Maps hostnames to the domain from domains_file they belong to."""
+
+    def __init__(self, domains):
+        self.domains = set(domains)
+        self.cache = {}
+
+    def __call__(self, host):
+        site = self.cache.get(host)
+        if site is None:
+            site = host
+            parts = host.split(".")
+            for i in range(len(parts)):
+                candidate = ".".join(parts[i:])
+                if candidate in self.domains:
+                    site = candidate
+                    break
+            self.cache[host] = site
+        return site
+
+    @classmethod
+    def for_spider(cls, spider):
+        return cls(getattr(spider, "allowed_domains", None) or [])
+
+
+class DomainStats:
+    __slots__ = ("pages", "bytes", "errors", "dropped", "started", "last_seen")
+
+    def __init__(self):
+        self.pages = 0
+        self.bytes = 0
+        self.errors = 0
+        self.dropped = 0
+        self.started = time.monotonic()
+        self.last_seen = self.started
+
+    def to_dict(self):
+        return {
+            "pages": self.pages,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "seconds": round(self.last_seen - self.started, 3),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.pages = data["pages"]
+        stats.bytes = data["bytes"]
+        stats.errors = data["errors"]
+        stats.dropped = data["dropped"]
+        stats.started = stats.last_seen - data["seconds"]
+        return stats
+
+
+class DomainBudgetMiddleware:
+    def __init__(self, stats, max_pages=0, max_depth=0, max_bytes=0, max_seconds=0):
+        self.stats = stats
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.domains = {}
+        self.site_for_host = SiteResolver([])
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        middleware = cls(
+            crawler.stats,
+            max_pages=s.getint("DOMAIN_MAX_PAGES"),
+            max_depth=s.getint("DOMAIN_MAX_DEPTH"),
+            max_bytes=s.getint("DOMAIN_MAX_BYTES"),
+            max_seconds=s.getfloat("DOMAIN_MAX_SECONDS"),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.site_for_host = SiteResolver.for_spider(spider)
+        checkpoint = CrawlCheckpoint.for_spider(spider)
+        if checkpoint:
+            for site, data in (checkpoint.get_state("domains") or {}).items():
+                self.domains[site] = DomainStats.from_dict(data)
+            checkpoint.on_save(self.save)
+
+    def summary(self):
+        return {site: stats.to_dict() for site, stats in self.domains.items()}
+
+    def save(self, checkpoint):
+        checkpoint.set_state("domains", self.summary())
+
+    def domain_stats(self, request):
+        site = self.site_for_host(urlparse_cached(request).hostname or "")
+        stats = self.domains.get(site)
+        if stats is None:
+            stats = self.domains[site] = DomainStats()
+        return site, stats
+
+    def exceeded(self, request, stats):
+        """Returns the name of the budget the request would exceed, if any."""
+        if self.max_pages and stats.pages >= self.max_pages:
+            return "pages"
+        if self.max_depth and request.meta.get("depth", 0) > self.max_depth:
+            return "depth"
+        if self.max_bytes and stats.bytes >= self.max_bytes:
+            return "bytes"
+        if self.max_seconds and time.monotonic() - stats.started >= self.max_seconds:
+            return "seconds"
+        return None
+
+    def process_request(self, request, spider):
+        if request.meta.get("dont_obey_robotstxt"):
+            return None
+        site, stats = self.domain_stats(request)
+        budget = self.exceeded(request, stats)
+        if budget:
+            stats.dropped += 1
+            self.stats.inc_value("domains/budget_exceeded/%s" % budget)
+            raise IgnoreRequest("Crawl budget (%s) exceeded for %s" % (budget, site))
+        return None
+
+    def process_response(self, request, response, spider):
+        if request.meta.get("dont_obey_robotstxt"):
+            return response
+        _, stats = self.domain_stats(request)
+        stats.pages += 1
+        stats.bytes += len(response.body)
+        stats.last_seen = time.monotonic()
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, IgnoreRequest):
+            return None
+        _, stats = self.domain_stats(request)
+        stats.errors += 1
+        stats.last_seen = time.monotonic()
+        return None
+
+    def spider_closed(self, spider):
+        summary = self.summary()
+        self.stats.set_value("domains/count", len(summary))
+        logger.info("Per-domain crawl stats: %s", json.dumps(summary))
@@ -0,0 +1,321 @@
+"""
+Crawl-state checkpointing and resume.
+
+When CHECKPOINT_DIR is set and the spider has a scan ID (the `scan_id` spider
+argument or the WEBSCRAPER_SCAN_ID environment variable), the crawl state is
+kept in `<CHECKPOINT_DIR>/<scan ID>-<hash of domains_file>/`:
+
+- checkpoint.sqlite3: the frontier (scheduled requests that haven't been
+  downloaded yet), the fingerprints of downloaded requests, and per-domain
+  state such as crawl budget stats;
+- emitted.sqlite3: the URLs of items already emitted (see dedup.DiskDedup).
+
+CheckpointMiddleware commits this state every CHECKPOINT_INTERVAL seconds and
+when the crawl stops, and if CHECKPOINT_S3_URI is set, uploads a snapshot to
+S3 (or minio). A crawl restarted with the same scan ID after a timeout, task
+stop or OOM restores the state, downloading it from S3 first if needed, and
+resumes from the frontier without re-emitting items. At most the last
+CHECKPOINT_INTERVAL seconds of work is repeated. Once a crawl finishes, a new
+crawl with the same ID starts from scratch.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+from urllib.parse import urlparse
+from scrapy import signals
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.request import request_from_dict
+from twisted.internet import task
+from .dedup import DiskDedup
+
+logger = logging.getLogger(__name__)
+
+FILES = ("checkpoint.sqlite3", "emitted.sqlite3")
+
+
+def checkpoint_id(spider):
+    """Returns the checkpoint ID for a spider, or None if it has no scan ID."""
+    scan_id = getattr(spider, "scan_id", None) or os.getenv("WEBSCRAPER_SCAN_ID")
+    if not scan_id:
+        return None
+    # Each chunk of a scan crawls a different domains_file.
+    with open(spider.domains_file, "rb") as f:
+        domains_hash = hashlib.sha256(f.read()).hexdigest()[:12]
+    return "%s-%s" % (scan_id, domains_hash)
+
+
+class S3Sync:
+    """Uploads and downloads checkpoint files to and from an S3 prefix."""
+
+    def __init__(self, uri, endpoint_url=None):
+        import boto3
+
+        parsed = urlparse(uri)
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def key(self, checkpoint_id, name):
+        return "/".join(p for p in (self.prefix, checkpoint_id, name) if p)
+
+    def download(self, checkpoint_id, directory):
+        for name in FILES:
+            try:
+                self.client.download_file(
+                    self.bucket,
+                    self.key(checkpoint_id, name),
+                    os.path.join(directory, name),
+                )
+            except self.client.exceptions.ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                    raise
+
+    def upload(self, checkpoint_id, paths):
+        for name, path in paths.items():
+            self.client.upload_file(path, self.bucket, self.key(checkpoint_id, name))
+
+
+class CrawlCheckpoint:
+    def __init__(self, directory, s3=None, checkpoint_id=None):
+        self.directory = directory
+        self.s3 = s3
+        self.checkpoint_id = checkpoint_id
+        os.makedirs(directory, exist_ok=True)
+        if s3 and not os.path.exists(os.path.join(directory, FILES[0])):
+            s3.download(checkpoint_id, directory)
+
+        self.db = sqlite3.connect(os.path.join(directory, FILES[0]))
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS frontier (fp BLOB PRIMARY KEY, request BLOB);
+            CREATE TABLE IF NOT EXISTS done (fp BLOB PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        finished = self.get_state("finished")
+        self.resumed = not finished and self._has_rows("done")
+        if finished:
+            # The previous crawl with this ID completed, so start over.
+            self.db.executescript(
+                "DELETE FROM frontier; DELETE FROM done; DELETE FROM state;"
+            )
+            if os.path.exists(os.path.join(directory, FILES[1])):
+                os.remove(os.path.join(directory, FILES[1]))
+        self.emitted = DiskDedup(
+            path=os.path.join(directory, FILES[1]), memory_entries=1 << 16
+        )
+        self.savers = []
+
+    @classmethod
+    def for_spider(cls, spider):
+        """Returns the spider's checkpoint, opening it if needed, or None if disabled."""
+        if not hasattr(spider, "checkpoint"):
+            spider.checkpoint = None
+            settings = getattr(spider, "settings", None) or {}
+            directory = settings.get("CHECKPOINT_DIR")
+            cid = checkpoint_id(spider) if directory else None
+            if cid:
+                s3 = None
+                if settings.get("CHECKPOINT_S3_URI"):
+                    s3 = S3Sync(
+                        settings.get("CHECKPOINT_S3_URI"),
+                        settings.get("CHECKPOINT_S3_ENDPOINT_URL"),
+                    )
+                spider.checkpoint = cls(os.path.join(directory, cid), s3, cid)
+                logger.info(
+                    "%s crawl checkpoint %s",
+                    "Resuming from" if spider.checkpoint.resumed else "Using",
+                    cid,
+                )
+        return spider.checkpoint
+
+    def _has_rows(self, table):
+        return (
+            self.db.execute("SELECT 1 FROM %s LIMIT 1" % table).fetchone() is not None
+        )
+
+    def get_state(self, key):
+        row = self.db.execute(
+            "SELECT value FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_state(self, key, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?)", (key, json.dumps(value))
+        )
+
+    def scheduled(self, fp, request, spider):
+        self.db.execute(
+            "INSERT OR REPLACE INTO frontier VALUES (?, ?)",
+            (fp, pickle.dumps(request.to_dict(spider=spider), protocol=4)),
+        )
+
+    def unscheduled(self, fp):
+        self.db.execute("DELETE FROM frontier WHERE fp = ?", (fp,))
+
+    def downloaded(self, fp):
+        self.db.execute("DELETE FROM frontier WHERE fp = ?", (fp,))
+        self.db.execute("INSERT OR IGNORE INTO done VALUES (?)", (fp,))
+
+    def seen(self, fp):
+        return any(
+            self.db.execute("SELECT 1 FROM %s WHERE fp = ?" % table, (fp,)).fetchone()
+            for table in ("done", "frontier")
+        )
+
+    def seen_fingerprints(self):
+        """Returns the fingerprints of all downloaded and pending requests."""
+        for table in ("done", "frontier"):
+            for (fp,) in self.db.execute("SELECT fp FROM %s" % table):
+                yield fp
+
+    def pending_requests(self, spider):
+        for (data,) in self.db.execute("SELECT request FROM frontier"):
+            request = request_from_dict(pickle.loads(data), spider=spider)
+            yield request.replace(dont_filter=True)
+
+    def on_save(self, callback):
+        """Registers a callback that stores extra state before each save."""
+        self.savers.append(callback)
+
+    def save(self, finished=False):
+        for callback in self.savers:
+            callback(self)
+        if finished:
+            self.set_state("finished", True)
+        self.db.commit()
+        self.emitted.flush()
+        if self.s3:
+            self._upload_snapshot()
+
+    def _upload_snapshot(self):
+        # Copy the databases with SQLite's backup API so the upload is consistent.
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {}
+            for name, db in zip(FILES, (self.db, self.emitted.db)):
+                paths[name] = os.path.join(tmp, name)
+                with sqlite3.connect(paths[name]) as copy:
+                    db.backup(copy)
+                copy.close()
+            self.s3.upload(self.checkpoint_id, paths)
+
+    def close(self):
+        self.db.close()
+        self.emitted.close()
+
+
+class CheckpointDupeFilter(RFPDupeFilter):
+    """Request dupefilter that also skips requests seen before a resume."""
+
+    crawler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        df = super().from_crawler(crawler)
+        df.crawler = crawler
+        return df
+
+    def open(self):
+        checkpoint = self.crawler and CrawlCheckpoint.for_spider(self.crawler.spider)
+        if checkpoint and checkpoint.resumed:
+            self.fingerprints.update(fp.hex() for fp in checkpoint.seen_fingerprints())
+        return super().open()
+
+
+class CheckpointMiddleware:
+    """Spider middleware that records crawl progress in the spider's checkpoint.
+
+    A request is added to the frontier when it is scheduled, and is marked as
+    done once the spider's callback has yielded all its output (or raised).
+    The resulting items have then been handed to the scraper but may still be
+    in the item pipelines, so an item whose pipelines hadn't finished when a
+    checkpoint was committed is lost if the crawl is killed before they do.
+    Requests that fail to download stay in the frontier and are retried on
+    resume. Redirects and retries share the fingerprint of the original
+    request.
+    """
+
+    def __init__(self, crawler, interval):
+        self.crawler = crawler
+        self.interval = interval
+        self.checkpoint = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get("CHECKPOINT_DIR"):
+            raise NotConfigured
+        middleware = cls(crawler, crawler.settings.getfloat("CHECKPOINT_INTERVAL", 60))
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            middleware.request_scheduled, signal=signals.request_scheduled
+        )
+        crawler.signals.connect(
+            middleware.request_dropped, signal=signals.request_dropped
+        )
+        return middleware
+
+    def fingerprint(self, request):
+        return self.crawler.request_fingerprinter.fingerprint(request)
+
+    def process_start_requests(self, start_requests, spider):
+        checkpoint = CrawlCheckpoint.for_spider(spider)
+        if not checkpoint or not checkpoint.resumed:
+            yield from start_requests
+            return
+        yield from checkpoint.pending_requests(spider)
+        for request in start_requests:
+            if not checkpoint.seen(self.fingerprint(request)):
+                yield request
+
+    def process_spider_output(self, response, result, spider):
+        try:
+            yield from result
+        finally:
+            self.done(response)
+
+    async def process_spider_output_async(self, response, result, spider):
+        try:
+            async for r in result:
+                yield r
+        finally:
+            self.done(response)
+
+    def done(self, response):
+        fp = response.meta.get("checkpoint_fingerprint")
+        if self.checkpoint and fp:
+            self.checkpoint.downloaded(fp)
+
+    def spider_opened(self, spider):
+        self.checkpoint = CrawlCheckpoint.for_spider(spider)
+        if self.checkpoint:
+            self.task = task.LoopingCall(self.checkpoint.save)
+            self.task.start(self.interval, now=False)
+
+    def request_scheduled(self, request, spider):
+        # Sent before the dupefilter runs, so duplicates get here too.
+        if self.checkpoint and "checkpoint_fingerprint" not in request.meta:
+            fp = self.fingerprint(request)
+            request.meta["checkpoint_fingerprint"] = fp
+            if not self.checkpoint.seen(fp):
+                request.meta["checkpoint_added"] = True
+                self.checkpoint.scheduled(fp, request, spider)
+
+    def request_dropped(self, request, spider):
+        if self.checkpoint and request.meta.pop("checkpoint_added", False):
+            self.checkpoint.unscheduled(request.meta["checkpoint_fingerprint"])
+
+    def spider_closed(self, spider, reason):
+        if not self.checkpoint:
+            return
+        if self.task and self.task.running:
+            self.task.stop()
+        self.checkpoint.save(finished=reason == "finished")
+        self.checkpoint.close()
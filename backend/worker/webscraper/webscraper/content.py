@@ -0,0 +1,82 @@
+"""
+Content-type-aware download handling.
+
+ContentTypeFilter stops downloads early instead of fetching whole responses
+that MainSpider would throw away:
+
+- when DOWNLOAD_TEXT_ONLY is set, responses whose Content-Type is not textual
+  (images, PDFs, archives, ...) are stopped as soon as their headers arrive;
+- when DOWNLOAD_TEXT_MAXSIZE is set, responses are cut off once that many
+  bytes have been streamed.
+
+Stopped responses are still passed to the spider, with the
+"download_stopped" flag and whatever part of the body was received.
+(DOWNLOAD_MAXSIZE, in contrast, drops responses that are too large.)
+"""
+from weakref import WeakKeyDictionary
+from scrapy import signals
+from scrapy.exceptions import NotConfigured, StopDownload
+
+TEXT_CONTENT_TYPES = {
+    b"application/json",
+    b"application/javascript",
+    b"application/x-javascript",
+    b"application/ecmascript",
+    b"application/xml",
+    b"application/rss+xml",
+    b"application/atom+xml",
+    b"application/xhtml+xml",
+    b"application/ld+json",
+    b"image/svg+xml",
+}
+
+
+def is_text_content_type(content_type):
+    """Returns whether the given Content-Type header value is textual.
+
+    A missing Content-Type is treated as textual, since it can't be ruled out.
+    """
+    if not content_type:
+        return True
+    mime = content_type.split(b";", 1)[0].strip().lower()
+    return (
+        mime.startswith(b"text/")
+        or mime in TEXT_CONTENT_TYPES
+        or mime.endswith(b"+xml")
+        or mime.endswith(b"+json")
+    )
+
+
+class ContentTypeFilter:
+    def __init__(self, stats, text_only=True, maxsize=0):
+        self.stats = stats
+        self.text_only = text_only
+        self.maxsize = maxsize
+        self.bytes_received_by_request = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        text_only = s.getbool("DOWNLOAD_TEXT_ONLY")
+        maxsize = s.getint("DOWNLOAD_TEXT_MAXSIZE")
+        if not text_only and not maxsize:
+            raise NotConfigured
+        ext = cls(crawler.stats, text_only=text_only, maxsize=maxsize)
+        crawler.signals.connect(ext.headers_received, signal=signals.headers_received)
+        if maxsize:
+            crawler.signals.connect(ext.bytes_received, signal=signals.bytes_received)
+        return ext
+
+    def headers_received(self, headers, body_length, request, spider):
+        if request.meta.get("dont_obey_robotstxt"):
+            return
+        if self.text_only and not is_text_content_type(headers.get(b"Content-Type")):
+            self.stats.inc_value("content/stopped/binary")
+            raise StopDownload(fail=False)
+
+    def bytes_received(self, data, request, spider):
+        received = self.bytes_received_by_request.get(request, 0) + len(data)
+        self.bytes_received_by_request[request] = received
+        if received >= self.maxsize and not request.meta.get("dont_obey_robotstxt"):
+            self.stats.inc_value("content/stopped/maxsize")
+            raise StopDownload(fail=False)
@@ -0,0 +1,336 @@
+"""
+Resident crawl service for MainSpider.
+
+Each `scrapy crawl main` starts Python, imports Scrapy, Twisted and the
+project, loads settings and builds the middleware stack before it sends its
+first request. The daemon does that once, and then runs crawl jobs as they
+come in, up to DAEMON_MAX_JOBS of them at a time in the same reactor (each
+with its own CONCURRENT_REQUESTS), sharing the DNS and host caches:
+
+    python -m webscraper.daemon [--socket PATH] [--max-jobs N] [-s NAME=VALUE]
+
+Jobs are read as JSON lines from stdin, or from each connection to the unix
+socket at PATH, and the results of each job are written back as JSON lines to
+where the job came from, interleaved with those of other jobs:
+
+    -> {"type": "crawl", "job_id": "1", "domains": ["https://a.gov"], "scan_id": "..."}
+    -> {"type": "cancel", "job_id": "1"}
+    <- {"type": "ready", "pid": 123}
+    <- {"type": "started", "job_id": "1", "queued_seconds": 0.0}
+    <- {"type": "item", "job_id": "1", "item": {...}}
+    <- {"type": "done", "job_id": "1", "finish_reason": "finished", "items": 10,
+        "startup_seconds": 0.01, "seconds": 12.3}
+    <- {"type": "error", "job_id": "1", "error": "..."}
+
+`domains` are the start URLs that would be the lines of domains_file, and
+`scan_id` is the `scan_id` spider argument. Items are deduplicated per job,
+like ExportFilePipeline does per crawl. When stdin is closed, the daemon exits
+once the jobs already submitted have finished. When a socket connection is
+closed, its jobs are cancelled.
+
+METRICS_PORT is ignored, since all the jobs would try to listen on it. Jobs
+share the METRICS_TARGET stream, opened once by the daemon, and their metrics
+snapshots carry their job_id.
+benchmarks/startup.py measures the time this saves per chunk.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from twisted.internet import defer, protocol
+from twisted.internet.interfaces import IHalfCloseableProtocol
+from twisted.protocols.basic import LineOnlyReceiver
+from zope.interface import implementer
+from .dedup import build_dedup
+from .pipelines import ExportFilePipeline
+from .spiders.main_spider import MainSpider
+
+logger = logging.getLogger(__name__)
+
+PIPELINE = "webscraper.pipelines.ExportFilePipeline"
+
+
+class Job:
+    def __init__(self, job_id, domains, send, scan_id=None):
+        self.id = job_id
+        self.domains = domains
+        self.scan_id = scan_id
+        self.send = send
+        self.crawler = None
+        self.cancelled = False
+        self.items = 0
+        self.submitted = time.monotonic()
+        self.started = None
+        self.opened = None
+
+    @classmethod
+    def from_message(cls, message, send):
+        """Returns the Job for a "crawl" message, or raises ValueError."""
+        job_id = message.get("job_id")
+        domains = message.get("domains")
+        scan_id = message.get("scan_id")
+        if not isinstance(job_id, str) or not job_id:
+            raise ValueError("job_id must be a non-empty string")
+        if not isinstance(domains, list) or not all(
+            isinstance(d, str) for d in domains
+        ):
+            raise ValueError("domains must be a list of strings")
+        domains = [d.strip() for d in domains if d.strip()]
+        if not domains:
+            raise ValueError("domains must not be empty")
+        if scan_id is not None and not isinstance(scan_id, str):
+            raise ValueError("scan_id must be a string")
+        return cls(job_id, domains, send, scan_id)
+
+    def spider_opened(self, spider):
+        self.opened = time.monotonic()
+
+    def summary(self):
+        stats = self.crawler.stats.get_stats() if self.crawler else {}
+        now = time.monotonic()
+        return {
+            "type": "done",
+            "job_id": self.id,
+            "finish_reason": "cancelled"
+            if self.cancelled
+            else stats.get("finish_reason", "failed"),
+            "items": self.items,
+            "startup_seconds": self.opened - self.started if self.opened else None,
+            "seconds": now - self.started if self.started else 0.0,
+        }
+
+
+class JobOutput:
+    """Sends items back to the client that submitted the job."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def write(self, item):
+        self.job.items += 1
+        self.job.send({"type": "item", "job_id": self.job.id, "item": item})
+
+    def close(self):
+        pass
+
+
+class DaemonExportFilePipeline(ExportFilePipeline):
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            urls_seen=build_dedup(crawler.settings),
+            output=JobOutput(crawler.daemon_job),
+        )
+
+
+class CrawlDaemon:
+    """Runs crawl jobs with a CrawlerRunner, at most max_jobs at a time."""
+
+    def __init__(self, runner, max_jobs=4, spidercls=MainSpider):
+        self.runner = runner
+        self.spidercls = spidercls
+        self.semaphore = defer.DeferredSemaphore(max(1, max_jobs))
+        self.jobs = {}
+        self.pending = {}
+
+    def submit(self, job):
+        """Queues a job. Returns a Deferred that fires when it's done."""
+        if job.id in self.jobs:
+            raise ValueError("Job %s is already running" % job.id)
+        self.jobs[job.id] = job
+        d = self.pending[job.id] = self.semaphore.run(self.run, job)
+        d.addErrback(self.failed, job)
+        d.addBoth(self.finished, job)
+        return d
+
+    def run(self, job):
+        if job.cancelled:
+            return None
+        job.started = time.monotonic()
+        job.send(
+            {
+                "type": "started",
+                "job_id": job.id,
+                "queued_seconds": job.started - job.submitted,
+            }
+        )
+        fd, path = tempfile.mkstemp(prefix="webscraper-job-", suffix=".txt")
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(job.domains))
+        kwargs = {"domains_file": path}
+        if job.scan_id:
+            kwargs["scan_id"] = job.scan_id
+        try:
+            crawler = job.crawler = self.runner.create_crawler(self.spidercls)
+            crawler.daemon_job = job
+            crawler.signals.connect(job.spider_opened, signal=signals.spider_opened)
+            d = self.runner.crawl(crawler, **kwargs)
+        except Exception:
+            os.remove(path)
+            raise
+        d.addBoth(self._remove, path)
+        return d
+
+    def _remove(self, result, path):
+        os.remove(path)
+        return result
+
+    def failed(self, failure, job):
+        logger.error(
+            "Job %s failed",
+            job.id,
+            exc_info=(failure.type, failure.value, failure.getTracebackObject()),
+        )
+        job.send({"type": "error", "job_id": job.id, "error": str(failure.value)})
+
+    def finished(self, result, job):
+        del self.jobs[job.id]
+        del self.pending[job.id]
+        summary = job.summary()
+        logger.info("Job %s done: %s", job.id, json.dumps(summary))
+        job.send(summary)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        crawler = job.crawler
+        if crawler and crawler.crawling and crawler.engine:
+            crawler.engine.close_spider(crawler.spider, "cancelled")
+        return True
+
+    def join(self):
+        """Returns a Deferred that fires when all the submitted jobs are done."""
+        return defer.DeferredList(list(self.pending.values()))
+
+
+class JobProtocol(LineOnlyReceiver):
+    delimiter = b"\n"
+    MAX_LENGTH = 64 << 20
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.job_ids = set()
+        self.closed = False
+
+    def connectionMade(self):
+        self.send({"type": "ready", "pid": os.getpid()})
+
+    def send(self, message):
+        if not self.closed:
+            self.transport.write(json.dumps(message).encode() + self.delimiter)
+
+    def error(self, error, job_id=None):
+        self.send({"type": "error", "job_id": job_id, "error": error})
+
+    def lineReceived(self, line):
+        if not line.strip():
+            return
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return self.error("Invalid JSON")
+        if not isinstance(message, dict):
+            return self.error("Messages must be JSON objects")
+        kind = message.get("type")
+        job_id = message.get("job_id")
+        if kind == "crawl":
+            try:
+                job = Job.from_message(message, self.send)
+                self.daemon.submit(job)
+            except ValueError as e:
+                return self.error(str(e), job_id)
+            self.job_ids.add(job.id)
+        elif kind == "cancel":
+            if job_id not in self.job_ids or not self.daemon.cancel(job_id):
+                self.error("Unknown job", job_id)
+        else:
+            self.error("Unknown message type: %s" % kind, job_id)
+
+    def lineLengthExceeded(self, line):
+        self.error("Message too long")
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason=protocol.connectionDone):
+        # Nobody is left to read the results.
+        self.closed = True
+        for job_id in self.job_ids:
+            self.daemon.cancel(job_id)
+
+
+@implementer(IHalfCloseableProtocol)
+class StdioJobProtocol(JobProtocol):
+    """Reads jobs until stdin is closed, and stops the reactor once they're done."""
+
+    def readConnectionLost(self):
+        # Closes stdout once everything has been written to it.
+        self.daemon.join().addBoth(lambda _: self.transport.loseConnection())
+
+    def writeConnectionLost(self):
+        super().connectionLost()
+
+    def connectionLost(self, reason=protocol.connectionDone):
+        super().connectionLost(reason)
+        from twisted.internet import reactor
+
+        if reactor.running:
+            reactor.stop()
+
+
+class JobFactory(protocol.Factory):
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def buildProtocol(self, addr):
+        return JobProtocol(self.daemon)
+
+
+def daemon_settings(overrides=()):
+    settings = get_project_settings()
+    pipelines = dict(settings.getdict("ITEM_PIPELINES"))
+    pipelines["webscraper.daemon.DaemonExportFilePipeline"] = pipelines.pop(
+        PIPELINE, 300
+    )
+    settings.set("ITEM_PIPELINES", pipelines)
+    settings.set("METRICS_PORT", 0)
+    for override in overrides:
+        name, _, value = override.partition("=")
+        settings.set(name, value)
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run crawl jobs in one process.")
+    parser.add_argument("--socket", help="listen on this unix socket, not stdin")
+    parser.add_argument("--max-jobs", type=int)
+    parser.add_argument("-s", dest="settings", action="append", default=[])
+    args = parser.parse_args(argv)
+
+    settings = daemon_settings(args.settings)
+    process = CrawlerProcess(settings)
+    daemon = CrawlDaemon(
+        process, args.max_jobs or settings.getint("DAEMON_MAX_JOBS", 4)
+    )
+    # The first crawler of the process installs TWISTED_REACTOR, which has to
+    # happen before anything imports the reactor.
+    process.create_crawler(MainSpider)
+    from twisted.internet import reactor, stdio
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        reactor.listenUNIX(args.socket, JobFactory(daemon), mode=0o600)
+        logger.info("Listening for crawl jobs on %s", args.socket)
+    else:
+        stdio.StandardIO(StdioJobProtocol(daemon))
+    process.start(stop_after_crawl=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Bulk writes of webpages to Postgres.
+
+saveWebpagesToDb.ts upserts webpages one INSERT at a time, in batches of 10,
+after each item has gone through stdout and Node. When DB_SINK_ENABLED is set,
+PostgresWebpagePipeline upserts them into the `webpage` table directly
+instead:
+
+- items are collected into batches of DB_SINK_BATCH_SIZE rows, which a
+  background thread COPYs into a temporary table and upserts with
+  INSERT ... ON CONFLICT ("domainId", url). Unchanged pages (see
+  incremental.py) only have their lastSeen date updated;
+- at most DB_SINK_MAX_PENDING_BATCHES batches are queued for the thread.
+  When the queue is full, process_item returns a Deferred that fires once
+  there is room, so Scrapy stops processing more items (see CONCURRENT_ITEMS)
+  until the database catches up;
+- partial batches are flushed every DB_SINK_FLUSH_INTERVAL seconds.
+
+The database is given by DB_SINK_DSN, or the same DB_HOST, DB_PORT, DB_NAME,
+DB_USERNAME and DB_PASSWORD environment variables as the backend. Domains are
+looked up by name, like webscraper.ts does, and webpages are attributed to the
+scan in the `scan_id` spider argument or WEBSCRAPER_SCAN_ID. Since this
+pipeline doesn't sync Elasticsearch, it leaves `syncedAt` alone and passes
+items on to ExportFilePipeline. webscraper.ts reads the same
+WEBSCRAPER_DB_SINK variable and then skips its own upserts, and only syncs
+the webpages this pipeline wrote with Elasticsearch.
+
+Rows written per second are logged every DB_SINK_FLUSH_INTERVAL seconds and
+when the spider closes, and counted in the "dbsink/..." stats.
+"""
+import csv
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, reactor, task, threads
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    "url",
+    "domain_name",
+    "status",
+    "responseSize",
+    "s3Key",
+    "nearDuplicateOf",
+    "unchanged",
+)
+CREATE_TEMP_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS webpage_sink (
+        url varchar, domain_name varchar, status numeric,
+        "responseSize" numeric, "s3Key" varchar, "nearDuplicateOf" varchar,
+        unchanged boolean
+    ) ON COMMIT DELETE ROWS
+"""
+# Rows for the same URL within a batch would make ON CONFLICT fail, so only
+# the last one of each is kept. Domains with the same name in several
+# organizations get the webpage of the most recently updated one, as in
+# webscraper.ts.
+UPSERT = """
+    INSERT INTO webpage (
+        url, "domainId", "discoveredById", status, "responseSize", "s3Key",
+        "nearDuplicateOf", "lastSeen"
+    )
+    SELECT DISTINCT ON (d.id, s.url)
+        s.url, d.id, %s, s.status, s."responseSize", s."s3Key",
+        s."nearDuplicateOf", now()
+    FROM (
+        SELECT *, row_number() OVER () AS n FROM webpage_sink
+        WHERE unchanged = {unchanged}
+    ) s
+    JOIN (
+        SELECT DISTINCT ON (name) id, name FROM domain
+        WHERE name IN (SELECT domain_name FROM webpage_sink)
+        ORDER BY name, "updatedAt" DESC
+    ) d ON d.name = s.domain_name
+    ORDER BY d.id, s.url, s.n DESC
+    ON CONFLICT ("domainId", url) DO UPDATE
+    SET {update}
+"""
+UPDATE_CHANGED = """"lastSeen" = excluded."lastSeen",
+        status = excluded.status,
+        "responseSize" = excluded."responseSize",
+        "s3Key" = COALESCE(excluded."s3Key", webpage."s3Key"),
+        "nearDuplicateOf" = excluded."nearDuplicateOf",
+        "updatedAt" = now()"""
+# Pages that haven't changed since the last crawl only have their lastSeen
+# date updated, like saveWebpagesToDb.ts does.
+UPDATE_UNCHANGED = '"lastSeen" = excluded."lastSeen"'
+
+
+def connection_params(settings):
+    """Returns the psycopg2.connect() arguments for the sink's database."""
+    if settings.get("DB_SINK_DSN"):
+        return {"dsn": settings.get("DB_SINK_DSN")}
+    return {
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USERNAME"),
+        "password": os.getenv("DB_PASSWORD"),
+    }
+
+
+class PostgresWebpagePipeline:
+    def __init__(
+        self,
+        connect,
+        scan_id=None,
+        batch_size=5000,
+        max_pending_batches=4,
+        flush_interval=5.0,
+        stats=None,
+    ):
+        self.connect = connect
+        self.scan_id = scan_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.batch = []
+        self.batches = queue.Queue(maxsize=max_pending_batches)
+        # (batch, Deferred) for the batches waiting for room in the queue.
+        self.waiting = deque()
+        self.thread = None
+        self.task = None
+        self.rows = 0
+        self.seconds = 0.0
+        self.logged = (0, time.monotonic())
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("DB_SINK_ENABLED"):
+            raise NotConfigured
+        params = connection_params(settings)
+
+        def connect():
+            import psycopg2
+
+            return psycopg2.connect(**params)
+
+        return cls(
+            connect,
+            batch_size=settings.getint("DB_SINK_BATCH_SIZE", 5000),
+            max_pending_batches=settings.getint("DB_SINK_MAX_PENDING_BATCHES", 4),
+            flush_interval=settings.getfloat("DB_SINK_FLUSH_INTERVAL", 5.0),
+            stats=crawler.stats,
+        )
+
+    def open_spider(self, spider=None):
+        if spider is not None and self.scan_id is None:
+            self.scan_id = getattr(spider, "scan_id", None) or os.getenv(
+                "WEBSCRAPER_SCAN_ID"
+            )
+        self.thread = threading.Thread(
+            target=self.run, name="webpage-db-sink", daemon=True
+        )
+        self.thread.start()
+        if self.flush_interval:
+            self.task = task.LoopingCall(self.tick)
+            self.task.start(self.flush_interval, now=False)
+
+    def process_item(self, item, spider=None):
+        self.batch.append(
+            (
+                item["url"],
+                item["domain_name"],
+                item["status"],
+                item.get("response_size"),
+                item.get("s3_key"),
+                item.get("near_duplicate_of"),
+                bool(item.get("unchanged")),
+            )
+        )
+        if len(self.batch) >= self.batch_size:
+            d = self.flush()
+            if d is not None:
+                return d.addCallback(lambda _: item)
+        return item
+
+    def flush(self):
+        """Hands the current batch to the writer thread.
+
+        Returns None, or a Deferred that fires once the batch has been queued
+        if the queue is full.
+        """
+        if not self.batch:
+            return None
+        batch, self.batch = self.batch, []
+        if not self.waiting:
+            try:
+                self.batches.put_nowait(batch)
+                return None
+            except queue.Full:
+                pass
+        self._inc_stat("dbsink/backpressure")
+        d = defer.Deferred()
+        self.waiting.append((batch, d))
+        return d
+
+    def drain(self):
+        """Queues waiting batches while there's room. Runs in the reactor thread."""
+        while self.waiting:
+            batch, d = self.waiting[0]
+            try:
+                self.batches.put_nowait(batch)
+            except queue.Full:
+                return
+            self.waiting.popleft()
+            d.callback(None)
+
+    def tick(self):
+        d = self.flush()
+        rows, started = self.logged
+        now = time.monotonic()
+        if self.rows > rows:
+            logger.info(
+                "Wrote %d webpages to the database (%.0f rows/s)",
+                self.rows - rows,
+                (self.rows - rows) / (now - started),
+            )
+        self.logged = (self.rows, now)
+        return d
+
+    def run(self):
+        conn = None
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                break
+            reactor.callFromThread(self.drain)
+            started = time.monotonic()
+            try:
+                if conn is None:
+                    conn = self.connect()
+                written = self.write_batch(conn, batch)
+            except Exception:
+                logger.exception(
+                    "Error writing %d webpages to the database", len(batch)
+                )
+                self._inc_stat("dbsink/failed_rows", len(batch))
+                if conn is not None and conn.closed:
+                    conn = None
+                continue
+            self.seconds += time.monotonic() - started
+            self.rows += written
+            self._inc_stat("dbsink/batches")
+            self._inc_stat("dbsink/rows", written)
+            self._inc_stat("dbsink/skipped_rows", len(batch) - written)
+        if conn is not None:
+            conn.close()
+
+    def write_batch(self, conn, batch):
+        """Upserts a batch of rows. Returns the number of webpages written."""
+        data = io.StringIO()
+        csv.writer(data).writerows(batch)
+        data.seek(0)
+        with conn, conn.cursor() as cursor:
+            cursor.execute(CREATE_TEMP_TABLE)
+            cursor.copy_expert(
+                "COPY webpage_sink (%s) FROM STDIN WITH (FORMAT csv)"
+                % ", ".join('"%s"' % c for c in COLUMNS),
+                data,
+            )
+            written = 0
+            for unchanged, update in (
+                (False, UPDATE_CHANGED),
+                (True, UPDATE_UNCHANGED),
+            ):
+                cursor.execute(
+                    UPSERT.format(unchanged=unchanged, update=update),
+                    (self.scan_id,),
+                )
+                written += cursor.rowcount
+            return written
+
+    def close_spider(self, spider=None):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.flush()
+        return threads.deferToThread(self.stop)
+
+    def stop(self):
+        for batch, _ in self.waiting:
+            self.batches.put(batch)
+        self.batches.put(None)
+        self.thread.join()
+        logger.info(
+            "Wrote %d webpages to the database in %.1fs (%.0f rows/s)",
+            self.rows,
+            self.seconds,
+            self.rows / self.seconds if self.seconds else 0,
+        )
+        if self.stats and self.seconds:
+            self.stats.set_value("dbsink/rows_per_second", self.rows / self.seconds)
+
+    def _inc_stat(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count)
@@ -0,0 +1,287 @@
+"""
+URL deduplication backends for ExportFilePipeline.
+
+A plain set of URL strings costs well over 100 bytes per URL, which adds up on
+large global scans. The backends here trade exactness or memory for disk:
+
+- "set": exact set of URL strings (the original behavior).
+- "fingerprint": 64-bit URL hashes in an array-backed open-addressing table.
+- "bloom": scalable Bloom filter with a configurable false-positive rate.
+- "disk": fingerprints buffered in memory and spilled to a SQLite file.
+
+The backend is selected with the DEDUP_BACKEND setting.
+"""
+from array import array
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+
+
+def fingerprint(url):
+    """Returns a non-zero 64-bit fingerprint of the given URL."""
+    digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+class SetDedup:
+    """Exact deduplication using a set of URL strings."""
+
+    def __init__(self):
+        self.urls = set()
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, url):
+        self.urls.add(url)
+
+    def close(self):
+        pass
+
+
+class FingerprintDedup:
+    """Stores 64-bit URL fingerprints in an open-addressing hash table.
+
+    The table is a flat array of unsigned 64-bit integers, where 0 marks an
+    empty slot, so each URL costs between 8 and 16 bytes depending on load.
+    """
+
+    max_load = 0.7
+
+    def __init__(self, initial_capacity=1 << 16):
+        size = 1 << max(4, math.ceil(math.log2(initial_capacity / self.max_load)))
+        self.table = array("Q", bytes(8 * size))
+        self.mask = size - 1
+        self.count = 0
+
+    def __contains__(self, url):
+        return self.contains_fingerprint(fingerprint(url))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (fp for fp in self.table if fp)
+
+    def add(self, url):
+        self.add_fingerprint(fingerprint(url))
+
+    def contains_fingerprint(self, fp):
+        table, mask = self.table, self.mask
+        i = fp & mask
+        while True:
+            value = table[i]
+            if value == fp:
+                return True
+            if value == 0:
+                return False
+            i = (i + 1) & mask
+
+    def add_fingerprint(self, fp):
+        table, mask = self.table, self.mask
+        i = fp & mask
+        while True:
+            value = table[i]
+            if value == fp:
+                return
+            if value == 0:
+                break
+            i = (i + 1) & mask
+        table[i] = fp
+        self.count += 1
+        if self.count > self.max_load * len(table):
+            self._grow()
+
+    def clear(self):
+        self.table = array("Q", bytes(8 * len(self.table)))
+        self.count = 0
+
+    def close(self):
+        pass
+
+    def _grow(self):
+        old = self.table
+        self.table = array("Q", bytes(16 * len(old)))
+        self.mask = len(self.table) - 1
+        self.count = 0
+        for fp in old:
+            if fp:
+                self.add_fingerprint(fp)
+
+
+class BloomFilter:
+    """Fixed-capacity Bloom filter using double hashing over a bytearray."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.num_bits = max(
+            8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def contains_hashes(self, h1, h2):
+        bits, num_bits = self.bits, self.num_bits
+        for i in range(self.num_hashes):
+            p = (h1 + i * h2) % num_bits
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add_hashes(self, h1, h2):
+        bits, num_bits = self.bits, self.num_bits
+        for i in range(self.num_hashes):
+            p = (h1 + i * h2) % num_bits
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class ScalableBloomDedup:
+    """Scalable Bloom filter (Almeida et al., 2007).
+
+    When the current filter reaches its capacity, a new filter is added with
+    `growth` times the capacity and a tighter error rate, so the overall
+    false-positive rate stays below `error_rate` however many URLs are added.
+    A false positive means a new URL is wrongly treated as a duplicate.
+    """
+
+    growth = 2
+    tightening = 0.5
+
+    def __init__(self, error_rate=0.0001, initial_capacity=1 << 16):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1.")
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.filters = []
+        self.count = 0
+
+    def __contains__(self, url):
+        h1, h2 = self._hashes(url)
+        return any(f.contains_hashes(h1, h2) for f in reversed(self.filters))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, url):
+        h1, h2 = self._hashes(url)
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            n = len(self.filters)
+            self.filters.append(
+                BloomFilter(
+                    self.initial_capacity * self.growth**n,
+                    self.error_rate * (1 - self.tightening) * self.tightening**n,
+                )
+            )
+        self.filters[-1].add_hashes(h1, h2)
+        self.count += 1
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _hashes(url):
+        digest = hashlib.blake2b(url.encode(), digest_size=16).digest()
+        return (
+            int.from_bytes(digest[:8], "little"),
+            int.from_bytes(digest[8:], "little") | 1,
+        )
+
+
+class DiskDedup:
+    """Buffers fingerprints in memory and spills them to a SQLite file.
+
+    At most `memory_entries` fingerprints are held in memory; the buffer
+    grows as needed up to that many, and once it is full it is written to
+    disk and cleared. If `path` is not given, a
+    temporary file is used and removed on close.
+    """
+
+    def __init__(self, path=None, memory_entries=1 << 20):
+        self.temporary = path is None
+        if self.temporary:
+            fd, path = tempfile.mkstemp(prefix="dedup-", suffix=".sqlite3")
+            os.close(fd)
+        self.path = path
+        self.memory_entries = memory_entries
+        self.buffer = FingerprintDedup()
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS seen (fp INTEGER PRIMARY KEY) WITHOUT ROWID"
+        )
+        self.spilled = self.db.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def __contains__(self, url):
+        fp = fingerprint(url)
+        if self.buffer.contains_fingerprint(fp):
+            return True
+        if not self.spilled:
+            return False
+        row = self.db.execute(
+            "SELECT 1 FROM seen WHERE fp = ?", (self._to_signed(fp),)
+        ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.spilled + len(self.buffer)
+
+    def add(self, url):
+        if url in self:
+            return
+        self.buffer.add_fingerprint(fingerprint(url))
+        if len(self.buffer) >= self.memory_entries:
+            self.flush()
+
+    def flush(self):
+        """Writes the in-memory buffer to disk."""
+        if not len(self.buffer):
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO seen (fp) VALUES (?)",
+                ((self._to_signed(fp),) for fp in self.buffer),
+            )
+        self.spilled += len(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        if self.temporary:
+            self.db.close()
+            os.remove(self.path)
+        else:
+            self.flush()
+            self.db.close()
+
+    @staticmethod
+    def _to_signed(fp):
+        # SQLite integers are signed 64-bit.
+        return fp - (1 << 64) if fp >= 1 << 63 else fp
+
+
+def build_dedup(settings):
+    """Builds the deduplication backend configured in the given Scrapy settings."""
+    backend = settings.get("DEDUP_BACKEND", "set")
+    capacity = settings.getint("DEDUP_INITIAL_CAPACITY", 1 << 16)
+    if backend == "set":
+        return SetDedup()
+    if backend == "fingerprint":
+        return FingerprintDedup(initial_capacity=capacity)
+    if backend == "bloom":
+        return ScalableBloomDedup(
+            error_rate=settings.getfloat("DEDUP_BLOOM_ERROR_RATE", 0.0001),
+            initial_capacity=capacity,
+        )
+    if backend == "disk":
+        return DiskDedup(
+            path=settings.get("DEDUP_DISK_PATH"),
+            memory_entries=settings.getint("DEDUP_MEMORY_ENTRIES", 1 << 20),
+        )
+    raise ValueError("Unknown DEDUP_BACKEND: %s" % backend)
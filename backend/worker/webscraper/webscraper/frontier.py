@@ -0,0 +1,249 @@
+"""
+Priority-ordered crawl frontier.
+
+With Scrapy's default scheduler, MainSpider crawls each domain in discovery
+order, so the time limit of a chunk cuts off arbitrary pages. FrontierMiddleware
+instead gives each followed request a priority, so that the most
+security-relevant pages are crawled first:
+
+    priority = largest weight among the FRONTIER_PATTERNS matching the URL
+               - FRONTIER_DEPTH_WEIGHT * depth
+               + FRONTIER_NOVELTY_WEIGHT / (1 + number of requests already
+                 scheduled for the same host and first path segment)
+
+The default patterns favour login pages, admin panels, .well-known (and
+security.txt in particular), and API documentation. The scheduler's priority
+queues (see pqueues.py) dequeue the highest priority first, and requests with
+the same priority in FIFO order.
+
+CompactFifoMemoryQueue, used as SCHEDULER_MEMORY_QUEUE, keeps each pending
+request as a pickled dict of its non-default fields instead of a Request
+object. Once the pickled requests take more than FRONTIER_MEMORY_LIMIT bytes,
+further ones are written to a temporary SQLite file (in FRONTIER_SPILL_DIR if
+set), and only their row IDs are kept in memory, so millions of pending
+requests fit in a few dozen MB.
+"""
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import tempfile
+from collections import deque
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.request import request_from_dict
+
+logger = logging.getLogger(__name__)
+
+PATTERNS = {
+    r"/\.well-known/security\.txt$|/security\.txt$": 100,
+    r"/\.well-known/": 80,
+    r"(?:swagger|openapi|api-?docs|redoc|graphi?ql)|/api/?$|/docs/api": 60,
+    r"(?:^|[/._=-])(?:log-?in|sign-?in|sso|auth|oauth|saml|cas|account)"
+    r"(?:[/._?&=-]|$)": 60,
+    r"(?:^|[/._=-])(?:admin|administrator|dashboard|manage|console|cpanel|phpmyadmin)"
+    r"(?:[/._?&=-]|$)": 60,
+}
+# Values of Request.to_dict that request_from_dict also defaults to.
+DEFAULTS = {"method": "GET", "encoding": "utf-8"}
+
+
+class FrontierScorer:
+    def __init__(
+        self,
+        patterns=PATTERNS,
+        depth_weight=10,
+        novelty_weight=20,
+        max_sections=1 << 18,
+    ):
+        self.patterns = [
+            (re.compile(pattern, re.I), weight) for pattern, weight in patterns.items()
+        ]
+        self.depth_weight = depth_weight
+        self.novelty_weight = novelty_weight
+        self.max_sections = max_sections
+        # Number of requests scored for each hash of (host, first path segment).
+        self.sections = {}
+
+    def score(self, request):
+        parsed = urlparse_cached(request)
+        path = parsed.path
+        target = path + "?" + parsed.query if parsed.query else path
+        score = max(
+            (weight for pattern, weight in self.patterns if pattern.search(target)),
+            default=0,
+        )
+        score -= self.depth_weight * request.meta.get("depth", 0)
+        if self.novelty_weight:
+            section = hash((parsed.netloc, path.split("/", 2)[1] if path else ""))
+            seen = self.sections.get(section, 0)
+            if len(self.sections) >= self.max_sections:
+                self.sections.clear()
+            self.sections[section] = seen + 1
+            score += self.novelty_weight // (1 + seen)
+        return score
+
+
+class FrontierMiddleware:
+    def __init__(self, scorer, stats=None):
+        self.scorer = scorer
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool("FRONTIER_ENABLED"):
+            raise NotConfigured
+        return cls(
+            FrontierScorer(
+                patterns=s.getdict("FRONTIER_PATTERNS") or PATTERNS,
+                depth_weight=s.getint("FRONTIER_DEPTH_WEIGHT", 10),
+                novelty_weight=s.getint("FRONTIER_NOVELTY_WEIGHT", 20),
+            ),
+            crawler.stats,
+        )
+
+    def process_request(self, request):
+        if not isinstance(request, Request):
+            return request
+        score = self.scorer.score(request)
+        if self.stats and score > 0:
+            self.stats.inc_value("frontier/prioritized")
+        return request.replace(priority=request.priority + score)
+
+    def process_start_requests(self, start_requests, spider):
+        for r in start_requests:
+            yield self.process_request(r)
+
+    def process_spider_output(self, response, result, spider):
+        for r in result:
+            yield self.process_request(r)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for r in result:
+            yield self.process_request(r)
+
+
+class FrontierStore:
+    """Serializes pending requests, spilling them to SQLite past a memory limit.
+
+    Shared by all the CompactFifoMemoryQueues of a crawler.
+    """
+
+    def __init__(self, spider=None, memory_limit=256 << 20, directory=None):
+        self.spider = spider
+        self.memory_limit = memory_limit
+        self.directory = directory
+        self.memory_size = 0
+        self.db = None
+        self.path = None
+        self.spilled = 0
+
+    @classmethod
+    def for_crawler(cls, crawler):
+        """Returns the crawler's frontier store, creating it the first time."""
+        store = getattr(crawler, "frontier_store", None)
+        if store is None:
+            s = crawler.settings
+            store = crawler.frontier_store = cls(
+                crawler.spider,
+                memory_limit=s.getint("FRONTIER_MEMORY_LIMIT", 256 << 20),
+                directory=s.get("FRONTIER_SPILL_DIR"),
+            )
+            crawler.signals.connect(store.close, signal=signals.spider_closed)
+        return store
+
+    def encode(self, request):
+        d = request.to_dict(spider=self.spider)
+        return pickle.dumps(
+            {k: v for k, v in d.items() if v and DEFAULTS.get(k) != v}, protocol=4
+        )
+
+    def decode(self, data):
+        return request_from_dict(pickle.loads(data), spider=self.spider)
+
+    def put(self, request):
+        """Returns the pickled request, or its row ID once memory is full."""
+        try:
+            data = self.encode(request)
+        except ValueError:
+            # The callback isn't a spider method, so keep the request as is.
+            return request
+        if self.memory_size + len(data) <= self.memory_limit:
+            self.memory_size += len(data)
+            return data
+        if self.db is None:
+            self._open_db()
+        self.spilled += 1
+        return self.db.execute(
+            "INSERT INTO frontier (request) VALUES (?)", (data,)
+        ).lastrowid
+
+    def get(self, entry, remove=True):
+        if isinstance(entry, Request):
+            return entry
+        if isinstance(entry, bytes):
+            if remove:
+                self.memory_size -= len(entry)
+            return self.decode(entry)
+        (data,) = self.db.execute(
+            "SELECT request FROM frontier WHERE id = ?", (entry,)
+        ).fetchone()
+        if remove:
+            self.db.execute("DELETE FROM frontier WHERE id = ?", (entry,))
+        return self.decode(data)
+
+    def _open_db(self):
+        fd, self.path = tempfile.mkstemp(
+            prefix="frontier-", suffix=".sqlite3", dir=self.directory
+        )
+        os.close(fd)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute(
+            "CREATE TABLE frontier (id INTEGER PRIMARY KEY, request BLOB NOT NULL)"
+        )
+        logger.info(
+            "Pending requests exceed FRONTIER_MEMORY_LIMIT, spilling to %s", self.path
+        )
+
+    def close(self, spider=None):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.path)
+            self.db = None
+
+
+class CompactFifoMemoryQueue:
+    """FIFO queue of requests, stored through a FrontierStore."""
+
+    def __init__(self, store):
+        self.store = store
+        self.entries = deque()
+
+    @classmethod
+    def from_crawler(cls, crawler, key=None):
+        return cls(FrontierStore.for_crawler(crawler))
+
+    def push(self, request):
+        self.entries.append(self.store.put(request))
+
+    def pop(self):
+        if not self.entries:
+            return None
+        return self.store.get(self.entries.popleft())
+
+    def peek(self):
+        if not self.entries:
+            return None
+        return self.store.get(self.entries[0], remove=False)
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return len(self.entries)
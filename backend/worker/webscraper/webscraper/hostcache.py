@@ -0,0 +1,228 @@
+"""
+Persistent robots.txt and DNS caches.
+
+Every run fetches robots.txt and resolves DNS again for every domain in
+domains_file before crawling it. When HOST_CACHE_PATH is set, robots.txt
+bodies and DNS answers are kept in that SQLite file, which can be shared by
+several crawls at once (e.g. the workers of launcher.py) and reused by later
+runs:
+
+- PersistentRobotsTxtMiddleware replaces Scrapy's RobotsTxtMiddleware, and
+  keeps robots.txt bodies for ROBOTSTXT_CACHE_TTL seconds. Bodies are stored
+  rather than parsed rules, since parsing is cheap and ROBOTSTXT_PARSER may
+  change between runs. Download errors aren't cached.
+- PersistentCachingResolver, used as DNS_RESOLVER, keeps the address of each
+  hostname for DNS_CACHE_TTL seconds. Note that when crawling through a proxy,
+  Scrapy only resolves the proxy's hostname.
+
+If HOST_CACHE_REFRESH_ASYNC is set, entries that expired less than
+HOST_CACHE_MAX_STALE seconds ago are used right away, and refreshed in the
+background. Hits, misses and refreshes are counted in the
+"robotstxt/cache/..." stats, and logged for DNS when the reactor stops.
+"""
+import logging
+import os
+import sqlite3
+import time
+from scrapy.downloadermiddlewares.robotstxt import RobotsTxtMiddleware
+from scrapy.http import Request
+from scrapy.http.request import NO_CALLBACK
+from scrapy.resolver import CachingThreadedResolver, dnscache
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import defer
+from twisted.internet.base import ThreadedResolver
+
+logger = logging.getLogger(__name__)
+
+# Google ignores anything after the first 500 KiB of a robots.txt file.
+MAX_ROBOTSTXT_SIZE = 500 * 1024
+
+
+class HostCache:
+    """Key-value tables with expiry times, stored in SQLite."""
+
+    TABLES = ("robots", "dns")
+    instances = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None)
+        # Several processes can read while one writes.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for table in self.TABLES:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS %s "
+                "(key TEXT PRIMARY KEY, value BLOB, expires REAL)" % table
+            )
+
+    @classmethod
+    def open(cls, path):
+        """Returns the cache at path, shared within the process, or None if path is empty."""
+        if not path:
+            return None
+        path = os.path.abspath(path)
+        if path not in cls.instances:
+            cls.instances[path] = cls(path)
+        return cls.instances[path]
+
+    def get(self, table, key, max_stale=0):
+        """Returns (value, fresh), or None if the entry is missing or too old."""
+        row = self.db.execute(
+            "SELECT value, expires FROM %s WHERE key = ?" % table, (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        now = time.time()
+        if expires + max_stale < now:
+            return None
+        return value, expires >= now
+
+    def put(self, table, key, value, ttl):
+        self.db.execute(
+            "INSERT OR REPLACE INTO %s VALUES (?, ?, ?)" % table,
+            (key, value, time.time() + ttl),
+        )
+
+    def close(self):
+        self.db.close()
+        self.instances.pop(self.path, None)
+
+
+class PersistentRobotsTxtMiddleware(RobotsTxtMiddleware):
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        s = crawler.settings
+        self.cache = HostCache.open(s.get("HOST_CACHE_PATH"))
+        self.ttl = s.getfloat("ROBOTSTXT_CACHE_TTL", 86400)
+        self.max_stale = (
+            s.getfloat("HOST_CACHE_MAX_STALE", 604800)
+            if s.getbool("HOST_CACHE_REFRESH_ASYNC")
+            else 0
+        )
+
+    def robot_parser(self, request, spider):
+        netloc = urlparse_cached(request).netloc
+        if self.cache and netloc not in self._parsers:
+            entry = self.cache.get("robots", netloc, self.max_stale)
+            if entry is None:
+                self.crawler.stats.inc_value("robotstxt/cache/miss")
+            else:
+                body, fresh = entry
+                self._parsers[netloc] = self._parserimpl.from_crawler(
+                    self.crawler, body
+                )
+                if fresh:
+                    self.crawler.stats.inc_value("robotstxt/cache/hit")
+                else:
+                    self.crawler.stats.inc_value("robotstxt/cache/stale")
+                    self._refresh(request, netloc)
+        return super().robot_parser(request, spider)
+
+    def _parse_robots(self, response, netloc, spider):
+        self._store(response, netloc)
+        super()._parse_robots(response, netloc, spider)
+
+    def _store(self, response, netloc):
+        if self.cache:
+            self.cache.put(
+                "robots", netloc, response.body[:MAX_ROBOTSTXT_SIZE], self.ttl
+            )
+
+    def _refresh(self, request, netloc):
+        """Downloads robots.txt again, replacing the rules in use once it arrives."""
+        url = urlparse_cached(request)
+        robotsreq = Request(
+            "%s://%s/robots.txt" % (url.scheme, netloc),
+            priority=self.DOWNLOAD_PRIORITY,
+            meta={"dont_obey_robotstxt": True},
+            callback=NO_CALLBACK,
+        )
+        dfd = self.crawler.engine.download(robotsreq)
+        dfd.addCallback(self._refreshed, netloc)
+        dfd.addErrback(
+            lambda failure: self.crawler.stats.inc_value(
+                "robotstxt/cache/refresh_failed"
+            )
+        )
+
+    def _refreshed(self, response, netloc):
+        self._store(response, netloc)
+        self._parsers[netloc] = self._parserimpl.from_crawler(
+            self.crawler, response.body
+        )
+        self.crawler.stats.inc_value("robotstxt/cache/refreshed")
+
+
+class PersistentCachingResolver(CachingThreadedResolver):
+    def __init__(
+        self,
+        reactor,
+        cache_size,
+        timeout,
+        cache=None,
+        ttl=3600,
+        refresh_async=False,
+        max_stale=604800,
+    ):
+        super().__init__(reactor, cache_size, timeout)
+        self.cache = cache
+        self.ttl = ttl
+        self.max_stale = max_stale if refresh_async else 0
+        self.stats = {"hit": 0, "miss": 0, "stale": 0, "refreshed": 0}
+
+    @classmethod
+    def from_crawler(cls, crawler, reactor):
+        # crawler is the CrawlerProcess here, which has settings but no stats.
+        s = crawler.settings
+        return cls(
+            reactor,
+            s.getint("DNSCACHE_SIZE") if s.getbool("DNSCACHE_ENABLED") else 0,
+            s.getfloat("DNS_TIMEOUT"),
+            cache=HostCache.open(s.get("HOST_CACHE_PATH")),
+            ttl=s.getfloat("DNS_CACHE_TTL", 3600),
+            refresh_async=s.getbool("HOST_CACHE_REFRESH_ASYNC"),
+            max_stale=s.getfloat("HOST_CACHE_MAX_STALE", 604800),
+        )
+
+    def install_on_reactor(self):
+        super().install_on_reactor()
+        if self.cache:
+            self.reactor.addSystemEventTrigger("before", "shutdown", self.log_stats)
+
+    def getHostByName(self, name, timeout=None):
+        if self.cache is None or name in dnscache:
+            return super().getHostByName(name, timeout)
+        entry = self.cache.get("dns", name, self.max_stale)
+        if entry is None:
+            self.stats["miss"] += 1
+            d = super().getHostByName(name, timeout)
+            d.addCallback(self._store, name)
+            return d
+        address, fresh = entry
+        if dnscache.limit:
+            dnscache[name] = address
+        if fresh:
+            self.stats["hit"] += 1
+        else:
+            self.stats["stale"] += 1
+            d = ThreadedResolver.getHostByName(self, name, (self.timeout,))
+            d.addCallback(self._refreshed, name)
+            d.addErrback(lambda failure: None)
+        return defer.succeed(address)
+
+    def _store(self, address, name):
+        self.cache.put("dns", name, address, self.ttl)
+        return address
+
+    def _refreshed(self, address, name):
+        self._store(address, name)
+        if dnscache.limit:
+            dnscache[name] = address
+        self.stats["refreshed"] += 1
+
+    def log_stats(self):
+        logger.info(
+            "DNS cache: %s", " ".join("%s=%d" % kv for kv in self.stats.items())
+        )
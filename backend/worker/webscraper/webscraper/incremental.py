@@ -0,0 +1,173 @@
+"""
+Incremental recrawling.
+
+When INCREMENTAL_STATE_PATH is set, IncrementalRecrawlMiddleware keeps the
+ETag, Last-Modified header and body hash of every page in a SQLite file.
+Later runs send If-None-Match / If-Modified-Since for known pages, and
+responses that come back as 304 or with an unchanged body hash are marked with
+the `incremental_unchanged` meta key, so MainSpider emits them as unchanged
+items without a body.
+
+Since a 304 response has no links to follow, MainSpider also schedules every
+known page of its domains at startup.
+"""
+import hashlib
+import sqlite3
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from urllib.parse import urlparse
+
+
+class RecrawlState:
+    """Per-URL crawl state from previous runs, stored in SQLite."""
+
+    def __init__(self, path, commit_every=1000):
+        # Autocommit, so that the write lock is only held while flushing, and
+        # shards or jobs sharing the file wait for it instead of failing.
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                domain TEXT NOT NULL,
+                status INTEGER,
+                response_size INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_domain ON pages (domain)")
+        self.commit_every = commit_every
+        # Rows not written yet, by URL.
+        self.pending = {}
+
+    def get(self, url):
+        if url in self.pending:
+            return dict(
+                zip(
+                    ("status", "response_size", "etag", "last_modified", "body_hash"),
+                    self.pending[url][2:],
+                )
+            )
+        row = self.db.execute(
+            "SELECT status, response_size, etag, last_modified, body_hash FROM pages WHERE url = ?",
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(
+            zip(("status", "response_size", "etag", "last_modified", "body_hash"), row)
+        )
+
+    def set(self, url, status, response_size, etag, last_modified, body_hash):
+        self.pending[url] = (
+            url,
+            urlparse(url).netloc,
+            status,
+            response_size,
+            etag,
+            last_modified,
+            body_hash,
+        )
+        if len(self.pending) >= self.commit_every:
+            self.commit()
+
+    def urls(self, domains):
+        """Returns the known URLs on the given domains."""
+        for domain in domains:
+            for (url,) in self.db.execute(
+                "SELECT url FROM pages WHERE domain = ?", (domain,)
+            ):
+                yield url
+
+    def commit(self):
+        """Writes the pending rows in one short transaction."""
+        if not self.pending:
+            return
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self.pending.values(),
+            )
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        self.pending = {}
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+class IncrementalRecrawlMiddleware:
+    """Sends conditional requests and detects unchanged pages."""
+
+    def __init__(self, state, stats):
+        self.state = state
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("INCREMENTAL_STATE_PATH")
+        if not path:
+            raise NotConfigured
+        middleware = cls(RecrawlState(path), crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        spider.recrawl_state = self.state
+
+    def spider_closed(self, spider):
+        self.state.close()
+
+    def process_request(self, request, spider):
+        # Skip robots.txt requests, which must always be fetched in full.
+        if request.method != "GET" or request.meta.get("dont_obey_robotstxt"):
+            return None
+        previous = self.state.get(request.url)
+        if previous is None:
+            return None
+        request.meta["incremental_previous"] = previous
+        if previous["etag"]:
+            request.headers.setdefault("If-None-Match", previous["etag"])
+        if previous["last_modified"]:
+            request.headers.setdefault("If-Modified-Since", previous["last_modified"])
+        return None
+
+    def process_response(self, request, response, spider):
+        if request.method != "GET" or request.meta.get("dont_obey_robotstxt"):
+            return response
+        previous = request.meta.get("incremental_previous")
+        if response.status == 304 and previous:
+            request.meta["incremental_unchanged"] = True
+            self.stats.inc_value("incremental/not_modified")
+            return response
+
+        body_hash = hashlib.sha256(response.body).hexdigest()
+        if previous and previous["body_hash"] == body_hash:
+            request.meta["incremental_unchanged"] = True
+            self.stats.inc_value("incremental/unchanged")
+        else:
+            self.stats.inc_value(
+                "incremental/changed" if previous else "incremental/new"
+            )
+        self.state.set(
+            response.url,
+            response.status,
+            len(response.body),
+            _header(response, b"ETag"),
+            _header(response, b"Last-Modified"),
+            body_hash,
+        )
+        return response
+
+
+def _header(response, name):
+    value = response.headers.get(name)
+    return value.decode("latin-1") if value else None
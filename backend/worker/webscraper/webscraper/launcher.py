@@ -0,0 +1,189 @@
+"""
+Runs MainSpider in several processes and merges their output.
+
+A single scrapy process is mostly limited to one core. The launcher splits
+domains_file by domain hash across N `scrapy crawl main` processes (one per
+CPU by default). Each shard sends its items to the launcher as msgpack frames
+over a pipe, and the launcher deduplicates them across shards and writes them
+in the project's configured output mode, so it can be used in place of
+`scrapy crawl main`:
+
+    python -m webscraper.launcher --domains-file domains.txt [--workers N] [-- scrapy args]
+
+src/tasks/webscraper.ts runs it this way when WEBSCRAPER_WORKERS is set.
+
+Items from different shards are interleaved in a fixed round-robin order (see
+merge()), so the same crawl gives the same output however the shards are
+scheduled. When METRICS_PORT is set, shard i serves its metrics on
+METRICS_PORT + i.
+"""
+import argparse
+import hashlib
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+from urllib.parse import urlparse
+from scrapy.utils.project import get_project_settings
+from .dedup import build_dedup
+from .output import build_output, read_frames
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def shard_for(url, num_shards):
+    """Returns the shard that crawls the given URL's domain."""
+    domain = urlparse(url).netloc.lower()
+    digest = hashlib.blake2b(domain.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % num_shards
+
+
+def partition_urls(urls, num_shards):
+    """Splits start URLs into num_shards lists, keeping each domain in one shard."""
+    shards = [[] for _ in range(num_shards)]
+    for url in urls:
+        if url.strip():
+            shards[shard_for(url, num_shards)].append(url)
+    return shards
+
+
+def shard_settings(index, settings):
+    """Returns the `-s` arguments that differ between shards."""
+    args = []
+    port = settings.getint("METRICS_PORT")
+    if port:
+        # Shards can't all listen on the same port.
+        args += ["-s", "METRICS_PORT=%d" % (port + index)]
+    return args
+
+
+def _read_items(stream, items):
+    try:
+        for item in read_frames(stream):
+            items.put(item)
+    finally:
+        items.put(None)
+
+
+def _read_lines(stream, lock, print):
+    for line in stream:
+        with lock:
+            print(line.decode(errors="replace").rstrip("\n"))
+
+
+def merge(item_streams, line_streams, output, urls_seen, print=print, buffer=1000):
+    """Writes items from all shards to output, dropping URLs already seen.
+
+    Items are written in a fixed order: the first item of each shard in shard
+    order, then the second of each, and so on, skipping shards that have
+    finished. The output, and which shard's copy of a duplicate URL is kept,
+    don't depend on how fast each shard crawls. A shard that gets `buffer`
+    items ahead of the slowest one is held back, since its pipe fills up.
+
+    Other lines that shards print to stdout are passed through with print().
+    Returns the number of items written.
+    """
+    queues = [queue.Queue(maxsize=buffer) for _ in item_streams]
+    lock = threading.Lock()
+    readers = [
+        threading.Thread(target=_read_items, args=(s, q), daemon=True)
+        for s, q in zip(item_streams, queues)
+    ] + [
+        threading.Thread(target=_read_lines, args=(s, lock, print), daemon=True)
+        for s in line_streams
+    ]
+    for reader in readers:
+        reader.start()
+
+    written = 0
+    while queues:
+        for q in list(queues):
+            item = q.get()
+            if item is None:
+                queues.remove(q)
+            elif item["url"] not in urls_seen:
+                urls_seen.add(item["url"])
+                with lock:
+                    output.write(item)
+                written += 1
+    for reader in readers:
+        reader.join()
+    return written
+
+
+def exit_code(returncodes):
+    """Returns the launcher's exit code: the first shard's that failed, or 0.
+
+    A shard killed by a signal has a negative returncode, which is reported as
+    128 + the signal number, like a shell does.
+    """
+    for returncode in returncodes:
+        if returncode < 0:
+            return 128 - returncode
+        if returncode:
+            return returncode
+    return 0
+
+
+def launch(domains_file, workers, scrapy_args=(), settings=None):
+    """Crawls domains_file with `workers` scrapy processes. Returns the exit code."""
+    settings = settings or get_project_settings()
+    with open(domains_file, "r") as f:
+        urls = f.read().split("\n")
+    shards = [s for s in partition_urls(urls, workers) if s]
+
+    processes, item_streams, line_streams = [], [], []
+    with tempfile.TemporaryDirectory(prefix="webscraper-shards-") as directory:
+        for i, shard in enumerate(shards):
+            shard_file = os.path.join(directory, "domains-%d.txt" % i)
+            with open(shard_file, "w") as f:
+                f.write("\n".join(shard))
+            read_fd, write_fd = os.pipe()
+            processes.append(
+                subprocess.Popen(
+                    [sys.executable, "-m", "scrapy", "crawl", "main"]
+                    + ["-a", "domains_file=%s" % shard_file]
+                    + [
+                        "-s",
+                        "OUTPUT_MODE=frames",
+                        "-s",
+                        "OUTPUT_TARGET=fd:%d" % write_fd,
+                    ]
+                    + list(scrapy_args)
+                    + shard_settings(i, settings),
+                    cwd=PROJECT_DIRECTORY,
+                    stdout=subprocess.PIPE,
+                    pass_fds=(write_fd,),
+                )
+            )
+            os.close(write_fd)
+            item_streams.append(os.fdopen(read_fd, "rb"))
+            line_streams.append(processes[-1].stdout)
+
+        urls_seen = build_dedup(settings)
+        output = build_output(settings)
+        try:
+            merge(item_streams, line_streams, output, urls_seen)
+        finally:
+            output.close()
+            urls_seen.close()
+        return exit_code([p.wait() for p in processes])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run MainSpider sharded across several processes."
+    )
+    parser.add_argument("--domains-file", required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "scrapy_args", nargs="*", help="extra arguments for scrapy crawl"
+    )
+    args = parser.parse_args()
+    sys.exit(launch(args.domains_file, max(1, args.workers), args.scrapy_args))
+
+
+if __name__ == "__main__":
+    main()
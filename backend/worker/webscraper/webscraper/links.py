@@ -0,0 +1,238 @@
+"""
+Canonicalization and filtering of followed links.
+
+LinkFilterMiddleware rewrites each request that the spider yields to a
+canonical URL, so that variants of the same page are only crawled once, and
+drops requests that are likely to be crawler traps, before they are
+scheduled. URLs are canonicalized by:
+
+- lowercasing the scheme and host, and dropping the fragment and default port;
+- removing tracking and session parameters (LINK_STRIP_QUERY_PARAMS, and any
+  parameter starting with "utm_"), including ";jsessionid=..." path parameters;
+- sorting the remaining query parameters and normalizing percent-encoding.
+
+Requests are then dropped if (0 disables a rule):
+
+    extension          the path ends in one of LINK_DENY_EXTENSIONS
+    path_depth         the path has more than LINK_MAX_PATH_DEPTH segments
+    repeated_segment   a path segment appears more than LINK_MAX_SEGMENT_REPEATS
+                       times, as in /a/b/a/b/a/b
+    query_params       the URL has more than LINK_MAX_QUERY_PARAMS parameters
+    query_variants     LINK_MAX_QUERY_VARIANTS different query strings have
+                       already been seen for the same host and path
+    calendar           the URL has a date more than
+                       LINK_CALENDAR_MAX_YEARS_AHEAD years in the future
+    trailing_slash     the same URL with or without a trailing slash has
+                       already been seen (if LINK_DEDUPE_TRAILING_SLASH is set)
+
+The URLs seen by the query_variants and trailing_slash rules are forgotten
+once max_entries of them are kept, so these rules use bounded memory on long
+crawls.
+
+Trailing slashes aren't removed from URLs instead, since servers usually
+redirect "/dir" to "/dir/", which would cost an extra request per directory.
+
+The number of requests dropped by each rule is recorded in the
+"links/dropped/<rule>" stats, and the number of rewritten URLs in
+"links/canonicalized". Requests with dont_filter set are left alone.
+"""
+import re
+from datetime import date
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.linkextractors import IGNORED_EXTENSIONS
+from w3lib.url import canonicalize_url
+
+STRIP_QUERY_PARAMS = [
+    "_ga",
+    "_gl",
+    "_hsenc",
+    "_hsmi",
+    "aspsessionid",
+    "cfid",
+    "cftoken",
+    "dclid",
+    "fbclid",
+    "gclid",
+    "igshid",
+    "jsessionid",
+    "mc_cid",
+    "mc_eid",
+    "msclkid",
+    "phpsessid",
+    "sessionid",
+    "session_id",
+    "sid",
+    "yclid",
+]
+DENY_EXTENSIONS = IGNORED_EXTENSIONS + ["gz", "tgz", "msi", "jar", "woff", "woff2"]
+SESSION_PATH_PARAM = re.compile(r";(?:jsessionid|phpsessid|sid)=[^/?#]*", re.I)
+# A year followed by a month, as in 2031-05 or /2031/05/.
+DATE = re.compile(r"(?<!\d)((?:19|2\d)\d\d)[-/_](?:0?[1-9]|1[0-2])(?!\d)")
+YEAR_PARAM = re.compile(r"(?:^|&)(?:year|yr|y)=((?:19|2\d)\d\d)(?:&|$)", re.I)
+
+
+class LinkFilter:
+    def __init__(
+        self,
+        strip_query_params=STRIP_QUERY_PARAMS,
+        dedupe_trailing_slash=True,
+        deny_extensions=DENY_EXTENSIONS,
+        max_path_depth=16,
+        max_segment_repeats=2,
+        max_query_params=10,
+        max_query_variants=50,
+        calendar_max_years_ahead=2,
+        today=None,
+        max_entries=1 << 18,
+    ):
+        self.strip_query_params = {p.lower() for p in strip_query_params}
+        self.dedupe_trailing_slash = dedupe_trailing_slash
+        self.deny_extensions = tuple("." + e.lower() for e in deny_extensions)
+        self.max_path_depth = max_path_depth
+        self.max_segment_repeats = max_segment_repeats
+        self.max_query_params = max_query_params
+        self.max_query_variants = max_query_variants
+        self.max_year = (
+            (today or date.today()).year + calendar_max_years_ahead
+            if calendar_max_years_ahead
+            else 0
+        )
+        self.max_entries = max_entries
+        # Hashes of the query strings seen for each hash of (host, path).
+        self.query_variants = {}
+        # Whether the first URL seen with each hash (without a trailing slash)
+        # had a trailing slash.
+        self.slash_variants = {}
+
+    def canonicalize(self, url):
+        scheme, netloc, path, query, _ = urlsplit(url)
+        scheme = scheme.lower()
+        netloc = netloc.lower()
+        if (scheme, netloc.rpartition(":")[2]) in (("http", "80"), ("https", "443")):
+            netloc = netloc.rpartition(":")[0]
+        if ";" in path:
+            path = SESSION_PATH_PARAM.sub("", path)
+        if query:
+            params = [
+                (k, v)
+                for k, v in parse_qsl(query, keep_blank_values=True)
+                if not self.strip_param(k)
+            ]
+            query = urlencode(params)
+        return canonicalize_url(urlunsplit((scheme, netloc, path or "/", query, "")))
+
+    def strip_param(self, name):
+        name = name.lower()
+        return name in self.strip_query_params or name.startswith("utm_")
+
+    def check(self, url):
+        """Returns the name of the rule that drops url, or None to keep it."""
+        _, netloc, path, query, _ = urlsplit(url)
+        lower_path = path.lower()
+        if self.deny_extensions and lower_path.endswith(self.deny_extensions):
+            return "extension"
+        segments = [s for s in path.split("/") if s]
+        if self.max_path_depth and len(segments) > self.max_path_depth:
+            return "path_depth"
+        if self.max_segment_repeats and len(segments) > self.max_segment_repeats:
+            counts = {}
+            for segment in segments:
+                counts[segment] = counts.get(segment, 0) + 1
+                if counts[segment] > self.max_segment_repeats:
+                    return "repeated_segment"
+        if query:
+            if self.max_query_params and query.count("&") >= self.max_query_params:
+                return "query_params"
+        if self.max_year and self.far_future(lower_path, query):
+            return "calendar"
+        if query and self.max_query_variants:
+            key = hash((netloc, path))
+            variants = self.query_variants.get(key)
+            if variants is None:
+                if len(self.query_variants) >= self.max_entries:
+                    self.query_variants.clear()
+                variants = self.query_variants[key] = set()
+            fingerprint = hash(query)
+            if fingerprint not in variants:
+                if len(variants) >= self.max_query_variants:
+                    return "query_variants"
+                variants.add(fingerprint)
+        if self.dedupe_trailing_slash and len(path) > 1:
+            slash = path.endswith("/")
+            key = hash((netloc, path.rstrip("/"), query))
+            first = self.slash_variants.get(key)
+            if first is None:
+                if len(self.slash_variants) >= self.max_entries:
+                    self.slash_variants.clear()
+                first = self.slash_variants[key] = slash
+            if first != slash:
+                return "trailing_slash"
+        return None
+
+    def far_future(self, path, query):
+        for match in DATE.finditer(path):
+            if int(match.group(1)) > self.max_year:
+                return True
+        if query:
+            for match in DATE.finditer(query):
+                if int(match.group(1)) > self.max_year:
+                    return True
+            match = YEAR_PARAM.search(query)
+            if match and int(match.group(1)) > self.max_year:
+                return True
+        return False
+
+
+class LinkFilterMiddleware:
+    def __init__(self, stats, link_filter):
+        self.stats = stats
+        self.filter = link_filter
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool("LINK_FILTER_ENABLED"):
+            raise NotConfigured
+        return cls(
+            crawler.stats,
+            LinkFilter(
+                strip_query_params=s.getlist(
+                    "LINK_STRIP_QUERY_PARAMS", STRIP_QUERY_PARAMS
+                ),
+                dedupe_trailing_slash=s.getbool("LINK_DEDUPE_TRAILING_SLASH", True),
+                deny_extensions=s.getlist("LINK_DENY_EXTENSIONS", DENY_EXTENSIONS),
+                max_path_depth=s.getint("LINK_MAX_PATH_DEPTH", 16),
+                max_segment_repeats=s.getint("LINK_MAX_SEGMENT_REPEATS", 2),
+                max_query_params=s.getint("LINK_MAX_QUERY_PARAMS", 10),
+                max_query_variants=s.getint("LINK_MAX_QUERY_VARIANTS", 50),
+                calendar_max_years_ahead=s.getint("LINK_CALENDAR_MAX_YEARS_AHEAD", 2),
+            ),
+        )
+
+    def process_request(self, request):
+        """Returns the canonical version of request, or None to drop it."""
+        if not isinstance(request, Request) or request.dont_filter:
+            return request
+        url = self.filter.canonicalize(request.url)
+        rule = self.filter.check(url)
+        if rule:
+            self.stats.inc_value("links/dropped/%s" % rule)
+            return None
+        if url != request.url:
+            self.stats.inc_value("links/canonicalized")
+            request = request.replace(url=url)
+        return request
+
+    def process_spider_output(self, response, result, spider):
+        for r in result:
+            r = self.process_request(r)
+            if r is not None:
+                yield r
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for r in result:
+            r = self.process_request(r)
+            if r is not None:
+                yield r
@@ -0,0 +1,373 @@
+"""
+Crawl metrics.
+
+WebscraperSpiderMiddleware and WebscraperDownloaderMiddleware (see
+middlewares.py) record into a CrawlMetrics shared through the crawler:
+
+- per domain (grouped like budgets.py, by the domain from domains_file):
+  requests, responses by status, response bytes, download errors and a
+  download latency histogram;
+- the scheduler queue depth and the number of requests being downloaded;
+- how many scheduled requests the dupefilter rejected, and how many items
+  pipelines dropped (ExportFilePipeline drops duplicate URLs);
+- a histogram of the time items spend in the item pipelines.
+
+Counters are plain integers and histograms are preallocated lists of bucket
+counts, and only one in METRICS_SAMPLE_EVERY observations is recorded in the
+histograms, so metrics are cheap enough to leave on.
+
+They are exported in one or both of these ways:
+
+- METRICS_PORT: serves the metrics in the Prometheus text format on
+  http://METRICS_HOST:METRICS_PORT/metrics. Only the METRICS_MAX_DOMAINS
+  domains with the most requests get their own `domain` label; the others
+  are added up under domain="other", so a crawl of many domains doesn't
+  create a series per domain;
+- METRICS_TARGET: every METRICS_INTERVAL seconds, and when the crawl ends,
+  writes a {"type": "metrics", ...} snapshot as a frame (see output.py) to
+  the target, which takes the same values as OUTPUT_TARGET. The target is
+  opened once per process and left open, so that the crawls of a crawl daemon
+  share it. Snapshots have the metrics of every domain.
+"""
+import logging
+import time
+from bisect import bisect_left
+from scrapy import signals
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import reactor, task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from .budgets import SiteResolver
+from .output import encode_frame, open_target
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PIPELINE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+# Items being timed through the pipelines at once, at most.
+MAX_TIMED_ITEMS = 10000
+
+# Streams opened for METRICS_TARGET values by this process.
+_targets = {}
+
+
+def shared_target(target):
+    """Returns the stream for a METRICS_TARGET, opening it the first time."""
+    stream = _targets.get(target)
+    if stream is None or stream.closed:
+        stream = _targets[target] = open_target(target)
+    return stream
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last bucket is +Inf.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def add(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def to_dict(self):
+        return {
+            "buckets": list(self.bounds),
+            "counts": list(self.counts),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class DomainMetrics:
+    __slots__ = ("requests", "responses", "bytes", "errors", "statuses", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.responses = 0
+        self.bytes = 0
+        self.errors = 0
+        self.statuses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+    def add(self, other):
+        self.requests += other.requests
+        self.responses += other.responses
+        self.bytes += other.bytes
+        self.errors += other.errors
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.latency.add(other.latency)
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "responses": self.responses,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+            "latency": self.latency.to_dict(),
+        }
+
+
+class CrawlMetrics:
+    def __init__(self, crawler=None, sample_every=10, max_domains=100):
+        self.crawler = crawler
+        self.sample_every = max(1, sample_every)
+        self.max_domains = max_domains
+        self.domains = {}
+        self.site_for_host = SiteResolver([])
+        self.scheduled = 0
+        self.duplicates = 0
+        self.items = {"scraped": 0, "dropped": 0, "error": 0}
+        self.spider_errors = 0
+        self.pipeline = Histogram(PIPELINE_BUCKETS)
+        # (item, start time) by id(item). Holding the item keeps its id from
+        # being reused by another item while it's timed.
+        self.item_starts = {}
+        self.latency_ticks = 0
+        self.item_ticks = 0
+        self.listener = None
+        self.stream = None
+        self.task = None
+
+    @classmethod
+    def for_crawler(cls, crawler):
+        """Returns the crawler's metrics, creating them the first time."""
+        metrics = getattr(crawler, "metrics", None)
+        if metrics is None:
+            s = crawler.settings
+            metrics = crawler.metrics = cls(
+                crawler,
+                sample_every=s.getint("METRICS_SAMPLE_EVERY", 10),
+                max_domains=s.getint("METRICS_MAX_DOMAINS", 100),
+            )
+            crawler.signals.connect(metrics.spider_opened, signal=signals.spider_opened)
+            crawler.signals.connect(metrics.spider_closed, signal=signals.spider_closed)
+        return metrics
+
+    def domain(self, request):
+        site = self.site_for_host(urlparse_cached(request).hostname or "")
+        metrics = self.domains.get(site)
+        if metrics is None:
+            metrics = self.domains[site] = DomainMetrics()
+        return metrics
+
+    # Downloads
+
+    def request_sent(self, request):
+        self.domain(request).requests += 1
+
+    def response_received(self, request, response):
+        metrics = self.domain(request)
+        metrics.responses += 1
+        metrics.bytes += len(response.body)
+        statuses = metrics.statuses
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        self.latency_ticks += 1
+        if self.latency_ticks % self.sample_every == 0:
+            latency = request.meta.get("download_latency")
+            if latency is not None:
+                metrics.latency.observe(latency)
+
+    def download_failed(self, request):
+        self.domain(request).errors += 1
+
+    # Scheduler and items
+
+    def request_scheduled(self, request, spider):
+        self.scheduled += 1
+
+    def request_dropped(self, request, spider):
+        self.duplicates += 1
+
+    def item_emitted(self, item):
+        self.item_ticks += 1
+        if (
+            self.item_ticks % self.sample_every == 0
+            and len(self.item_starts) < MAX_TIMED_ITEMS
+        ):
+            self.item_starts[id(item)] = (item, time.perf_counter())
+
+    def item_done(self, item, result):
+        self.items[result] += 1
+        started = self.item_starts.pop(id(item), None)
+        if started is not None and started[0] is item:
+            self.pipeline.observe(time.perf_counter() - started[1])
+
+    def item_scraped(self, item, response, spider):
+        self.item_done(item, "scraped")
+
+    def item_dropped(self, item, response, exception, spider):
+        self.item_done(item, "dropped")
+
+    def item_error(self, item, response, spider, failure):
+        self.item_done(item, "error")
+
+    # Export
+
+    def queue_depth(self):
+        engine = getattr(self.crawler, "engine", None)
+        slot = getattr(engine, "slot", None)
+        if slot is None:
+            return 0, 0
+        return len(slot.scheduler), len(engine.downloader.active)
+
+    def snapshot(self):
+        queued, active = self.queue_depth()
+        finished = self.items["scraped"] + self.items["dropped"]
+        # Jobs of a crawl daemon share the target, so tell their snapshots apart.
+        job = getattr(self.crawler, "daemon_job", None)
+        return {
+            "type": "metrics",
+            "job_id": job.id if job else None,
+            "time": time.time(),
+            "queue_depth": queued,
+            "downloads_active": active,
+            "scheduled": self.scheduled,
+            "duplicates": self.duplicates,
+            "dedup_hit_rate": self.duplicates / self.scheduled
+            if self.scheduled
+            else 0.0,
+            "items": dict(self.items),
+            "item_dedup_hit_rate": self.items["dropped"] / finished
+            if finished
+            else 0.0,
+            "spider_errors": self.spider_errors,
+            "pipeline": self.pipeline.to_dict(),
+            "domains": {site: m.to_dict() for site, m in self.domains.items()},
+        }
+
+    def labeled_domains(self):
+        """Returns [(label, DomainMetrics)] for the Prometheus `domain` label.
+
+        The max_domains domains with the most requests keep their name, and the
+        others are added up under "other".
+        """
+        domains = sorted(self.domains.items(), key=lambda e: (-e[1].requests, e[0]))
+        labeled = sorted(domains[: self.max_domains])
+        if len(domains) > self.max_domains:
+            other = DomainMetrics()
+            for _, m in domains[self.max_domains :]:
+                other.add(m)
+            labeled.append(("other", other))
+        return labeled
+
+    def prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def sample(name, labels, value):
+            label_text = ",".join('%s="%s"' % (k, escape(v)) for k, v in labels)
+            lines.append(
+                "webscraper_%s%s %s"
+                % (name, "{%s}" % label_text if label_text else "", value)
+            )
+
+        def metric(name, kind, samples):
+            lines.append("# TYPE webscraper_%s %s" % (name, kind))
+            for labels, value in samples:
+                sample(name, labels, value)
+
+        def histogram(name, series):
+            lines.append("# TYPE webscraper_%s histogram" % name)
+            for labels, h in series:
+                cumulative = 0
+                for bound, count in zip(h.bounds + ("+Inf",), h.counts):
+                    cumulative += count
+                    sample(name + "_bucket", labels + [("le", bound)], cumulative)
+                sample(name + "_sum", labels, h.sum)
+                sample(name + "_count", labels, h.count)
+
+        queued, active = self.queue_depth()
+        metric("queue_depth", "gauge", [([], queued)])
+        metric("downloads_active", "gauge", [([], active)])
+        metric("scheduled_requests_total", "counter", [([], self.scheduled)])
+        metric("duplicate_requests_total", "counter", [([], self.duplicates)])
+        metric(
+            "items_total",
+            "counter",
+            [([("result", k)], v) for k, v in self.items.items()],
+        )
+        metric("spider_errors_total", "counter", [([], self.spider_errors)])
+        histogram("pipeline_seconds", [([], self.pipeline)])
+        domains = self.labeled_domains()
+        for name in ("requests", "responses", "bytes", "errors"):
+            metric(
+                "domain_%s_total" % name,
+                "counter",
+                [([("domain", site)], getattr(m, name)) for site, m in domains],
+            )
+        metric(
+            "domain_statuses_total",
+            "counter",
+            [
+                ([("domain", site), ("status", status)], count)
+                for site, m in domains
+                for status, count in sorted(m.statuses.items())
+            ],
+        )
+        histogram(
+            "domain_latency_seconds",
+            [([("domain", site)], m.latency) for site, m in domains],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_frame(self):
+        try:
+            self.stream.write(encode_frame(self.snapshot()))
+            self.stream.flush()
+        except OSError as e:
+            logger.warning("Failed to write metrics: %s", e)
+
+    def spider_opened(self, spider):
+        self.site_for_host = SiteResolver.for_spider(spider)
+        s = self.crawler.settings
+        port = s.getint("METRICS_PORT")
+        if port:
+            self.listener = reactor.listenTCP(
+                port,
+                Site(MetricsResource(self)),
+                interface=s.get("METRICS_HOST", "127.0.0.1"),
+            )
+        target = s.get("METRICS_TARGET")
+        if target:
+            self.stream = shared_target(target)
+            self.task = task.LoopingCall(self.write_frame)
+            self.task.start(s.getfloat("METRICS_INTERVAL", 30), now=False)
+
+    def spider_closed(self, spider):
+        if self.task and self.task.running:
+            self.task.stop()
+        # Items that never reached the end of the pipelines.
+        self.item_starts.clear()
+        if self.stream:
+            self.write_frame()
+        if self.listener:
+            return self.listener.stopListening()
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4")
+        return self.metrics.prometheus().encode()
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
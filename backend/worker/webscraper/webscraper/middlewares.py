@@ -2,102 +2,93 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+#
+# Both middlewares record crawl metrics; see webscraper/metrics.py.
 
 from scrapy import signals
-
-# useful for handling different item types with a single interface
-from itemadapter import is_item, ItemAdapter
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Request
+from .metrics import CrawlMetrics
 
 
 class WebscraperSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """Records scheduled and duplicate requests, item results and pipeline time."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        metrics = CrawlMetrics.for_crawler(crawler)
+        s = cls(metrics)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(
+            metrics.request_scheduled, signal=signals.request_scheduled
+        )
+        crawler.signals.connect(metrics.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(metrics.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(metrics.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(metrics.item_error, signal=signals.item_error)
         return s
 
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
-
-        # Should return None or raise an exception.
-        return None
-
     def process_spider_output(self, response, result, spider):
         # Called with the results returned from the Spider, after
         # it has processed the response.
-
-        # Must return an iterable of Request, or item objects.
         for i in result:
+            if not isinstance(i, Request):
+                self.metrics.item_emitted(i)
+            yield i
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for i in result:
+            if not isinstance(i, Request):
+                self.metrics.item_emitted(i)
             yield i
 
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
         # (from other spider middleware) raises an exception.
-
-        # Should return either None or an iterable of Request or item objects.
-        pass
-
-    def process_start_requests(self, start_requests, spider):
-        # Called with the start requests of the spider, and works
-        # similarly to the process_spider_output() method, except
-        # that it doesn’t have a response associated.
-
-        # Must return only requests (not items).
-        for r in start_requests:
-            yield r
+        self.metrics.spider_errors += 1
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
 class WebscraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """Records per-domain requests, responses, bytes, statuses, errors and latency."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        s = cls(CrawlMetrics.for_crawler(crawler))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
     def process_request(self, request, spider):
         # Called for each request that goes through the downloader
         # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+        self.metrics.request_sent(request)
         return None
 
     def process_response(self, request, response, spider):
         # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        self.metrics.response_received(request, response)
         return response
 
     def process_exception(self, request, exception, spider):
         # Called when a download handler or a process_request()
         # (from other downloader middleware) raises an exception.
-
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+        if not isinstance(exception, IgnoreRequest):
+            self.metrics.download_failed(request)
+        return None
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
@@ -0,0 +1,221 @@
+"""
+Near-duplicate page detection.
+
+Many sites serve thousands of near-identical pages: paginated listings,
+soft-404s that return 200, and CMS templates. NearDuplicateMiddleware computes
+a 64-bit SimHash of the words of each page body (its first NEARDUP_MAX_CHARS
+characters, without tags, scripts and styles, and with numbers replaced by
+0), and looks it up in an LSH index of the pages already seen on the same
+domain from domains_file. A page is a near duplicate of an earlier one if
+their SimHashes differ in at most NEARDUP_MAX_DISTANCE bits. The index splits
+SimHashes into NEARDUP_MAX_DISTANCE + 1 bands, so that any two such SimHashes
+have at least one band in common.
+
+NEARDUP_ACTION says what happens to near-duplicate pages:
+
+    drop        their items are dropped
+    metadata    their items are emitted without a body or headers, with
+                `near_duplicate_of` set to the URL of the earlier page
+    nofollow    their items are emitted as usual, with `near_duplicate_of`
+                set, but links from them aren't followed (the default)
+
+The number of pages and near duplicates per domain is logged as JSON when the
+crawl finishes, and the totals are in the "neardup/pages" and
+"neardup/duplicates" stats.
+"""
+import json
+import logging
+import re
+import numpy as np
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.utils.httpobj import urlparse_cached
+from .budgets import SiteResolver
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("drop", "metadata", "nofollow")
+SCRIPT_OR_STYLE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.I | re.S)
+TAG = re.compile(r"<[^>]*>")
+WORD = re.compile(r"\w+")
+DIGITS = re.compile(r"\d+")
+SHINGLE_SIZE = 3
+
+
+def simhash(text, max_chars=262144):
+    """Returns the 64-bit SimHash of the word 3-shingles of an HTML document."""
+    text = TAG.sub(" ", SCRIPT_OR_STYLE.sub(" ", text[:max_chars]))
+    # Page numbers, IDs and dates are what most templated pages differ in.
+    words = WORD.findall(DIGITS.sub("0", text.lower()))
+    if len(words) < SHINGLE_SIZE:
+        words += [""] * (SHINGLE_SIZE - len(words))
+    # Python's string hashes are randomized per process, which is fine since
+    # SimHashes are only compared within a crawl.
+    hashes = np.fromiter(
+        {hash(tuple(words[i : i + SHINGLE_SIZE])) for i in range(len(words) - 2)},
+        dtype=np.int64,
+    )
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1)
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(hashes)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+class SimHashIndex:
+    """LSH index of SimHashes, for finding those within max_distance bits."""
+
+    def __init__(self, max_distance=3, max_size=100000):
+        self.bands = max_distance + 1
+        self.band_bits = 64 // self.bands
+        self.max_distance = max_distance
+        self.max_size = max_size
+        self.tables = [{} for _ in range(self.bands)]
+        self.urls = []
+        self.hashes = []
+
+    def keys(self, value):
+        mask = (1 << self.band_bits) - 1
+        return [(value >> (i * self.band_bits)) & mask for i in range(self.bands)]
+
+    def find(self, value):
+        """Returns the URL of an indexed near duplicate of value, or None."""
+        for table, key in zip(self.tables, self.keys(value)):
+            for i in table.get(key, ()):
+                if bin(self.hashes[i] ^ value).count("1") <= self.max_distance:
+                    return self.urls[i]
+        return None
+
+    def add(self, value, url):
+        if len(self.urls) >= self.max_size:
+            return
+        i = len(self.urls)
+        self.urls.append(url)
+        self.hashes.append(value)
+        for table, key in zip(self.tables, self.keys(value)):
+            table.setdefault(key, []).append(i)
+
+
+class DomainDuplicates:
+    __slots__ = ("index", "pages", "duplicates")
+
+    def __init__(self, index):
+        self.index = index
+        self.pages = 0
+        self.duplicates = 0
+
+    def to_dict(self):
+        return {
+            "pages": self.pages,
+            "duplicates": self.duplicates,
+            "ratio": round(self.duplicates / self.pages, 4) if self.pages else 0.0,
+        }
+
+
+class NearDuplicateMiddleware:
+    def __init__(
+        self,
+        stats,
+        action="nofollow",
+        max_distance=3,
+        max_chars=262144,
+        max_pages_per_domain=100000,
+    ):
+        if action not in ACTIONS:
+            raise ValueError("Unknown NEARDUP_ACTION: %s" % action)
+        self.stats = stats
+        self.action = action
+        self.max_distance = max_distance
+        self.max_chars = max_chars
+        self.max_pages_per_domain = max_pages_per_domain
+        self.domains = {}
+        self.site_for_host = SiteResolver([])
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool("NEARDUP_ENABLED"):
+            raise NotConfigured
+        middleware = cls(
+            crawler.stats,
+            action=s.get("NEARDUP_ACTION", "nofollow"),
+            max_distance=s.getint("NEARDUP_MAX_DISTANCE", 3),
+            max_chars=s.getint("NEARDUP_MAX_CHARS", 262144),
+            max_pages_per_domain=s.getint("NEARDUP_MAX_PAGES_PER_DOMAIN", 100000),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.site_for_host = SiteResolver.for_spider(spider)
+
+    def check(self, response, item):
+        """Returns the URL of an earlier near duplicate of the item's page, or None."""
+        site = self.site_for_host(urlparse_cached(response).hostname or "")
+        domain = self.domains.get(site)
+        if domain is None:
+            domain = self.domains[site] = DomainDuplicates(
+                SimHashIndex(self.max_distance, self.max_pages_per_domain)
+            )
+        value = simhash(item["body"], self.max_chars)
+        domain.pages += 1
+        self.stats.inc_value("neardup/pages")
+        original = domain.index.find(value)
+        if original is None:
+            domain.index.add(value, item["url"])
+        else:
+            domain.duplicates += 1
+            self.stats.inc_value("neardup/duplicates")
+        return original
+
+    def process_item(self, item, original):
+        if self.action == "drop":
+            return None
+        if self.action == "metadata":
+            return dict(
+                status=item["status"],
+                url=item["url"],
+                domain_name=item["domain_name"],
+                response_size=item["response_size"],
+                near_duplicate_of=original,
+            )
+        item["near_duplicate_of"] = original
+        return item
+
+    def process_result(self, response, result, state):
+        """Returns the result, its replacement, or None to drop it.
+
+        state is shared by all the results for the same response. CrawlSpider
+        yields the items of a page before the requests for its links.
+        """
+        if isinstance(result, Request):
+            if self.action == "nofollow" and state.get("original"):
+                self.stats.inc_value("neardup/links_not_followed")
+                return None
+            return result
+        body = result.get("body") if isinstance(result, dict) else None
+        if body and body != "<binary>" and response is not None:
+            original = state["original"] = self.check(response, result)
+            if original is not None:
+                return self.process_item(result, original)
+        return result
+
+    def process_spider_output(self, response, result, spider):
+        state = {}
+        for r in result:
+            r = self.process_result(response, r, state)
+            if r is not None:
+                yield r
+
+    async def process_spider_output_async(self, response, result, spider):
+        state = {}
+        async for r in result:
+            r = self.process_result(response, r, state)
+            if r is not None:
+                yield r
+
+    def summary(self):
+        return {site: domain.to_dict() for site, domain in self.domains.items()}
+
+    def spider_closed(self, spider):
+        logger.info("Near-duplicate pages per domain: %s", json.dumps(self.summary()))
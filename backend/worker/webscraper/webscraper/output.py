@@ -0,0 +1,140 @@
+"""
+Item output channels for ExportFilePipeline.
+
+"jsonlines" (the default) prints each item as a `database_output: ` JSON line
+on stdout, which is what src/tasks/webscraper.ts parses.
+
+"frames" writes each item as a length-prefixed msgpack frame to a dedicated
+channel, so that items don't share a pipe with scrapy logs and don't need to
+be scanned for a prefix and re-parsed. Each frame is:
+
+    4 bytes   big-endian length of the rest of the frame
+    1 byte    compression (0 = none, 1 = gzip, 2 = zstd)
+    N bytes   msgpack-encoded item, compressed as indicated
+
+The channel is given by OUTPUT_TARGET, one of:
+
+    fd:<n>        an inherited file descriptor, e.g. fd:3
+    unix:<path>   a unix socket that the consumer is listening on
+    fifo:<path>   a named pipe (also works for regular files)
+
+Frames are opt-in. src/tasks/webscraper.ts reads them from fd:3 when
+WEBSCRAPER_OUTPUT_MODE is "frames" (see src/tasks/helpers/readFrames.ts),
+and webscraper.launcher reads the output of each shard with read_frames().
+"""
+import gzip
+import json
+import os
+import socket
+import struct
+import msgpack
+import zstandard
+
+COMPRESSION_NONE = 0
+COMPRESSION_GZIP = 1
+COMPRESSION_ZSTD = 2
+COMPRESSIONS = {
+    None: COMPRESSION_NONE,
+    "gzip": COMPRESSION_GZIP,
+    "zstd": COMPRESSION_ZSTD,
+}
+HEADER = struct.Struct(">IB")
+
+
+class JsonLinesOutput:
+    """Prints items as `database_output: ` JSON lines."""
+
+    def __init__(self, print=print):
+        self.print = print
+
+    def write(self, item):
+        self.print("database_output: " + json.dumps(item))
+
+    def close(self):
+        pass
+
+
+class FrameOutput:
+    """Writes items as length-prefixed msgpack frames to a binary stream."""
+
+    def __init__(self, stream, compression=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unknown OUTPUT_COMPRESSION: %s" % compression)
+        self.stream = stream
+        self.compression = COMPRESSIONS[compression]
+        self.compressor = (
+            zstandard.ZstdCompressor() if self.compression == COMPRESSION_ZSTD else None
+        )
+
+    def write(self, item):
+        self.stream.write(encode_frame(item, self.compression, self.compressor))
+
+    def close(self):
+        self.stream.close()
+
+
+def encode_frame(item, compression=COMPRESSION_NONE, compressor=None):
+    payload = msgpack.packb(item, use_bin_type=True)
+    if compression == COMPRESSION_GZIP:
+        payload = gzip.compress(payload, compresslevel=1)
+    elif compression == COMPRESSION_ZSTD:
+        payload = (compressor or zstandard.ZstdCompressor()).compress(payload)
+    return HEADER.pack(len(payload) + 1, compression) + payload
+
+
+def read_frames(stream):
+    """Yields the items from a stream of frames written by FrameOutput."""
+    decompressor = zstandard.ZstdDecompressor()
+    while True:
+        header = _read_exactly(stream, HEADER.size)
+        if not header:
+            return
+        length, compression = HEADER.unpack(header)
+        payload = _read_exactly(stream, length - 1)
+        if len(payload) != length - 1:
+            raise EOFError("Truncated frame")
+        if compression == COMPRESSION_GZIP:
+            payload = gzip.decompress(payload)
+        elif compression == COMPRESSION_ZSTD:
+            payload = decompressor.decompress(payload)
+        yield msgpack.unpackb(payload, raw=False)
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    while data and len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def open_target(target):
+    """Opens the binary stream described by an OUTPUT_TARGET value."""
+    kind, _, location = target.partition(":")
+    if kind == "fd":
+        return os.fdopen(int(location), "wb")
+    if kind == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(location)
+        stream = sock.makefile("wb")
+        # The stream holds its own reference to the socket.
+        sock.close()
+        return stream
+    if kind == "fifo":
+        return open(location, "wb")
+    raise ValueError("Unknown OUTPUT_TARGET: %s" % target)
+
+
+def build_output(settings, print=print):
+    """Builds the item output channel configured in the given Scrapy settings."""
+    mode = settings.get("OUTPUT_MODE", "jsonlines")
+    if mode == "jsonlines":
+        return JsonLinesOutput(print)
+    if mode == "frames":
+        return FrameOutput(
+            open_target(settings.get("OUTPUT_TARGET", "fd:3")),
+            compression=settings.get("OUTPUT_COMPRESSION"),
+        )
+    raise ValueError("Unknown OUTPUT_MODE: %s" % mode)
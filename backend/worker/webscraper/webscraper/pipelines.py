@@ -3,18 +3,43 @@ import json
 import os
 from io import BytesIO
 from datetime import datetime
+from .checkpoint import CrawlCheckpoint
+from .dedup import SetDedup, build_dedup
+from .output import JsonLinesOutput, build_output
 
 
 class ExportFilePipeline:
     """Prints file contents to the console."""
 
-    def __init__(self, print=print):
-        self.urls_seen = set()
+    def __init__(self, print=print, urls_seen=None, output=None):
+        self.urls_seen = SetDedup() if urls_seen is None else urls_seen
         self.print = print
+        self.output = JsonLinesOutput(print) if output is None else output
+        self.checkpoint = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            urls_seen=build_dedup(crawler.settings),
+            output=build_output(crawler.settings),
+        )
+
+    def open_spider(self, spider=None):
+        checkpoint = spider and CrawlCheckpoint.for_spider(spider)
+        if checkpoint:
+            # Keep track of emitted URLs across restarts of the same crawl.
+            self.urls_seen.close()
+            self.urls_seen = checkpoint.emitted
+            self.checkpoint = checkpoint
+
+    def close_spider(self, spider=None):
+        if not self.checkpoint:
+            self.urls_seen.close()
+        self.output.close()
 
     def process_item(self, item, spider=None):
         if item["url"] in self.urls_seen:
             raise DropItem("Duplicate item found with url: %s" % item["url"])
         self.urls_seen.add(item["url"])
-        self.print("database_output: " + json.dumps(item))
+        self.output.write(item)
         return item
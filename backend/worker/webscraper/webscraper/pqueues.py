@@ -0,0 +1,74 @@
+"""
+Scheduler priority queues.
+
+DomainRoundRobinPriorityQueue keeps one priority queue per domain from
+domains_file and dequeues from them in turn, so that a single huge site can't
+crowd out small ones. Domains whose next request would go to a downloader
+slot that is already at its concurrency limit are skipped while other domains
+have room.
+
+Enable it with:
+
+    SCHEDULER_PRIORITY_QUEUE = "webscraper.pqueues.DomainRoundRobinPriorityQueue"
+"""
+from collections import deque
+from scrapy.pqueues import DownloaderAwarePriorityQueue
+from .budgets import SiteResolver
+
+
+class DomainRoundRobinPriorityQueue(DownloaderAwarePriorityQueue):
+    def __init__(self, crawler, downstream_queue_cls, key, slot_startprios=()):
+        super().__init__(crawler, downstream_queue_cls, key, slot_startprios)
+        self.site_for_host = None
+        self.rotation = deque(self.pqueues)
+
+    def _site(self, request):
+        if self.site_for_host is None:
+            self.site_for_host = SiteResolver.for_spider(self.crawler.spider)
+        return self.site_for_host(self._downloader_interface.get_slot_key(request))
+
+    def _saturated(self, site):
+        # A domain's requests can go to several hosts, so check the downloader
+        # slot of the request that would be dequeued next.
+        request = self.pqueues[site].peek()
+        if request is None:
+            return False
+        slot_key = self._downloader_interface.get_slot_key(request)
+        slot = self._downloader_interface.downloader.slots.get(slot_key)
+        return slot is not None and len(slot.active) >= slot.concurrency
+
+    def _next_site(self):
+        """Moves domains at their concurrency limit to the back of the rotation.
+
+        Leaves the rotation as it was if every domain is at its limit.
+        """
+        for _ in range(len(self.rotation)):
+            if not self._saturated(self.rotation[0]):
+                return
+            self.rotation.rotate(-1)
+
+    def push(self, request):
+        site = self._site(request)
+        if site not in self.pqueues:
+            self.pqueues[site] = self.pqfactory(site)
+            self.rotation.append(site)
+        self.pqueues[site].push(request)
+
+    def pop(self):
+        if not self.rotation:
+            return None
+        self._next_site()
+        site = self.rotation.popleft()
+        queue = self.pqueues[site]
+        request = queue.pop()
+        if len(queue) == 0:
+            del self.pqueues[site]
+        else:
+            self.rotation.append(site)
+        return request
+
+    def peek(self):
+        if not self.rotation:
+            return None
+        self._next_site()
+        return self.pqueues[self.rotation[0]].peek()
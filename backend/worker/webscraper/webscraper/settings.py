@@ -7,6 +7,7 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 import logging
+import os
 
 BOT_NAME = "webscraper"
 
@@ -45,28 +46,216 @@ TELNETCONSOLE_ENABLED = False
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    'webscraper.middlewares.WebscraperSpiderMiddleware': 543,
-# }
+SPIDER_MIDDLEWARES = {
+    "webscraper.middlewares.WebscraperSpiderMiddleware": 543,
+    "webscraper.links.LinkFilterMiddleware": 700,
+    "webscraper.neardup.NearDuplicateMiddleware": 750,
+    # After LinkFilterMiddleware, so that it scores canonical URLs.
+    "webscraper.frontier.FrontierMiddleware": 650,
+    "webscraper.checkpoint.CheckpointMiddleware": 100,
+}
+
+# Canonicalize followed links and drop likely crawler traps (session and
+# tracking parameters, repeated path segments, query string explosions,
+# far-future calendar pages, binary file extensions). 0 disables a limit.
+# See webscraper/links.py.
+LINK_FILTER_ENABLED = True
+# LINK_DEDUPE_TRAILING_SLASH = True
+# LINK_MAX_PATH_DEPTH = 16
+# LINK_MAX_SEGMENT_REPEATS = 2
+# LINK_MAX_QUERY_PARAMS = 10
+# LINK_MAX_QUERY_VARIANTS = 50
+# LINK_CALENDAR_MAX_YEARS_AHEAD = 2
+
+# Crawl the most security-relevant pages first: login pages, admin panels,
+# .well-known and security.txt, API docs, shallow pages and new sections of a
+# site get a higher priority. Pending requests are kept pickled, and spilled
+# to a temporary SQLite file (in FRONTIER_SPILL_DIR) past FRONTIER_MEMORY_LIMIT
+# bytes. See webscraper/frontier.py.
+FRONTIER_ENABLED = True
+# FRONTIER_DEPTH_WEIGHT = 10
+# FRONTIER_NOVELTY_WEIGHT = 20
+SCHEDULER_MEMORY_QUEUE = "webscraper.frontier.CompactFifoMemoryQueue"
+# FRONTIER_MEMORY_LIMIT = 268435456
+# FRONTIER_SPILL_DIR = "/tmp"
+
+# Detect pages that are near duplicates of an earlier page on the same domain
+# (templated pages, soft 404s, paginated listings), and "drop" them, emit
+# "metadata"-only items pointing at the earlier page, or don't follow their
+# links ("nofollow"). Items are marked with near_duplicate_of either way.
+# Not following links can leave large parts of templated sites uncrawled, so
+# this is off by default. See webscraper/neardup.py.
+NEARDUP_ENABLED = False
+NEARDUP_ACTION = "nofollow"
+# NEARDUP_MAX_DISTANCE = 3
+# NEARDUP_MAX_CHARS = 262144
+# NEARDUP_MAX_PAGES_PER_DOMAIN = 100000
+
+# Extract links from only about the first LINK_EXTRACT_MAXBYTES bytes of each
+# page, and follow at most LINK_MAX_PER_PAGE links per page, sampled by URL
+# hash (0 means no limit). See webscraper/spiders/main_spider.py.
+LINK_EXTRACT_MAXBYTES = 1048576
+# LINK_MAX_PER_PAGE = 0
+
+# Directory for crawl checkpoints. When set, a crawl with a scan ID (the
+# scan_id spider argument or WEBSCRAPER_SCAN_ID) periodically saves its
+# frontier, seen requests, emitted URLs and per-domain stats, and resumes from
+# them if restarted. Snapshots are also uploaded to CHECKPOINT_S3_URI
+# ("s3://bucket/prefix"), if set. See webscraper/checkpoint.py.
+CHECKPOINT_DIR = os.getenv("WEBSCRAPER_CHECKPOINT_DIR")
+CHECKPOINT_S3_URI = os.getenv("WEBSCRAPER_CHECKPOINT_S3_URI")
+CHECKPOINT_S3_ENDPOINT_URL = "http://minio:9000" if os.getenv("IS_LOCAL") else None
+# CHECKPOINT_INTERVAL = 60
+DUPEFILTER_CLASS = "webscraper.checkpoint.CheckpointDupeFilter"
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    'webscraper.middlewares.WebscraperDownloaderMiddleware': 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+    "scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware": None,
+    "webscraper.hostcache.PersistentRobotsTxtMiddleware": 100,
+    "webscraper.budgets.DomainBudgetMiddleware": 550,
+    "webscraper.incremental.IncrementalRecrawlMiddleware": 560,
+    "webscraper.throttle.AdaptiveConcurrencyMiddleware": 580,
+    # Closest to the downloader, so that it sees every attempt and the raw
+    # response bytes.
+    "webscraper.middlewares.WebscraperDownloaderMiddleware": 950,
+    # Records responses before any other middleware has changed them.
+    "webscraper.warc.WarcRecorderMiddleware": 960,
+}
+
+# SQLite file in which robots.txt files (for ROBOTSTXT_CACHE_TTL seconds) and
+# DNS answers (for DNS_CACHE_TTL seconds) are kept across runs and processes.
+# With HOST_CACHE_REFRESH_ASYNC, entries that expired less than
+# HOST_CACHE_MAX_STALE seconds ago are used while being refreshed in the
+# background. See webscraper/hostcache.py.
+HOST_CACHE_PATH = os.getenv("WEBSCRAPER_HOST_CACHE_PATH")
+DNS_RESOLVER = "webscraper.hostcache.PersistentCachingResolver"
+# ROBOTSTXT_CACHE_TTL = 86400
+# DNS_CACHE_TTL = 3600
+# HOST_CACHE_REFRESH_ASYNC = False
+# HOST_CACHE_MAX_STALE = 604800
+
+# Per-domain latency, bytes and statuses, queue depth, dedup hit rate and
+# pipeline time. Served in the Prometheus text format on METRICS_PORT, and/or
+# written as a frame to METRICS_TARGET (like OUTPUT_TARGET) every
+# METRICS_INTERVAL seconds. Prometheus only gets a label for each of the
+# METRICS_MAX_DOMAINS domains with the most requests. See webscraper/metrics.py.
+METRICS_ENABLED = True
+METRICS_PORT = int(os.getenv("WEBSCRAPER_METRICS_PORT", "0"))
+# METRICS_HOST = "127.0.0.1"
+METRICS_TARGET = os.getenv("WEBSCRAPER_METRICS_TARGET")
+# METRICS_INTERVAL = 30
+# METRICS_SAMPLE_EVERY = 10
+# METRICS_MAX_DOMAINS = 100
+
+# Per-domain crawl budgets (0 means no limit). See webscraper/budgets.py.
+DOMAIN_MAX_PAGES = 0
+DOMAIN_MAX_DEPTH = 0
+DOMAIN_MAX_BYTES = 0
+DOMAIN_MAX_SECONDS = 0
+
+# Dequeue requests from the domains in domains_file in turn.
+# See webscraper/pqueues.py.
+SCHEDULER_PRIORITY_QUEUE = "webscraper.pqueues.DomainRoundRobinPriorityQueue"
+
+# Adjust per-host concurrency from observed latency and error rate. Both this
+# and AutoThrottle react to latency, so enable only one of them.
+# See webscraper/throttle.py.
+ADAPTIVE_CONCURRENCY_ENABLED = False
+# ADAPTIVE_CONCURRENCY_MIN = 1
+# ADAPTIVE_CONCURRENCY_MAX = 8
+# ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 2.0
+# ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE = 0.2
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-# }
+EXTENSIONS = {
+    #    'scrapy.extensions.telnet.TelnetConsole': None,
+    "webscraper.content.ContentTypeFilter": 500,
+}
+
+# Stop downloading non-text responses as soon as their headers arrive, and
+# optionally cut off text responses after DOWNLOAD_TEXT_MAXSIZE bytes.
+# See webscraper/content.py.
+DOWNLOAD_TEXT_ONLY = True
+# DOWNLOAD_TEXT_MAXSIZE = 10485760
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
+    "webscraper.bodystore.BodyStorePipeline": 200,
+    "webscraper.bodypolicy.BodyPolicyPipeline": 250,
+    "webscraper.dbsink.PostgresWebpagePipeline": 260,
     "webscraper.pipelines.ExportFilePipeline": 300,
 }
 
+# URL deduplication backend used by ExportFilePipeline. One of "set" (exact,
+# but stores every URL string), "fingerprint" (64-bit URL hashes), "bloom"
+# (scalable Bloom filter) or "disk" (fingerprints spilled to SQLite each time
+# DEDUP_MEMORY_ENTRIES of them are buffered). See webscraper/dedup.py.
+DEDUP_BACKEND = "fingerprint"
+# DEDUP_INITIAL_CAPACITY = 65536
+# DEDUP_BLOOM_ERROR_RATE = 0.0001
+# DEDUP_DISK_PATH = "dedup.sqlite3"
+# DEDUP_MEMORY_ENTRIES = 1048576
+
+# How ExportFilePipeline outputs items: "jsonlines" prints `database_output: `
+# lines on stdout, "frames" writes length-prefixed msgpack frames to
+# OUTPUT_TARGET ("fd:<n>", "unix:<path>" or "fifo:<path>"), optionally
+# compressed with "gzip" or "zstd". src/tasks/webscraper.ts reads frames from
+# fd 3 when WEBSCRAPER_OUTPUT_MODE is "frames", but can't decompress zstd.
+# See webscraper/output.py.
+OUTPUT_MODE = os.getenv("WEBSCRAPER_OUTPUT_MODE", "jsonlines")
+# OUTPUT_TARGET = "fd:3"
+# OUTPUT_COMPRESSION = "gzip"
+
+# Content-addressed store for page bodies, as "file:///path" or
+# "s3://bucket/prefix". When set, BodyStorePipeline replaces each item's body
+# with its SHA-256 (s3_key), size and an optional preview. See
+# webscraper/bodystore.py.
+BODY_STORE_URI = os.getenv("WEBSCRAPER_BODY_STORE_URI")
+BODY_STORE_S3_ENDPOINT_URL = "http://minio:9000" if os.getenv("IS_LOCAL") else None
+# BODY_PREVIEW_LENGTH = 1000
+
+# Limit and encode the bodies that are output inline (i.e. not replaced by
+# BodyStorePipeline): bodies larger than BODY_MAX_SIZE bytes keep their first
+# bytes and last BODY_TRUNCATE_TAIL bytes, and BODY_COMPRESSION ("gzip")
+# compresses and base64 encodes them, declared in body_encoding.
+# response_size is unchanged. See webscraper/bodypolicy.py.
+BODY_POLICY_ENABLED = True
+BODY_MAX_SIZE = 2097152
+# BODY_TRUNCATE_TAIL = 65536
+# BODY_COMPRESSION = "gzip"
+# BODY_COMPRESSION_MIN_SIZE = 1024
+
+# Upsert webpages into Postgres directly, in batches of DB_SINK_BATCH_SIZE
+# rows COPYed from a background thread, with at most
+# DB_SINK_MAX_PENDING_BATCHES batches waiting. The database is DB_SINK_DSN, or
+# the DB_* environment variables of the backend. Set it through
+# WEBSCRAPER_DB_SINK, which also makes webscraper.ts skip its own upserts.
+# See webscraper/dbsink.py.
+DB_SINK_ENABLED = bool(os.getenv("WEBSCRAPER_DB_SINK"))
+DB_SINK_DSN = os.getenv("WEBSCRAPER_DB_SINK_DSN")
+# DB_SINK_BATCH_SIZE = 5000
+# DB_SINK_MAX_PENDING_BATCHES = 4
+# DB_SINK_FLUSH_INTERVAL = 5
+
+# Number of jobs that `python -m webscraper.daemon` crawls at the same time,
+# each with its own CONCURRENT_REQUESTS. See webscraper/daemon.py.
+# DAEMON_MAX_JOBS = 4
+
+# SQLite file with the ETag, Last-Modified and body hash of every page from
+# previous runs. When set, known pages are requested conditionally and
+# unchanged pages are emitted without a body. See webscraper/incremental.py.
+INCREMENTAL_STATE_PATH = os.getenv("WEBSCRAPER_INCREMENTAL_STATE_PATH")
+
+# Write every downloaded response to .warc.gz files in WARC_RECORD_DIR, each
+# with a CDXJ index, so that the crawl can be replayed offline with
+# WARC_REPLAY_DIR (see the end of this file). See webscraper/warc.py.
+WARC_RECORD_DIR = os.getenv("WEBSCRAPER_WARC_RECORD_DIR")
+# WARC_PREFIX = "crossfeed"
+# WARC_MAX_SIZE = 1073741824
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 AUTOTHROTTLE_ENABLED = True
@@ -99,3 +288,17 @@ AUTOTHROTTLE_DEBUG = False
 LOG_LEVEL = logging.INFO
 
 HTTPERROR_ALLOW_ALL = True
+
+# Serve all requests from the WARC files recorded in WARC_REPLAY_DIR, without
+# throttling, since nothing goes over the network. See webscraper/warc.py.
+WARC_REPLAY_DIR = os.getenv("WEBSCRAPER_WARC_REPLAY_DIR")
+if WARC_REPLAY_DIR:
+    DOWNLOAD_HANDLERS = {
+        "http": "webscraper.warc.WarcReplayDownloadHandler",
+        "https": "webscraper.warc.WarcReplayDownloadHandler",
+    }
+    AUTOTHROTTLE_ENABLED = False
+    ADAPTIVE_CONCURRENCY_ENABLED = False
+    CONCURRENT_REQUESTS = 64
+    CONCURRENT_REQUESTS_PER_DOMAIN = 64
+    HOST_CACHE_PATH = None
@@ -1,15 +1,100 @@
 import scrapy
+from scrapy.http import TextResponse
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.linkextractors import LinkExtractor
 from urllib.parse import urlparse
+from functools import lru_cache
+from heapq import nsmallest
+from w3lib.encoding import http_content_type_encoding
+from scrapy.utils.python import to_unicode
 import hashlib
 import json
+import zlib
+from ..content import is_text_content_type
+
+
+@lru_cache(maxsize=1024)
+def _header_name(name):
+    return name.decode()
+
+
+def decode_body(response):
+    """Returns the decoded body of a response, or "<binary>" for binary content."""
+    content_type = response.headers.get(b"Content-Type")
+    if not is_text_content_type(content_type):
+        return "<binary>"
+    declared = http_content_type_encoding(to_unicode(content_type or b""))
+    if declared in (None, "utf-8"):
+        # Most pages are UTF-8, which is much faster to decode directly.
+        try:
+            return response.body.decode()
+        except UnicodeDecodeError:
+            pass
+    if isinstance(response, TextResponse):
+        # Uses the encoding from the headers, BOM or <meta> tag, detected once.
+        return response.text
+    return "<binary>"
+
+
+def response_headers(response):
+    """Returns the response headers as a list of {"name": ..., "value": ...} dicts."""
+    # Iterate over the underlying dict to skip Headers' per-key normalization.
+    return [
+        {"name": _header_name(name), "value": value.decode(errors="replace")}
+        for name, values in dict.items(response.headers)
+        for value in values
+    ]
+
+
+def response_size(response):
+    """Returns the size of the response body, including any part that wasn't downloaded."""
+    size = len(response.body)
+    if "download_stopped" in response.flags:
+        length = response.headers.get(b"Content-Length")
+        if length and length.isdigit():
+            size = max(size, int(length))
+    return size
+
+
+def link_extraction_response(response, max_bytes):
+    """Returns the response, or a copy with only about the first max_bytes of its
+    body if it's longer, to extract links from."""
+    if not max_bytes or len(response.body) <= max_bytes:
+        return response
+    # Cut before the last tag that starts within the limit, so that the
+    # prefix doesn't end in the middle of a link.
+    end = response.body.rfind(b"<", 0, max_bytes)
+    return response.replace(body=response.body[: end if end > 0 else max_bytes])
+
+
+def sample_links(links, limit):
+    """Returns at most `limit` of the links, in their original order.
+
+    The links are chosen by a hash of their URLs, so the same page always
+    yields the same sample, and the sample isn't biased towards the links at
+    the top of the page (usually navigation).
+    """
+    if not limit or len(links) <= limit:
+        return links
+    keep = set(
+        nsmallest(
+            limit, range(len(links)), key=lambda i: zlib.crc32(links[i].url.encode())
+        )
+    )
+    return [link for i, link in enumerate(links) if i in keep]
 
 
 class MainSpider(CrawlSpider):
     name = "main"
 
-    rules = (Rule(LinkExtractor(), callback="parse_item", follow=True),)
+    rules = (
+        Rule(
+            LinkExtractor(),
+            callback="parse_item",
+            follow=True,
+            process_links="limit_links",
+        ),
+    )
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -17,26 +102,67 @@ class MainSpider(CrawlSpider):
             self.start_urls = f.read().split("\n")
         self.allowed_domains = [urlparse(url).netloc for url in self.start_urls]
 
+    def start_requests(self):
+        yield from super().start_requests()
+        # Set by IncrementalRecrawlMiddleware. Pages that come back as 304
+        # have no links to follow, so all known pages are scheduled directly.
+        recrawl_state = getattr(self, "recrawl_state", None)
+        if recrawl_state:
+            for url in recrawl_state.urls(self.allowed_domains):
+                yield scrapy.Request(url)
+
+    def setting(self, name, default=0):
+        settings = getattr(self, "settings", None)
+        return settings.getint(name, default) if settings else default
+
+    def _requests_to_follow(self, response):
+        # Links are only extracted from the start of large pages, so that
+        # the whole page isn't decoded and parsed into a tree just for links.
+        max_bytes = self.setting("LINK_EXTRACT_MAXBYTES")
+        prefix = link_extraction_response(response, max_bytes)
+        if prefix is not response:
+            self.crawler.stats.inc_value("links/extract_truncated")
+        return super()._requests_to_follow(prefix)
+
+    def limit_links(self, links):
+        limit = self.setting("LINK_MAX_PER_PAGE")
+        sampled = sample_links(links, limit)
+        if len(sampled) < len(links):
+            self.crawler.stats.inc_value(
+                "links/dropped/per_page", len(links) - len(sampled)
+            )
+        return sampled
+
     def parse_start_url(self, response):
         return self.parse_item(response)
 
     def parse_item(self, response):
-        try:
-            body_decoded = response.body.decode()
-        except UnicodeDecodeError:
-            body_decoded = "<binary>"
-
-        headers = []
-        for name, values in response.headers.items():
-            for value in values:
-                headers.append({"name": name.decode(), "value": value.decode()})
+        if response.meta.get("incremental_unchanged"):
+            yield self.unchanged_item(response)
+            return
 
         item = dict(
             status=response.status,
             url=response.url,
             domain_name=urlparse(response.url).netloc,
-            body=body_decoded,
-            response_size=len(response.body),
-            headers=headers,
+            body=decode_body(response),
+            response_size=response_size(response),
+            headers=response_headers(response),
         )
         yield item
+
+    def unchanged_item(self, response):
+        """Returns an item without a body for a page that hasn't changed since the last run."""
+        previous = response.meta.get("incremental_previous", {})
+        status = response.status
+        size = len(response.body)
+        if status == 304:
+            status = previous.get("status", status)
+            size = previous.get("response_size", size)
+        return dict(
+            status=status,
+            url=response.url,
+            domain_name=urlparse(response.url).netloc,
+            response_size=size,
+            unchanged=True,
+        )
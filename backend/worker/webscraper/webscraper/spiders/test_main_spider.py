@@ -1,6 +1,6 @@
 import pytest
 from .main_spider import MainSpider
-from scrapy.http import Response, Request
+from scrapy.http import HtmlResponse, Response, Request
 from tempfile import NamedTemporaryFile
 import json
 
@@ -77,3 +77,88 @@ def test_sample_website(spider):
 
     # Make sure this doesn't give an error; this can fail if the response has any binary values.
     json.dumps(results)
+
+
+def test_binary_content_type(spider):
+    response = Response(
+        url="https://www.cisa.gov/report.pdf",
+        request=Request(url="https://www.cisa.gov/report.pdf"),
+        body=b"%PDF-1.4 abc",
+        headers={"Content-Type": "application/pdf"},
+    )
+    assert list(spider.parse_item(response))[0]["body"] == "<binary>"
+
+
+def test_text_response_uses_declared_encoding(spider):
+    response = HtmlResponse(
+        url="https://www.cisa.gov",
+        request=Request(url="https://www.cisa.gov"),
+        body="<body>Café</body>".encode("latin-1"),
+        headers={"Content-Type": "text/html; charset=ISO-8859-1"},
+    )
+    assert list(spider.parse_item(response))[0]["body"] == "<body>Café</body>"
+
+
+def test_stopped_download_reports_full_size(spider):
+    response = Response(
+        url="https://www.cisa.gov/image.png",
+        request=Request(url="https://www.cisa.gov/image.png"),
+        body=b"",
+        headers={"Content-Type": "image/png", "Content-Length": "15726"},
+        flags=["download_stopped"],
+    )
+    item = list(spider.parse_item(response))[0]
+    assert item["body"] == "<binary>"
+    assert item["response_size"] == 15726
+
+
+def test_non_utf8_header_value(spider):
+    response = Response(
+        url="https://www.cisa.gov",
+        request=Request(url="https://www.cisa.gov"),
+        body=b"<body>Hello world</body>",
+        headers={"X-Custom": b"caf\xe9"},
+    )
+    item = list(spider.parse_item(response))[0]
+    assert item["headers"] == [{"name": "X-Custom", "value": "caf�"}]
+    json.dumps(item)
+
+
+def crawler_spider(**settings):
+    from scrapy.utils.test import get_crawler
+
+    crawler = get_crawler(MainSpider, settings_dict=settings)
+    with NamedTemporaryFile() as f:
+        spider = MainSpider.from_crawler(crawler, domains_file=f.name)
+    crawler.stats.open_spider(spider)
+    return spider
+
+
+def links_page(count, padding=0):
+    links = "".join('<a href="/page/%d">%d</a>' % (i, i) for i in range(count))
+    body = "<html><body>%s%s</body></html>" % (links, "x" * padding)
+    return HtmlResponse(url="https://www.cisa.gov/", body=body.encode())
+
+
+def test_link_extraction_prefix():
+    spider = crawler_spider(LINK_EXTRACT_MAXBYTES=200)
+    response = links_page(20, padding=1000)
+    urls = [r.url for r in spider._requests_to_follow(response)]
+    # Only the links in the first 200 bytes, and not a partial one.
+    assert urls == ["https://www.cisa.gov/page/%d" % i for i in range(len(urls))]
+    assert 5 <= len(urls) < 20
+    assert spider.crawler.stats.get_value("links/extract_truncated") == 1
+
+    spider = crawler_spider(LINK_EXTRACT_MAXBYTES=0)
+    assert len(list(spider._requests_to_follow(response))) == 20
+
+
+def test_links_per_page_are_sampled_deterministically():
+    spider = crawler_spider(LINK_MAX_PER_PAGE=5)
+    urls = [r.url for r in spider._requests_to_follow(links_page(50))]
+    assert len(urls) == 5
+    assert urls == [r.url for r in spider._requests_to_follow(links_page(50))]
+    # In page order, but not just the first links.
+    assert urls == sorted(urls, key=lambda url: int(url.rsplit("/", 1)[1]))
+    assert urls != ["https://www.cisa.gov/page/%d" % i for i in range(5)]
+    assert spider.crawler.stats.get_value("links/dropped/per_page") == 90
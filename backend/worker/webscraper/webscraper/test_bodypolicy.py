@@ -0,0 +1,89 @@
+import base64
+import gzip
+import logging
+import pytest
+import re
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+from .bodypolicy import BodyPolicyPipeline, truncate
+
+
+def make_item(body, **kwargs):
+    return dict(
+        status=200,
+        url="https://www.cisa.gov",
+        domain_name="www.cisa.gov",
+        body=body,
+        response_size=len(body.encode()),
+        headers=[],
+        **kwargs,
+    )
+
+
+def test_small_bodies_are_unchanged():
+    item = make_item("<body>Hello world</body>")
+    assert BodyPolicyPipeline(max_size=1000).process_item(dict(item)) == item
+
+
+def test_truncates_head_and_tail():
+    body = "<html>" + "a" * 5000 + "b" * 5000 + "</html>"
+    pipeline = BodyPolicyPipeline(max_size=1000, tail_size=100)
+    item = pipeline.process_item(make_item(body))
+    assert item["body_truncated"]
+    assert item["response_size"] == 10013
+    stored = item["body"]
+    assert len(stored.encode()) <= 1000
+    assert stored.startswith("<html>aaa")
+    assert stored.endswith("b" * 93 + "</html>")
+    marker = re.search(r"\n<!-- crossfeed: truncated (\d+) bytes -->\n", stored)
+    assert int(marker.group(1)) == 10013 - (len(stored) - len(marker.group(0)))
+
+
+def test_truncate_keeps_valid_utf8():
+    text, removed = truncate(("é" * 1000).encode(), 101, 11)
+    assert set(text.replace(text[text.index("\n") : text.rindex("\n") + 1], "")) == {
+        "é"
+    }
+    assert len(text.encode()) <= 101
+    assert removed >= 1899
+    text, _ = truncate(b"x" * 100, 10, 0)
+    assert text.startswith("\n<!--")
+
+
+def test_compression():
+    body = "<p>Hello world</p>" * 200
+    pipeline = BodyPolicyPipeline(compression="gzip")
+    item = pipeline.process_item(make_item(body))
+    assert item["body_encoding"] == "gzip+base64"
+    assert gzip.decompress(base64.b64decode(item["body"])).decode() == body
+    assert item["response_size"] == 3600
+    # Small bodies aren't worth compressing.
+    assert "body_encoding" not in pipeline.process_item(make_item("<p></p>"))
+    with pytest.raises(ValueError):
+        BodyPolicyPipeline(compression="zstd")
+
+
+def test_size_distribution(caplog):
+    crawler = get_crawler(
+        settings_dict={"BODY_POLICY_ENABLED": True, "BODY_MAX_SIZE": 4096}
+    )
+    crawler.stats.open_spider(None)
+    pipeline = BodyPolicyPipeline.from_crawler(crawler)
+    for size in (10, 1024, 1025, 100000):
+        pipeline.process_item(make_item("x" * size))
+    # Bodies replaced by BodyStorePipeline are counted too.
+    pipeline.process_item({"url": "https://www.cisa.gov/a", "body_size": 20})
+    stats = crawler.stats.get_stats()
+    assert stats["bodypolicy/size/<=1KiB"] == 3
+    assert stats["bodypolicy/size/<=4KiB"] == 1
+    assert stats["bodypolicy/size/<=256KiB"] == 1
+    assert stats["bodypolicy/max_size"] == 100000
+    assert stats["bodypolicy/truncated"] == 1
+    with caplog.at_level(logging.INFO):
+        pipeline.close_spider()
+    assert "Body sizes: <=1KiB:3 <=4KiB:1 <=256KiB:1" in caplog.text
+
+    with pytest.raises(NotConfigured):
+        BodyPolicyPipeline.from_crawler(
+            get_crawler(settings_dict={"BODY_POLICY_ENABLED": False})
+        )
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import uuid
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+from .bodystore import (
+    BodyStorePipeline,
+    LocalBodyStore,
+    S3BodyStore,
+    build_body_store,
+)
+
+BODY = "<body>Hello world</body>"
+KEY = hashlib.sha256(BODY.encode()).hexdigest()
+
+
+@pytest.fixture
+def item():
+    return {
+        "status": 200,
+        "url": "https://www.cisa.gov",
+        "domain_name": "www.cisa.gov",
+        "body": BODY,
+        "response_size": 24,
+        "headers": [],
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalBodyStore(str(tmp_path))
+
+
+def test_replaces_body_with_reference(store, item):
+    pipeline = BodyStorePipeline(store, preview_length=6)
+    result = pipeline.process_item(item)
+    assert "body" not in result
+    assert result["s3_key"] == KEY
+    assert result["body_size"] == 24
+    assert result["body_preview"] == "<body>"
+    assert result["response_size"] == 24
+    assert store.get(KEY) == BODY.encode()
+
+
+def test_stores_identical_bodies_once(store, item):
+    pipeline = BodyStorePipeline(store)
+    pipeline.process_item(dict(item))
+    store.put = lambda key, data: pytest.fail("Body should not be stored again")
+    pipeline.process_item(dict(item, url="https://www.cisa.gov/other"))
+    # A new pipeline, e.g. from a later scan, also finds the existing body.
+    BodyStorePipeline(store).process_item(dict(item))
+
+
+def test_items_without_body_are_unchanged(store):
+    item = {"url": "https://www.cisa.gov", "s3_key": KEY}
+    assert BodyStorePipeline(store).process_item(dict(item)) == item
+
+
+def test_not_configured_without_uri():
+    with pytest.raises(NotConfigured):
+        BodyStorePipeline.from_crawler(get_crawler(settings_dict={}))
+
+
+def test_build_body_store(tmp_path):
+    store = build_body_store("file://" + str(tmp_path))
+    assert isinstance(store, LocalBodyStore)
+    assert store.root == str(tmp_path)
+    with pytest.raises(ValueError):
+        build_body_store("ftp://example.com/bodies")
+
+
+@pytest.mark.skipif(
+    not os.getenv("BODY_STORE_TEST_S3_ENDPOINT_URL"),
+    reason="Set BODY_STORE_TEST_S3_ENDPOINT_URL (e.g. http://localhost:9000) to test against minio",
+)
+def test_s3_store(item):
+    import boto3
+
+    client = boto3.client(
+        "s3",
+        endpoint_url=os.getenv("BODY_STORE_TEST_S3_ENDPOINT_URL"),
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID", "aws_access_key"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY", "aws_secret_key"),
+        region_name="us-east-1",
+    )
+    bucket = "crossfeed-webscraper-test-" + uuid.uuid4().hex[:8]
+    client.create_bucket(Bucket=bucket)
+    store = S3BodyStore(bucket, "bodies", client=client)
+    assert not store.exists(KEY)
+    BodyStorePipeline(store).process_item(item)
+    assert store.exists(KEY)
+    assert store.get(KEY) == BODY.encode()
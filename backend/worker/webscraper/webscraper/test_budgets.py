@@ -0,0 +1,82 @@
+import pytest
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+from tempfile import NamedTemporaryFile
+from .budgets import DomainBudgetMiddleware, SiteResolver
+from .spiders.main_spider import MainSpider
+
+
+@pytest.fixture
+def spider():
+    with NamedTemporaryFile() as f:
+        spider = MainSpider(domains_file=f.name)
+    spider.allowed_domains = ["www.cisa.gov", "example.gov"]
+    return spider
+
+
+def make_middleware(spider, **settings):
+    crawler = get_crawler(settings_dict=settings)
+    middleware = DomainBudgetMiddleware.from_crawler(crawler)
+    middleware.spider_opened(spider)
+    return middleware
+
+
+def download(middleware, spider, url, body=b"", **meta):
+    request = Request(url, meta=meta)
+    middleware.process_request(request, spider)
+    middleware.process_response(request, Response(url, body=body), spider)
+
+
+def test_site_resolver():
+    resolve = SiteResolver(["www.cisa.gov", "example.gov"])
+    assert resolve("www.cisa.gov") == "www.cisa.gov"
+    assert resolve("sub.example.gov") == "example.gov"
+    assert resolve("other.gov") == "other.gov"
+
+
+def test_max_pages_per_domain(spider):
+    middleware = make_middleware(spider, DOMAIN_MAX_PAGES=2)
+    download(middleware, spider, "https://example.gov/1")
+    download(middleware, spider, "https://sub.example.gov/2")
+    with pytest.raises(IgnoreRequest):
+        download(middleware, spider, "https://example.gov/3")
+    # Other domains have their own budget.
+    download(middleware, spider, "https://www.cisa.gov/1")
+    assert middleware.domains["example.gov"].dropped == 1
+
+
+def test_max_depth(spider):
+    middleware = make_middleware(spider, DOMAIN_MAX_DEPTH=1)
+    download(middleware, spider, "https://example.gov/1", depth=1)
+    with pytest.raises(IgnoreRequest):
+        download(middleware, spider, "https://example.gov/2", depth=2)
+
+
+def test_max_bytes(spider):
+    middleware = make_middleware(spider, DOMAIN_MAX_BYTES=10)
+    download(middleware, spider, "https://example.gov/1", body=b"x" * 10)
+    with pytest.raises(IgnoreRequest):
+        download(middleware, spider, "https://example.gov/2")
+
+
+def test_max_seconds(spider):
+    middleware = make_middleware(spider, DOMAIN_MAX_SECONDS=60)
+    download(middleware, spider, "https://example.gov/1")
+    middleware.domains["example.gov"].started -= 61
+    with pytest.raises(IgnoreRequest):
+        download(middleware, spider, "https://example.gov/2")
+
+
+def test_no_limits_and_stats(spider):
+    middleware = make_middleware(spider)
+    for i in range(100):
+        download(middleware, spider, "https://example.gov/%d" % i, body=b"abc")
+    middleware.process_exception(
+        Request("https://example.gov/error"), Exception(), spider
+    )
+    assert middleware.domains["example.gov"].to_dict()["pages"] == 100
+    assert middleware.domains["example.gov"].to_dict()["bytes"] == 300
+    assert middleware.domains["example.gov"].to_dict()["errors"] == 1
+    middleware.spider_closed(spider)
+    assert middleware.stats.get_value("domains/count") == 1
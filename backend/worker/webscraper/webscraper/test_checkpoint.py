@@ -0,0 +1,152 @@
+import pytest
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+from .budgets import DomainBudgetMiddleware
+from .checkpoint import CheckpointDupeFilter, CheckpointMiddleware, CrawlCheckpoint
+from .pipelines import ExportFilePipeline
+from .spiders.main_spider import MainSpider
+
+START_URL = "https://www.cisa.gov/"
+
+
+@pytest.fixture
+def settings(tmp_path):
+    return {"CHECKPOINT_DIR": str(tmp_path / "checkpoints")}
+
+
+@pytest.fixture
+def domains_file(tmp_path):
+    path = tmp_path / "domains.txt"
+    path.write_text(START_URL)
+    return str(path)
+
+
+class Run:
+    """One run of MainSpider with the checkpoint components, driven by hand."""
+
+    def __init__(self, settings, domains_file, scan_id="scan-1"):
+        self.crawler = get_crawler(MainSpider, settings_dict=settings)
+        self.spider = self.crawler._create_spider(
+            domains_file=domains_file, scan_id=scan_id
+        )
+        self.crawler.spider = self.spider
+        self.middleware = CheckpointMiddleware.from_crawler(self.crawler)
+        self.dupefilter = CheckpointDupeFilter.from_crawler(self.crawler)
+        self.dupefilter.open()
+        self.pipeline = ExportFilePipeline(print=lambda *args: None)
+        self.start_requests = list(
+            self.middleware.process_start_requests(
+                self.spider.start_requests(), self.spider
+            )
+        )
+        self.pipeline.open_spider(self.spider)
+        self.middleware.spider_opened(self.spider)
+
+    def schedule(self, request):
+        # Mirrors ExecutionEngine._schedule_request.
+        self.middleware.request_scheduled(request, self.spider)
+        if not request.dont_filter and self.dupefilter.request_seen(request):
+            self.middleware.request_dropped(request, self.spider)
+            return False
+        return True
+
+    def parse(self, request):
+        response = HtmlResponse(request.url, body=b"<body></body>", request=request)
+        result = self.spider.parse_item(response)
+        for item in self.middleware.process_spider_output(
+            response, result, self.spider
+        ):
+            self.pipeline.process_item(item)
+
+    def close(self, reason):
+        self.pipeline.close_spider(self.spider)
+        self.middleware.spider_closed(self.spider, reason)
+
+
+def test_not_configured():
+    with pytest.raises(NotConfigured):
+        CheckpointMiddleware.from_crawler(get_crawler(settings_dict={}))
+
+
+def test_disabled_without_scan_id(settings, domains_file, monkeypatch):
+    monkeypatch.delenv("WEBSCRAPER_SCAN_ID", raising=False)
+    run = Run(settings, domains_file, scan_id=None)
+    assert run.spider.checkpoint is None
+    assert [r.url for r in run.start_requests] == [START_URL]
+
+
+def test_resume_after_crash(settings, domains_file):
+    run = Run(settings, domains_file)
+    assert not run.spider.checkpoint.resumed
+    (start,) = run.start_requests
+    assert run.schedule(start)
+    run.parse(start)
+    pending = Request("https://www.cisa.gov/pending")
+    assert run.schedule(pending)
+    assert not run.schedule(Request(pending.url))
+    # The process is killed after the last periodic save.
+    run.spider.checkpoint.save()
+    del run
+
+    run = Run(settings, domains_file)
+    assert run.spider.checkpoint.resumed
+    # Only the request that wasn't downloaded is scheduled again.
+    assert [r.url for r in run.start_requests] == [pending.url]
+    assert run.start_requests[0].dont_filter
+    assert not run.schedule(Request(START_URL))
+    assert not run.schedule(Request(pending.url))
+    assert run.schedule(Request("https://www.cisa.gov/new"))
+    # Items emitted before the crash aren't emitted again.
+    with pytest.raises(DropItem):
+        run.pipeline.process_item({"url": START_URL})
+    run.parse(run.start_requests[0])
+    run.close("finished")
+
+    # A finished crawl isn't resumed.
+    run = Run(settings, domains_file)
+    assert not run.spider.checkpoint.resumed
+    assert [r.url for r in run.start_requests] == [START_URL]
+    run.pipeline.process_item({"url": START_URL})
+
+
+def test_checkpoint_per_scan_and_domains_file(settings, domains_file, tmp_path):
+    run = Run(settings, domains_file)
+    run.schedule(run.start_requests[0])
+    run.parse(run.start_requests[0])
+    run.close("shutdown")
+
+    assert Run(settings, domains_file).spider.checkpoint.resumed
+    assert not Run(settings, domains_file, scan_id="scan-2").spider.checkpoint.resumed
+    other = tmp_path / "other.txt"
+    other.write_text("https://example.gov/")
+    assert not Run(settings, str(other)).spider.checkpoint.resumed
+
+
+def test_domain_stats_restored(settings, domains_file):
+    run = Run(settings, domains_file)
+    budgets = DomainBudgetMiddleware.from_crawler(run.crawler)
+    budgets.spider_opened(run.spider)
+    budgets.domain_stats(Request(START_URL))[1].pages = 5
+    run.schedule(run.start_requests[0])
+    run.parse(run.start_requests[0])
+    run.close("shutdown")
+
+    run = Run(settings, domains_file)
+    budgets = DomainBudgetMiddleware.from_crawler(run.crawler)
+    budgets.spider_opened(run.spider)
+    assert budgets.domains["www.cisa.gov"].pages == 5
+
+
+def test_checkpoint_directory_wiped_when_finished(tmp_path):
+    checkpoint = CrawlCheckpoint(str(tmp_path))
+    checkpoint.downloaded(b"fp")
+    checkpoint.emitted.add("https://www.cisa.gov/")
+    checkpoint.save(finished=True)
+    checkpoint.close()
+
+    checkpoint = CrawlCheckpoint(str(tmp_path))
+    assert not checkpoint.resumed
+    assert not checkpoint.seen(b"fp")
+    assert "https://www.cisa.gov/" not in checkpoint.emitted
+    checkpoint.close()
@@ -0,0 +1,56 @@
+import pytest
+from scrapy.exceptions import NotConfigured, StopDownload
+from scrapy.http import Headers, Request
+from scrapy.utils.test import get_crawler
+from .content import ContentTypeFilter, is_text_content_type
+
+
+@pytest.mark.parametrize(
+    "content_type,expected",
+    [
+        (b"text/html; charset=UTF-8", True),
+        (b"TEXT/PLAIN", True),
+        (b"application/json", True),
+        (b"application/vnd.api+json", True),
+        (b"application/xhtml+xml", True),
+        (None, True),
+        (b"application/pdf", False),
+        (b"image/png", False),
+        (b"application/zip", False),
+        (b"application/octet-stream", False),
+    ],
+)
+def test_is_text_content_type(content_type, expected):
+    assert is_text_content_type(content_type) == expected
+
+
+def make_filter(**settings):
+    return ContentTypeFilter.from_crawler(get_crawler(settings_dict=settings))
+
+
+def test_not_configured():
+    with pytest.raises(NotConfigured):
+        make_filter(DOWNLOAD_TEXT_ONLY=False)
+
+
+def test_stops_binary_downloads():
+    ext = make_filter(DOWNLOAD_TEXT_ONLY=True)
+    request = Request("https://www.cisa.gov/image.png")
+    ext.headers_received(Headers({"Content-Type": "text/html"}), 10, request, None)
+    with pytest.raises(StopDownload) as e:
+        ext.headers_received(Headers({"Content-Type": "image/png"}), 10, request, None)
+    assert not e.value.fail
+    robots = Request(
+        "https://www.cisa.gov/robots.txt", meta={"dont_obey_robotstxt": True}
+    )
+    ext.headers_received(Headers({"Content-Type": "image/png"}), 10, robots, None)
+
+
+def test_stops_after_maxsize():
+    ext = make_filter(DOWNLOAD_TEXT_ONLY=False, DOWNLOAD_TEXT_MAXSIZE=10)
+    request = Request("https://www.cisa.gov")
+    ext.bytes_received(b"x" * 6, request, None)
+    with pytest.raises(StopDownload):
+        ext.bytes_received(b"x" * 6, request, None)
+    # Other requests are counted separately.
+    ext.bytes_received(b"x" * 6, Request("https://www.cisa.gov/other"), None)
@@ -0,0 +1,137 @@
+import json
+import os
+import pytest
+from scrapy.exceptions import DropItem
+from scrapy.settings import Settings
+from scrapy.signalmanager import SignalManager
+from scrapy.statscollectors import MemoryStatsCollector
+from twisted.internet import defer
+from .daemon import CrawlDaemon, DaemonExportFilePipeline, Job, JobProtocol
+
+
+class FakeEngine:
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    def close_spider(self, spider, reason):
+        self.crawler.finish(reason)
+
+
+class FakeCrawler:
+    def __init__(self):
+        self.settings = Settings()
+        self.signals = SignalManager(self)
+        self.stats = MemoryStatsCollector(self)
+        self.crawling = False
+        self.engine = FakeEngine(self)
+        self.spider = None
+        self.kwargs = None
+        self.deferred = defer.Deferred()
+
+    def finish(self, reason="finished"):
+        self.stats.set_value("finish_reason", reason)
+        self.crawling = False
+        self.deferred.callback(None)
+
+
+class FakeRunner:
+    def __init__(self):
+        self.crawlers = []
+
+    def create_crawler(self, spidercls):
+        self.crawlers.append(FakeCrawler())
+        return self.crawlers[-1]
+
+    def crawl(self, crawler, **kwargs):
+        with open(kwargs["domains_file"]) as f:
+            crawler.domains = f.read().split("\n")
+        crawler.kwargs = kwargs
+        crawler.crawling = True
+        return crawler.deferred
+
+
+class FakeTransport:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    def messages(self):
+        return [json.loads(line) for line in self.data.splitlines()]
+
+
+def test_jobs_run_concurrently_up_to_max_jobs():
+    runner = FakeRunner()
+    daemon = CrawlDaemon(runner, max_jobs=2)
+    sent = []
+    for i in range(3):
+        daemon.submit(Job(str(i), ["https://%d.gov" % i], sent.append, scan_id="s"))
+    assert len(runner.crawlers) == 2
+    assert runner.crawlers[0].domains == ["https://0.gov"]
+    assert runner.crawlers[0].kwargs["scan_id"] == "s"
+    path = runner.crawlers[0].kwargs["domains_file"]
+
+    runner.crawlers[0].finish()
+    assert not os.path.exists(path)
+    assert len(runner.crawlers) == 3
+    for crawler in runner.crawlers[1:]:
+        crawler.finish()
+    done = [m for m in sent if m["type"] == "done"]
+    assert [m["job_id"] for m in done] == ["0", "1", "2"]
+    assert all(m["finish_reason"] == "finished" for m in done)
+    assert daemon.join().called
+
+
+def test_items_are_sent_back_per_job_and_deduplicated():
+    runner = FakeRunner()
+    daemon = CrawlDaemon(runner)
+    sent = []
+    daemon.submit(Job("a", ["https://a.gov"], sent.append))
+    pipeline = DaemonExportFilePipeline.from_crawler(runner.crawlers[0])
+    item = {"url": "https://a.gov/", "status": 200}
+    pipeline.process_item(item)
+    with pytest.raises(DropItem):
+        pipeline.process_item(item)
+    runner.crawlers[0].finish()
+    assert sent[1] == {"type": "item", "job_id": "a", "item": item}
+    assert sent[2]["items"] == 1
+
+
+def test_cancel_running_and_queued_jobs():
+    runner = FakeRunner()
+    daemon = CrawlDaemon(runner, max_jobs=1)
+    sent = []
+    daemon.submit(Job("a", ["https://a.gov"], sent.append))
+    daemon.submit(Job("b", ["https://b.gov"], sent.append))
+    assert daemon.cancel("b")
+    assert daemon.cancel("a")
+    assert not daemon.cancel("c")
+    # The queued job never starts a crawl.
+    assert len(runner.crawlers) == 1
+    done = {m["job_id"]: m for m in sent if m["type"] == "done"}
+    assert done["a"]["finish_reason"] == "cancelled"
+    assert done["b"]["finish_reason"] == "cancelled"
+    assert runner.crawlers[0].stats.get_value("finish_reason") == "cancelled"
+
+
+def test_protocol():
+    runner = FakeRunner()
+    protocol = JobProtocol(CrawlDaemon(runner))
+    protocol.transport = FakeTransport()
+    protocol.connectionMade()
+    for message in (
+        {"type": "crawl", "job_id": "a", "domains": ["https://a.gov", " "]},
+        {"type": "crawl", "job_id": "a", "domains": ["https://a.gov"]},
+        {"type": "crawl", "job_id": "b", "domains": []},
+        {"type": "cancel", "job_id": "c"},
+        {"type": "stop"},
+    ):
+        protocol.lineReceived(json.dumps(message).encode())
+    protocol.lineReceived(b"not json")
+    messages = protocol.transport.messages()
+    assert [m["type"] for m in messages] == ["ready", "started"] + ["error"] * 5
+    assert runner.crawlers[0].domains == ["https://a.gov"]
+
+    protocol.connectionLost()
+    assert runner.crawlers[0].stats.get_value("finish_reason") == "cancelled"
@@ -0,0 +1,91 @@
+import pytest
+from scrapy.settings import Settings
+from .dedup import (
+    DiskDedup,
+    FingerprintDedup,
+    ScalableBloomDedup,
+    SetDedup,
+    build_dedup,
+)
+from .pipelines import ExportFilePipeline
+
+URLS = ["https://www.cisa.gov/page/%d" % i for i in range(5000)]
+UNSEEN_URLS = ["https://www.cisa.gov/other/%d" % i for i in range(5000)]
+
+
+@pytest.fixture(
+    params=[
+        SetDedup,
+        lambda: FingerprintDedup(initial_capacity=16),
+        lambda: ScalableBloomDedup(error_rate=0.001, initial_capacity=256),
+        lambda: DiskDedup(memory_entries=1000),
+    ]
+)
+def dedup(request):
+    d = request.param()
+    yield d
+    d.close()
+
+
+def test_no_false_negatives(dedup):
+    for url in URLS:
+        dedup.add(url)
+    assert all(url in dedup for url in URLS)
+
+
+def test_false_positive_rate(dedup):
+    for url in URLS:
+        dedup.add(url)
+    false_positives = sum(url in dedup for url in UNSEEN_URLS)
+    assert false_positives <= 0.001 * len(UNSEEN_URLS) * 5
+
+
+def test_disk_dedup_persists(tmp_path):
+    path = str(tmp_path / "dedup.sqlite3")
+    d = DiskDedup(path=path, memory_entries=10)
+    for url in URLS[:25]:
+        d.add(url)
+    d.close()
+
+    d = DiskDedup(path=path, memory_entries=10)
+    assert all(url in d for url in URLS[:25])
+    assert URLS[25] not in d
+    d.close()
+
+
+@pytest.mark.parametrize(
+    "backend,cls",
+    [
+        ("set", SetDedup),
+        ("fingerprint", FingerprintDedup),
+        ("bloom", ScalableBloomDedup),
+        ("disk", DiskDedup),
+    ],
+)
+def test_build_dedup(backend, cls):
+    d = build_dedup(Settings({"DEDUP_BACKEND": backend}))
+    assert isinstance(d, cls)
+    d.close()
+
+
+def test_build_dedup_unknown_backend():
+    with pytest.raises(ValueError):
+        build_dedup(Settings({"DEDUP_BACKEND": "unknown"}))
+
+
+def test_pipeline_uses_configured_backend():
+    from scrapy.utils.test import get_crawler
+
+    crawler = get_crawler(settings_dict={"DEDUP_BACKEND": "bloom"})
+    pipeline = ExportFilePipeline.from_crawler(crawler)
+    assert isinstance(pipeline.urls_seen, ScalableBloomDedup)
+
+
+def test_disk_dedup_buffer_grows():
+    d = DiskDedup(memory_entries=1 << 20)
+    assert len(d.buffer.table) <= 1 << 17
+    for url in URLS[:100]:
+        d.add(url)
+    assert not d.spilled
+    assert all(url in d for url in URLS[:100])
+    d.close()
@@ -0,0 +1,132 @@
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.pqueues import ScrapyPriorityQueue
+from scrapy.utils.test import get_crawler
+from .frontier import (
+    CompactFifoMemoryQueue,
+    FrontierMiddleware,
+    FrontierScorer,
+    FrontierStore,
+)
+
+
+class ExampleSpider(Spider):
+    name = "example"
+
+    def parse_page(self, response):
+        pass
+
+
+def test_scores():
+    score = FrontierScorer(novelty_weight=0).score
+    assert score(Request("https://a.gov/.well-known/security.txt")) == 100
+    assert score(Request("https://a.gov/security.txt")) == 100
+    assert score(Request("https://a.gov/.well-known/openid-configuration")) == 80
+    assert score(Request("https://a.gov/swagger-ui/index.html")) == 60
+    assert score(Request("https://a.gov/api/")) == 60
+    assert score(Request("https://a.gov/user/login.php")) == 60
+    assert score(Request("https://a.gov/wp-login.php")) == 60
+    assert score(Request("https://a.gov/wp-admin/")) == 60
+    assert score(Request("https://a.gov/?page=signin")) == 60
+    assert score(Request("https://a.gov/author/jane")) == 0
+    assert score(Request("https://a.gov/lessons")) == 0
+    assert score(Request("https://a.gov/admin", meta={"depth": 3})) == 30
+
+
+def test_novelty():
+    score = FrontierScorer(patterns={}, depth_weight=0).score
+    assert score(Request("https://a.gov/news/1")) == 20
+    assert score(Request("https://a.gov/news/2")) == 10
+    assert score(Request("https://a.gov/news/3")) == 6
+    assert score(Request("https://a.gov/events/1")) == 20
+    assert score(Request("https://b.gov/news/1")) == 20
+
+
+def test_middleware():
+    crawler = get_crawler(settings_dict={"FRONTIER_ENABLED": True})
+    crawler.stats.open_spider(None)
+    middleware = FrontierMiddleware.from_crawler(crawler)
+    item = {"url": "https://a.gov/"}
+    output = list(
+        middleware.process_spider_output(
+            None,
+            [
+                item,
+                Request("https://a.gov/login", meta={"depth": 1}),
+                Request("https://a.gov/page", priority=5, meta={"depth": 1}),
+            ],
+            None,
+        )
+    )
+    assert output[0] is item
+    assert [r.priority for r in output[1:]] == [70, 15]
+    assert crawler.stats.get_value("frontier/prioritized") == 2
+
+    with pytest.raises(NotConfigured):
+        FrontierMiddleware.from_crawler(
+            get_crawler(settings_dict={"FRONTIER_ENABLED": False})
+        )
+
+
+def test_priority_order():
+    crawler = get_crawler(ExampleSpider, {"FRONTIER_ENABLED": True})
+    crawler.spider = ExampleSpider()
+    middleware = FrontierMiddleware.from_crawler(crawler)
+    queue = ScrapyPriorityQueue(crawler, CompactFifoMemoryQueue, "")
+    urls = [
+        "https://a.gov/about/team",
+        "https://a.gov/about/history",
+        "https://a.gov/admin/",
+        "https://a.gov/docs/guide",
+        "https://a.gov/.well-known/security.txt",
+    ]
+    for url in urls:
+        request = Request(url, callback=crawler.spider.parse_page, meta={"depth": 1})
+        queue.push(middleware.process_request(request))
+    popped = [queue.pop() for _ in urls]
+    assert [r.url for r in popped] == [
+        "https://a.gov/.well-known/security.txt",
+        "https://a.gov/admin/",
+        "https://a.gov/about/team",
+        "https://a.gov/docs/guide",
+        "https://a.gov/about/history",
+    ]
+    assert popped[0].callback == crawler.spider.parse_page
+    assert popped[0].meta == {"depth": 1}
+    assert queue.pop() is None
+
+
+def test_spills_to_disk(tmp_path):
+    spider = ExampleSpider()
+    store = FrontierStore(spider, memory_limit=500, directory=str(tmp_path))
+    queue = CompactFifoMemoryQueue(store)
+    for i in range(10):
+        queue.push(
+            Request(
+                "https://a.gov/%d" % i,
+                callback=spider.parse_page,
+                headers={"X-Page": str(i)},
+                priority=i,
+            )
+        )
+    # Requests whose callbacks can't be serialized are kept as they are.
+    unserializable = Request("https://a.gov/lambda", callback=lambda r: None)
+    queue.push(unserializable)
+    assert len(queue) == 11
+    assert 0 < store.spilled < 10
+    assert store.memory_size <= 500
+    assert len(list(tmp_path.iterdir())) == 1
+    assert queue.peek().url == "https://a.gov/0"
+    for i in range(10):
+        request = queue.pop()
+        assert request.url == "https://a.gov/%d" % i
+        assert request.headers["X-Page"] == str(i).encode()
+        assert request.priority == i
+        assert request.callback == spider.parse_page
+    assert queue.pop() is unserializable
+    assert queue.pop() is None
+    assert store.memory_size == 0
+    store.close()
+    assert list(tmp_path.iterdir()) == []
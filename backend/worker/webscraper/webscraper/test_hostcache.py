@@ -0,0 +1,126 @@
+import pytest
+import time
+from scrapy.http import Request, TextResponse
+from scrapy.resolver import dnscache
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.internet.base import ThreadedResolver
+from .hostcache import (
+    HostCache,
+    PersistentCachingResolver,
+    PersistentRobotsTxtMiddleware,
+)
+
+ROBOTS = b"User-agent: *\nDisallow: /private\n"
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "hosts.sqlite3")
+    yield path
+    cache = HostCache.open(path)
+    cache.close()
+
+
+def test_host_cache(path, monkeypatch):
+    cache = HostCache.open(path)
+    assert HostCache.open(path) is cache
+    assert HostCache.open(None) is None
+    assert cache.get("dns", "a.gov") is None
+    cache.put("dns", "a.gov", "192.0.2.1", ttl=60)
+    assert cache.get("dns", "a.gov") == ("192.0.2.1", True)
+    # Other processes see the same entries.
+    assert HostCache(path).get("dns", "a.gov") == ("192.0.2.1", True)
+    now = time.time()
+    monkeypatch.setattr("time.time", lambda: now + 120)
+    assert cache.get("dns", "a.gov") is None
+    assert cache.get("dns", "a.gov", max_stale=100) == ("192.0.2.1", False)
+
+
+def make_middleware(path, downloads, **settings):
+    crawler = get_crawler(
+        settings_dict=dict(ROBOTSTXT_OBEY=True, HOST_CACHE_PATH=path, **settings)
+    )
+    crawler.stats.open_spider(None)
+
+    class Engine:
+        def download(self, request):
+            downloads.append(request.url)
+            return defer.succeed(
+                TextResponse(request.url, body=ROBOTS, request=request)
+            )
+
+    crawler.engine = Engine()
+    return PersistentRobotsTxtMiddleware.from_crawler(crawler)
+
+
+def allowed(middleware, url):
+    results = []
+    d = middleware.process_request(Request(url), None)
+    d.addCallbacks(lambda _: results.append(True), lambda _: results.append(False))
+    return results[0]
+
+
+def test_robots_cached_across_runs(path):
+    downloads = []
+    first = make_middleware(path, downloads)
+    assert not allowed(first, "https://a.gov/private/x")
+    assert allowed(first, "https://a.gov/public")
+    assert downloads == ["https://a.gov/robots.txt"]
+    assert first.crawler.stats.get_value("robotstxt/cache/miss") == 1
+
+    second = make_middleware(path, downloads)
+    assert not allowed(second, "https://a.gov/private/x")
+    assert downloads == ["https://a.gov/robots.txt"]
+    assert second.crawler.stats.get_value("robotstxt/cache/hit") == 1
+
+
+def test_robots_refreshed_in_background(path):
+    HostCache.open(path).put("robots", "a.gov", b"", ttl=-10)
+    downloads = []
+    middleware = make_middleware(path, downloads)
+    assert not allowed(middleware, "https://a.gov/private/x")
+    assert middleware.crawler.stats.get_value("robotstxt/cache/miss") == 1
+
+    HostCache.open(path).put("robots", "a.gov", b"", ttl=-10)
+    middleware = make_middleware(path, downloads, HOST_CACHE_REFRESH_ASYNC=True)
+    pending = defer.Deferred()
+    middleware.crawler.engine.download = lambda request: pending
+    # The stale rules are used until the new ones arrive.
+    assert allowed(middleware, "https://a.gov/private/x")
+    pending.callback(TextResponse("https://a.gov/robots.txt", body=ROBOTS))
+    assert not allowed(middleware, "https://a.gov/private/x")
+    stats = middleware.crawler.stats
+    assert stats.get_value("robotstxt/cache/stale") == 1
+    assert stats.get_value("robotstxt/cache/refreshed") == 1
+    assert HostCache.open(path).get("robots", "a.gov") == (ROBOTS, True)
+
+
+def test_resolver(path, monkeypatch):
+    lookups = []
+
+    def lookup(self, name, timeout=None):
+        lookups.append(name)
+        return defer.succeed("192.0.2.%d" % len(lookups))
+
+    monkeypatch.setattr(ThreadedResolver, "getHostByName", lookup)
+    monkeypatch.setattr(dnscache, "limit", 0)
+    cache = HostCache.open(path)
+
+    def resolve(resolver, name):
+        results = []
+        resolver.getHostByName(name).addCallback(results.append)
+        return results[0]
+
+    resolver = PersistentCachingResolver(None, 0, 60, cache=cache)
+    assert resolve(resolver, "a.gov") == "192.0.2.1"
+    resolver = PersistentCachingResolver(None, 0, 60, cache=cache)
+    assert resolve(resolver, "a.gov") == "192.0.2.1"
+    assert lookups == ["a.gov"]
+    assert resolver.stats["hit"] == 1
+
+    cache.put("dns", "a.gov", "192.0.2.1", ttl=-1)
+    resolver = PersistentCachingResolver(None, 0, 60, cache=cache, refresh_async=True)
+    assert resolve(resolver, "a.gov") == "192.0.2.1"
+    assert resolver.stats == {"hit": 0, "miss": 0, "stale": 1, "refreshed": 1}
+    assert cache.get("dns", "a.gov") == ("192.0.2.2", True)
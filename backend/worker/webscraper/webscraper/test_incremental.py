@@ -0,0 +1,102 @@
+import pytest
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+from scrapy.exceptions import NotConfigured
+from tempfile import NamedTemporaryFile
+from .incremental import IncrementalRecrawlMiddleware, RecrawlState
+from .spiders.main_spider import MainSpider
+
+URL = "https://www.cisa.gov/page"
+HEADERS = {"ETag": '"abc"', "Last-Modified": "Sun, 18 Oct 2020 00:08:03 GMT"}
+
+
+@pytest.fixture
+def spider():
+    with NamedTemporaryFile() as f:
+        return MainSpider(domains_file=f.name)
+
+
+@pytest.fixture
+def middleware(tmp_path):
+    crawler = get_crawler(
+        settings_dict={"INCREMENTAL_STATE_PATH": str(tmp_path / "state.sqlite3")}
+    )
+    return IncrementalRecrawlMiddleware.from_crawler(crawler)
+
+
+def fetch(middleware, spider, status=200, body=b"<body>Hello world</body>"):
+    request = Request(URL)
+    middleware.process_request(request, spider)
+    response = Response(URL, status=status, body=body, headers=HEADERS, request=request)
+    return request, middleware.process_response(request, response, spider)
+
+
+def test_not_configured():
+    with pytest.raises(NotConfigured):
+        IncrementalRecrawlMiddleware.from_crawler(get_crawler(settings_dict={}))
+
+
+def test_new_page(middleware, spider):
+    request, response = fetch(middleware, spider)
+    assert "If-None-Match" not in request.headers
+    assert not response.meta.get("incremental_unchanged")
+    assert middleware.state.get(URL)["etag"] == '"abc"'
+
+
+def test_conditional_request_and_not_modified(middleware, spider):
+    fetch(middleware, spider)
+    request, response = fetch(middleware, spider, status=304, body=b"")
+    assert request.headers["If-None-Match"] == b'"abc"'
+    assert request.headers["If-Modified-Since"] == HEADERS["Last-Modified"].encode()
+    assert response.meta["incremental_unchanged"]
+    assert list(spider.parse_item(response)) == [
+        {
+            "status": 200,
+            "url": URL,
+            "domain_name": "www.cisa.gov",
+            "response_size": 24,
+            "unchanged": True,
+        }
+    ]
+
+
+def test_unchanged_and_changed_body(middleware, spider):
+    fetch(middleware, spider)
+    _, response = fetch(middleware, spider)
+    assert response.meta["incremental_unchanged"]
+    _, response = fetch(middleware, spider, body=b"<body>Changed</body>")
+    assert not response.meta.get("incremental_unchanged")
+    assert list(spider.parse_item(response))[0]["body"] == "<body>Changed</body>"
+
+
+def test_robots_txt_not_conditional(middleware, spider):
+    fetch(middleware, spider)
+    request = Request(URL, meta={"dont_obey_robotstxt": True})
+    middleware.process_request(request, spider)
+    assert "If-None-Match" not in request.headers
+
+
+def test_state_persists_and_seeds_start_requests(tmp_path, spider):
+    path = str(tmp_path / "state.sqlite3")
+    state = RecrawlState(path)
+    state.set(URL, 200, 24, None, None, "hash")
+    state.set("https://other.gov/page", 200, 24, None, None, "hash")
+    state.close()
+
+    spider.start_urls = []
+    spider.allowed_domains = ["www.cisa.gov"]
+    spider.recrawl_state = RecrawlState(path)
+    assert [r.url for r in spider.start_requests()] == [URL]
+
+
+def test_states_can_share_a_file(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    first, second = RecrawlState(path), RecrawlState(path)
+    first.set(URL, 200, 24, None, None, "hash")
+    assert first.get(URL)["body_hash"] == "hash"
+    # Pending rows don't hold a lock on the file.
+    second.set("https://other.gov/page", 200, 24, None, None, "hash")
+    second.commit()
+    first.close()
+    assert second.get(URL)["status"] == 200
+    second.close()
@@ -0,0 +1,108 @@
+import time
+from io import BytesIO
+from scrapy.settings import Settings
+from .dedup import SetDedup
+from .launcher import exit_code, merge, partition_urls, shard_for, shard_settings
+from .output import FrameOutput
+
+
+class UnclosableBytesIO(BytesIO):
+    def close(self):
+        pass
+
+
+class ListOutput:
+    def __init__(self):
+        self.items = []
+
+    def write(self, item):
+        self.items.append(item)
+
+
+def frames(*urls):
+    stream = UnclosableBytesIO()
+    output = FrameOutput(stream)
+    for url in urls:
+        output.write({"url": url, "status": 200})
+    stream.seek(0)
+    return stream
+
+
+def test_partition_keeps_domains_together():
+    urls = ["https://site%d.gov/" % i for i in range(100)] + [
+        "https://site1.gov/other",
+        "",
+    ]
+    shards = partition_urls(urls, 4)
+    assert sorted(sum(shards, [])) == sorted(u for u in urls if u)
+    assert shard_for("https://site1.gov/", 4) == shard_for("https://SITE1.gov/other", 4)
+    for i, shard in enumerate(shards):
+        assert all(shard_for(url, 4) == i for url in shard)
+
+
+def test_merge_dedups_across_shards_and_keeps_order():
+    output = ListOutput()
+    lines = []
+    written = merge(
+        [
+            frames("https://a.gov/1", "https://a.gov/2", "https://b.gov/shared"),
+            frames("https://b.gov/1", "https://b.gov/shared", "https://b.gov/2"),
+        ],
+        [BytesIO(b"some log line\n")],
+        output,
+        SetDedup(),
+        print=lines.append,
+    )
+    assert written == 5
+    # Round-robin in shard order; the first copy of b.gov/shared is kept.
+    assert [item["url"] for item in output.items] == [
+        "https://a.gov/1",
+        "https://b.gov/1",
+        "https://a.gov/2",
+        "https://b.gov/shared",
+        "https://b.gov/2",
+    ]
+    assert lines == ["some log line"]
+
+
+def test_merge_order_does_not_depend_on_timing():
+    class SlowStream(UnclosableBytesIO):
+        def read(self, *args):
+            time.sleep(0.01)
+            return super().read(*args)
+
+    output = ListOutput()
+    merge(
+        [
+            SlowStream(frames("https://a.gov/1", "https://a.gov/2").read()),
+            frames("https://b.gov/1", "https://b.gov/2", "https://b.gov/3"),
+            frames(),
+        ],
+        [],
+        output,
+        SetDedup(),
+        buffer=1,
+    )
+    assert [item["url"] for item in output.items] == [
+        "https://a.gov/1",
+        "https://b.gov/1",
+        "https://a.gov/2",
+        "https://b.gov/2",
+        "https://b.gov/3",
+    ]
+
+
+def test_exit_code_reports_any_failed_shard():
+    assert exit_code([]) == 0
+    assert exit_code([0, 0]) == 0
+    assert exit_code([0, 2, 1]) == 2
+    # Killed by SIGKILL.
+    assert exit_code([0, -9]) == 137
+
+
+def test_shards_get_their_own_metrics_port():
+    assert shard_settings(1, Settings({"METRICS_PORT": 0})) == []
+    assert shard_settings(2, Settings({"METRICS_PORT": 9410})) == [
+        "-s",
+        "METRICS_PORT=9412",
+    ]
@@ -0,0 +1,104 @@
+import pytest
+from datetime import date
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+from .links import LinkFilter, LinkFilterMiddleware
+
+
+@pytest.fixture
+def link_filter():
+    return LinkFilter(today=date(2024, 6, 1))
+
+
+def test_canonicalize(link_filter):
+    canonicalize = link_filter.canonicalize
+    assert (
+        canonicalize("HTTPS://WWW.Example.GOV:443/Path?b=2&utm_source=x&a=1#top")
+        == "https://www.example.gov/Path?a=1&b=2"
+    )
+    assert (
+        canonicalize("http://example.gov/a;jsessionid=ABC123?PHPSESSID=1&q=x%2fy")
+        == "http://example.gov/a?q=x%2Fy"
+    )
+    assert canonicalize("http://example.gov:8080") == "http://example.gov:8080/"
+    assert canonicalize("http://example.gov/?fbclid=1") == "http://example.gov/"
+
+
+def test_rules(link_filter):
+    check = link_filter.check
+    assert check("https://example.gov/report.PDF") == "extension"
+    assert check("https://example.gov/archive.tar.gz") == "extension"
+    assert check("https://example.gov/" + "/".join("d%d" % i for i in range(17))) == (
+        "path_depth"
+    )
+    assert check("https://example.gov/a/b/a/b/a/b") == "repeated_segment"
+    assert check("https://example.gov/a/b/a/b") is None
+    query = "&".join("p%d=1" % i for i in range(11))
+    assert check("https://example.gov/search?" + query) == "query_params"
+    assert check("https://example.gov/calendar/2027/01") == "calendar"
+    assert check("https://example.gov/events?month=2031-05") == "calendar"
+    assert check("https://example.gov/events?year=2030") == "calendar"
+    assert check("https://example.gov/calendar/2026/12") is None
+    assert check("https://example.gov/news/1999/01/story") is None
+    assert check("https://example.gov/news/203105") is None
+
+
+def test_query_variants():
+    link_filter = LinkFilter(max_query_variants=3)
+    for i in range(3):
+        assert link_filter.check("https://example.gov/list?page=%d" % i) is None
+    assert link_filter.check("https://example.gov/list?page=0") is None
+    assert link_filter.check("https://example.gov/list?page=3") == "query_variants"
+    assert link_filter.check("https://other.gov/list?page=3") is None
+
+
+def test_trailing_slash(link_filter):
+    assert link_filter.check("https://example.gov/dir/") is None
+    assert link_filter.check("https://example.gov/dir/") is None
+    assert link_filter.check("https://example.gov/dir") == "trailing_slash"
+    assert link_filter.check("https://example.gov/page") is None
+    assert link_filter.check("https://example.gov/page/") == "trailing_slash"
+    assert LinkFilter(dedupe_trailing_slash=False).check("https://a.gov/x/") is None
+
+
+def test_seen_urls_are_bounded():
+    link_filter = LinkFilter(max_query_variants=1, max_entries=2)
+    assert link_filter.check("https://example.gov/a?page=1") is None
+    assert link_filter.check("https://example.gov/a?page=2") == "query_variants"
+    for path in ("b", "c", "d/"):
+        assert link_filter.check("https://example.gov/%s?page=1" % path) is None
+        assert len(link_filter.query_variants) <= 2
+        assert len(link_filter.slash_variants) <= 2
+    # Variants of URLs that are still kept are dropped, /a has been forgotten.
+    assert link_filter.check("https://example.gov/d?page=1") == "trailing_slash"
+    assert link_filter.check("https://example.gov/a?page=2") is None
+
+
+def test_middleware():
+    crawler = get_crawler(settings_dict={"LINK_FILTER_ENABLED": True})
+    crawler.stats.open_spider(None)
+    middleware = LinkFilterMiddleware.from_crawler(crawler)
+    item = {"url": "https://example.gov/"}
+    result = [
+        item,
+        Request("https://example.gov/page?utm_campaign=x"),
+        Request("https://example.gov/logo.png"),
+        Request("https://example.gov/logo.png", dont_filter=True),
+        Request("https://example.gov/a/a/a"),
+    ]
+    output = list(middleware.process_spider_output(None, result, None))
+    assert output[0] is item
+    assert [r.url for r in output[1:]] == [
+        "https://example.gov/page",
+        "https://example.gov/logo.png",
+    ]
+    stats = crawler.stats.get_stats()
+    assert stats["links/canonicalized"] == 1
+    assert stats["links/dropped/extension"] == 1
+    assert stats["links/dropped/repeated_segment"] == 1
+
+    with pytest.raises(NotConfigured):
+        LinkFilterMiddleware.from_crawler(
+            get_crawler(settings_dict={"LINK_FILTER_ENABLED": False})
+        )
@@ -0,0 +1,215 @@
+import pytest
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+from tempfile import NamedTemporaryFile
+from twisted.web.test.requesthelper import DummyRequest
+from .daemon import Job
+from .metrics import CrawlMetrics, MetricsResource, shared_target
+from .middlewares import WebscraperDownloaderMiddleware, WebscraperSpiderMiddleware
+from .output import read_frames
+from .spiders.main_spider import MainSpider
+
+
+@pytest.fixture
+def spider():
+    with NamedTemporaryFile() as f:
+        spider = MainSpider(domains_file=f.name)
+    spider.allowed_domains = ["example.gov"]
+    return spider
+
+
+def make_crawler(**settings):
+    settings.setdefault("METRICS_ENABLED", True)
+    settings.setdefault("METRICS_SAMPLE_EVERY", 1)
+    crawler = get_crawler(settings_dict=settings)
+    spider_mw = WebscraperSpiderMiddleware.from_crawler(crawler)
+    downloader_mw = WebscraperDownloaderMiddleware.from_crawler(crawler)
+    return crawler, spider_mw, downloader_mw
+
+
+def download(middleware, spider, url, status=200, body=b"", latency=0.2):
+    request = Request(url, meta={"download_latency": latency})
+    middleware.process_request(request, spider)
+    middleware.process_response(
+        request, Response(url, status=status, body=body), spider
+    )
+
+
+def test_disabled():
+    crawler = get_crawler(settings_dict={"METRICS_ENABLED": False})
+    with pytest.raises(NotConfigured):
+        WebscraperSpiderMiddleware.from_crawler(crawler)
+    with pytest.raises(NotConfigured):
+        WebscraperDownloaderMiddleware.from_crawler(crawler)
+
+
+def test_records_downloads_and_items(spider):
+    crawler, spider_mw, downloader_mw = make_crawler()
+    metrics = crawler.metrics
+    assert spider_mw.metrics is downloader_mw.metrics is metrics
+    metrics.spider_opened(spider)
+
+    download(downloader_mw, spider, "https://example.gov/1", body=b"x" * 100)
+    download(downloader_mw, spider, "https://sub.example.gov/2", status=404)
+    download(downloader_mw, spider, "https://other.gov/", latency=3)
+    downloader_mw.process_exception(Request("https://example.gov/3"), OSError(), spider)
+
+    for url in ("https://example.gov/1", "https://example.gov/1"):
+        request = Request(url)
+        crawler.signals.send_catch_log(
+            signal=signals.request_scheduled, request=request, spider=spider
+        )
+    crawler.signals.send_catch_log(
+        signal=signals.request_dropped, request=request, spider=spider
+    )
+
+    items = [{"url": "https://example.gov/1"}, {"url": "https://example.gov/1"}]
+    output = list(
+        spider_mw.process_spider_output(
+            None, items + [Request("https://a.gov")], spider
+        )
+    )
+    assert len(output) == 3
+    crawler.signals.send_catch_log(
+        signal=signals.item_scraped, item=items[0], response=None, spider=spider
+    )
+    crawler.signals.send_catch_log(
+        signal=signals.item_dropped,
+        item=items[1],
+        response=None,
+        exception=DropItem(),
+        spider=spider,
+    )
+
+    snapshot = metrics.snapshot()
+    domain = snapshot["domains"]["example.gov"]
+    assert domain["requests"] == 2
+    assert domain["responses"] == 2
+    assert domain["bytes"] == 100
+    assert domain["errors"] == 1
+    assert domain["statuses"] == {"200": 1, "404": 1}
+    assert domain["latency"]["count"] == 2
+    assert domain["latency"]["counts"][2] == 2
+    assert snapshot["domains"]["other.gov"]["latency"]["counts"][6] == 1
+    assert snapshot["dedup_hit_rate"] == 0.5
+    assert snapshot["items"] == {"scraped": 1, "dropped": 1, "error": 0}
+    assert snapshot["item_dedup_hit_rate"] == 0.5
+    assert snapshot["pipeline"]["count"] == 2
+    assert metrics.item_starts == {}
+
+
+def test_histogram_sampling(spider):
+    crawler, _, downloader_mw = make_crawler(METRICS_SAMPLE_EVERY=4)
+    crawler.metrics.spider_opened(spider)
+    for i in range(10):
+        download(downloader_mw, spider, "https://example.gov/%d" % i)
+    domain = crawler.metrics.domains["example.gov"]
+    assert domain.responses == 10
+    assert domain.latency.count == 2
+
+
+def test_prometheus(spider):
+    crawler, _, downloader_mw = make_crawler()
+    crawler.metrics.spider_opened(spider)
+    download(downloader_mw, spider, "https://example.gov/", body=b"abc")
+    download(downloader_mw, spider, 'https://a"b.gov/', status=500)
+
+    request = DummyRequest([b"metrics"])
+    text = MetricsResource(crawler.metrics).render_GET(request).decode()
+    lines = text.splitlines()
+    assert request.responseHeaders.getRawHeaders(b"Content-Type")[0].startswith(
+        b"text/plain"
+    )
+    assert 'webscraper_domain_bytes_total{domain="example.gov"} 3' in lines
+    assert (
+        'webscraper_domain_statuses_total{domain="a\\"b.gov",status="500"} 1' in lines
+    )
+    assert (
+        'webscraper_domain_latency_seconds_bucket{domain="example.gov",le="+Inf"} 1'
+        in lines
+    )
+    assert 'webscraper_items_total{result="scraped"} 0' in lines
+    assert lines.count("# TYPE webscraper_domain_latency_seconds histogram") == 1
+    assert "webscraper_queue_depth 0" in lines
+
+
+def test_prometheus_caps_domain_labels(spider):
+    crawler, _, downloader_mw = make_crawler(METRICS_MAX_DOMAINS=2)
+    crawler.metrics.spider_opened(spider)
+    for site, count in (("a.gov", 3), ("b.gov", 1), ("c.gov", 2), ("d.gov", 1)):
+        for _ in range(count):
+            download(downloader_mw, spider, "https://%s/" % site, body=b"abc")
+
+    lines = crawler.metrics.prometheus().splitlines()
+    requests = [
+        line for line in lines if line.startswith("webscraper_domain_requests_total")
+    ]
+    assert requests == [
+        'webscraper_domain_requests_total{domain="a.gov"} 3',
+        'webscraper_domain_requests_total{domain="c.gov"} 2',
+        'webscraper_domain_requests_total{domain="other"} 2',
+    ]
+    assert 'webscraper_domain_statuses_total{domain="other",status="200"} 2' in lines
+    assert 'webscraper_domain_latency_seconds_count{domain="other"} 2' in lines
+    # Snapshots keep every domain.
+    assert sorted(crawler.metrics.snapshot()["domains"]) == [
+        "a.gov",
+        "b.gov",
+        "c.gov",
+        "d.gov",
+    ]
+
+
+def test_frames(spider, tmp_path):
+    path = tmp_path / "metrics"
+    path.touch()
+    crawler, _, downloader_mw = make_crawler(METRICS_TARGET="fifo:%s" % path)
+    crawler.metrics.spider_opened(spider)
+    download(downloader_mw, spider, "https://example.gov/")
+    crawler.metrics.write_frame()
+    download(downloader_mw, spider, "https://example.gov/")
+    crawler.metrics.spider_closed(spider)
+
+    with open(path, "rb") as f:
+        frames = list(read_frames(f))
+    assert [f["type"] for f in frames] == ["metrics", "metrics"]
+    assert frames[0]["job_id"] is None
+    assert [f["domains"]["example.gov"]["responses"] for f in frames] == [1, 2]
+    assert not crawler.metrics.task.running
+
+
+def test_frames_share_the_target(spider, tmp_path):
+    path = tmp_path / "metrics"
+    path.touch()
+    target = "fifo:%s" % path
+    for job_id in ("a", "b"):
+        crawler, _, _ = make_crawler(METRICS_TARGET=target)
+        crawler.daemon_job = Job(job_id, [], None)
+        crawler.metrics.spider_opened(spider)
+        crawler.metrics.spider_closed(spider)
+    assert crawler.metrics.stream is shared_target(target)
+    assert not crawler.metrics.stream.closed
+    with open(path, "rb") as f:
+        assert [f["job_id"] for f in read_frames(f)] == ["a", "b"]
+
+
+def test_pipeline_timing_checks_item_identity(spider):
+    crawler, spider_mw, _ = make_crawler()
+    metrics = crawler.metrics
+    item = {"url": "https://example.gov/"}
+    list(spider_mw.process_spider_output(None, [item], spider))
+    # A different item that happens to get the same id isn't timed.
+    metrics.item_starts[id(item)] = ({}, 0)
+    metrics.item_scraped(item, None, spider)
+    assert metrics.pipeline.count == 0
+    list(spider_mw.process_spider_output(None, [item], spider))
+    metrics.spider_closed(spider)
+    assert metrics.item_starts == {}
+
+
+def test_shared_per_crawler():
+    crawler = get_crawler()
+    assert CrawlMetrics.for_crawler(crawler) is CrawlMetrics.for_crawler(crawler)
+    assert CrawlMetrics.for_crawler(get_crawler()) is not crawler.metrics
@@ -0,0 +1,134 @@
+import pytest
+import random
+import string
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+from .neardup import NearDuplicateMiddleware, SimHashIndex, simhash
+
+TEMPLATE = (
+    "<html><head><title>Agency</title><script>var page = %d;</script></head>"
+    "<body><nav>Home About Contact Services News Events Careers</nav>"
+    "<h1>Page not found</h1><p>The page %d you requested could not be found. "
+    "Please check the address or use the search box.</p>"
+    "<footer>Copyright 2024 Agency. All rights reserved.</footer></body></html>"
+)
+
+VOCABULARY = [
+    "".join(random.Random(i).choices(string.ascii_lowercase, k=6)) for i in range(500)
+]
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def test_simhash():
+    assert distance(simhash(TEMPLATE % (1, 1)), simhash(TEMPLATE % (2, 2))) == 0
+    rng = random.Random(0)
+    words = " ".join(rng.choice(VOCABULARY) for _ in range(5000))
+    assert distance(simhash(words), simhash(words + " one more sentence")) <= 3
+    assert distance(simhash(words), simhash(TEMPLATE % (1, 1))) > 10
+    assert simhash("") == simhash("<p></p>")
+
+
+def test_index():
+    index = SimHashIndex(max_distance=3)
+    index.add(0b1111, "https://a.gov/1")
+    assert index.find(0b1111) == "https://a.gov/1"
+    assert index.find(0b0111 | 1 << 63 | 1 << 40) == "https://a.gov/1"
+    assert index.find(0b0000 | 1 << 63) is None
+    full = SimHashIndex(max_size=1)
+    full.add(1, "https://a.gov/1")
+    full.add(2, "https://a.gov/2")
+    assert full.urls == ["https://a.gov/1"]
+
+
+def crawl(middleware, pages):
+    """Returns the output of the middleware for each (url, body, links)."""
+    outputs = []
+    for url, body, links in pages:
+        response = HtmlResponse(url, body=body.encode())
+        item = dict(
+            status=200,
+            url=url,
+            domain_name=response.url.split("/")[2],
+            body=body,
+            response_size=len(body),
+            headers=[],
+        )
+        result = [item] + [Request(link) for link in links]
+        outputs.append(list(middleware.process_spider_output(response, result, None)))
+    return outputs
+
+
+PAGES = [
+    ("https://a.gov/missing/1", TEMPLATE % (1, 1), ["https://a.gov/x"]),
+    ("https://a.gov/missing/2", TEMPLATE % (2, 2), ["https://a.gov/y"]),
+    ("https://www.a.gov/about", "<p>About the agency and what it does</p>", []),
+    ("https://b.gov/missing/3", TEMPLATE % (3, 3), []),
+]
+
+
+@pytest.fixture
+def crawler():
+    crawler = get_crawler(settings_dict={"NEARDUP_ENABLED": True})
+    crawler.stats.open_spider(None)
+    return crawler
+
+
+class Spider:
+    allowed_domains = ["a.gov", "b.gov"]
+
+
+def make_middleware(crawler, action):
+    middleware = NearDuplicateMiddleware(crawler.stats, action=action)
+    middleware.spider_opened(Spider())
+    return middleware
+
+
+def test_metadata(crawler):
+    middleware = make_middleware(crawler, "metadata")
+    outputs = crawl(middleware, PAGES)
+    assert outputs[0][0]["body"] == TEMPLATE % (1, 1)
+    assert outputs[1][0] == {
+        "status": 200,
+        "url": "https://a.gov/missing/2",
+        "domain_name": "a.gov",
+        "response_size": len(TEMPLATE % (2, 2)),
+        "near_duplicate_of": "https://a.gov/missing/1",
+    }
+    assert outputs[1][1].url == "https://a.gov/y"
+    # Other domains have their own index.
+    assert "near_duplicate_of" not in outputs[3][0]
+    assert middleware.summary() == {
+        "a.gov": {"pages": 3, "duplicates": 1, "ratio": 0.3333},
+        "b.gov": {"pages": 1, "duplicates": 0, "ratio": 0.0},
+    }
+    assert crawler.stats.get_value("neardup/pages") == 4
+    assert crawler.stats.get_value("neardup/duplicates") == 1
+
+
+def test_drop_and_nofollow(crawler):
+    outputs = crawl(make_middleware(crawler, "drop"), PAGES[:2])
+    assert [r.url for r in outputs[1]] == ["https://a.gov/y"]
+    outputs = crawl(make_middleware(crawler, "nofollow"), PAGES[:2])
+    assert len(outputs[0]) == 2
+    assert outputs[1] == [
+        dict(
+            outputs[1][0],
+            body=TEMPLATE % (2, 2),
+            near_duplicate_of="https://a.gov/missing/1",
+        )
+    ]
+    assert "near_duplicate_of" not in outputs[0][0]
+    assert crawler.stats.get_value("neardup/links_not_followed") == 1
+
+
+def test_not_configured():
+    with pytest.raises(NotConfigured):
+        NearDuplicateMiddleware.from_crawler(
+            get_crawler(settings_dict={"NEARDUP_ENABLED": False})
+        )
+    with pytest.raises(ValueError):
+        NearDuplicateMiddleware(None, action="skip")
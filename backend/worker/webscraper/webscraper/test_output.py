@@ -0,0 +1,106 @@
+import os
+import socket
+import threading
+import pytest
+from io import BytesIO
+from scrapy.settings import Settings
+from .output import (
+    FrameOutput,
+    JsonLinesOutput,
+    build_output,
+    open_target,
+    read_frames,
+)
+from .pipelines import ExportFilePipeline
+
+ITEMS = [
+    {
+        "status": 200,
+        "url": "https://www.cisa.gov/%d" % i,
+        "domain_name": "www.cisa.gov",
+        "body": "<body>Hello world %d</body>" % i,
+        "response_size": 24,
+        "headers": [{"name": "Server", "value": "Apache"}],
+    }
+    for i in range(3)
+]
+
+
+class UnclosableBytesIO(BytesIO):
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_frames_round_trip(compression):
+    stream = UnclosableBytesIO()
+    output = FrameOutput(stream, compression=compression)
+    for item in ITEMS:
+        output.write(item)
+    output.close()
+    stream.seek(0)
+    assert list(read_frames(stream)) == ITEMS
+
+
+def test_truncated_frame():
+    stream = UnclosableBytesIO()
+    FrameOutput(stream).write(ITEMS[0])
+    with pytest.raises(EOFError):
+        list(read_frames(BytesIO(stream.getvalue()[:-1])))
+
+
+def test_fd_target():
+    r, w = os.pipe()
+    output = FrameOutput(open_target("fd:%d" % w))
+    for item in ITEMS:
+        output.write(item)
+    output.close()
+    with os.fdopen(r, "rb") as f:
+        assert list(read_frames(f)) == ITEMS
+
+
+def test_unix_socket_target(tmp_path):
+    path = str(tmp_path / "items.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    received = []
+
+    def consume():
+        conn, _ = server.accept()
+        with conn.makefile("rb") as f:
+            received.extend(read_frames(f))
+        conn.close()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    output = FrameOutput(open_target("unix:" + path), compression="zstd")
+    for item in ITEMS:
+        output.write(item)
+    output.close()
+    consumer.join(5)
+    server.close()
+    assert received == ITEMS
+
+
+def test_build_output(tmp_path):
+    assert isinstance(build_output(Settings()), JsonLinesOutput)
+    path = str(tmp_path / "items.bin")
+    output = build_output(
+        Settings({"OUTPUT_MODE": "frames", "OUTPUT_TARGET": "fifo:" + path})
+    )
+    assert isinstance(output, FrameOutput)
+    output.close()
+    with pytest.raises(ValueError):
+        build_output(Settings({"OUTPUT_MODE": "unknown"}))
+
+
+def test_pipeline_frames_mode():
+    stream = UnclosableBytesIO()
+    print = lambda line: pytest.fail("Items should not be printed")
+    pipeline = ExportFilePipeline(print=print, output=FrameOutput(stream))
+    for item in ITEMS:
+        pipeline.process_item(item)
+    pipeline.close_spider()
+    stream.seek(0)
+    assert list(read_frames(stream)) == ITEMS
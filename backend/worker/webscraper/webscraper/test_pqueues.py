@@ -0,0 +1,74 @@
+import pytest
+from scrapy.http import Request
+from scrapy.squeues import FifoMemoryQueue
+from scrapy.utils.test import get_crawler
+from .pqueues import DomainRoundRobinPriorityQueue
+
+
+class Slot:
+    def __init__(self, concurrency, active):
+        self.concurrency = concurrency
+        self.active = set(range(active))
+
+
+@pytest.fixture
+def crawler():
+    crawler = get_crawler()
+
+    class Spider:
+        allowed_domains = ["a.gov", "b.gov", "c.gov"]
+
+    class Downloader:
+        slots = {}
+
+        def _get_slot_key(self, request, spider):
+            return request.meta.get("download_slot") or request.url.split("/")[2]
+
+    class Engine:
+        downloader = Downloader()
+
+    crawler.spider = Spider()
+    crawler.engine = Engine()
+    return crawler
+
+
+@pytest.fixture
+def queue(crawler):
+    return DomainRoundRobinPriorityQueue(crawler, FifoMemoryQueue, "")
+
+
+def test_round_robin_across_domains(queue):
+    for i in range(3):
+        queue.push(Request("https://a.gov/%d" % i))
+    queue.push(Request("https://www.b.gov/0"))
+    queue.push(Request("https://c.gov/0"))
+    assert len(queue) == 5
+    urls = [queue.pop().url for _ in range(5)]
+    assert urls == [
+        "https://a.gov/0",
+        "https://www.b.gov/0",
+        "https://c.gov/0",
+        "https://a.gov/1",
+        "https://a.gov/2",
+    ]
+    assert queue.pop() is None
+
+
+def test_skips_saturated_domains(queue, crawler):
+    queue.push(Request("https://a.gov/0"))
+    queue.push(Request("https://b.gov/0"))
+    crawler.engine.downloader.slots["a.gov"] = Slot(concurrency=2, active=2)
+    assert queue.pop().url == "https://b.gov/0"
+    # Saturated domains are still dequeued when nothing else is left.
+    assert queue.pop().url == "https://a.gov/0"
+
+
+def test_saturation_is_checked_per_host(queue, crawler):
+    queue.push(Request("https://www.a.gov/0"))
+    queue.push(Request("https://a.gov/1"))
+    queue.push(Request("https://b.gov/0"))
+    crawler.engine.downloader.slots["www.a.gov"] = Slot(concurrency=1, active=1)
+    assert queue.peek().url == "https://b.gov/0"
+    assert queue.pop().url == "https://b.gov/0"
+    assert queue.pop().url == "https://www.a.gov/0"
+    assert queue.pop().url == "https://a.gov/1"
@@ -0,0 +1,64 @@
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+from .throttle import AdaptiveConcurrencyMiddleware
+
+
+class Slot:
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+
+
+@pytest.fixture
+def slot():
+    return Slot(concurrency=4)
+
+
+@pytest.fixture
+def middleware(slot):
+    crawler = get_crawler(
+        settings_dict={
+            "ADAPTIVE_CONCURRENCY_ENABLED": True,
+            "ADAPTIVE_CONCURRENCY_MAX": 6,
+            "ADAPTIVE_CONCURRENCY_TARGET_LATENCY": 1.0,
+            "ADAPTIVE_CONCURRENCY_WINDOW": 1,
+        }
+    )
+
+    class Engine:
+        class downloader:
+            slots = {"example.gov": slot}
+
+    crawler.engine = Engine()
+    return AdaptiveConcurrencyMiddleware.from_crawler(crawler)
+
+
+def respond(middleware, status=200, latency=0.1):
+    request = Request(
+        "https://example.gov",
+        meta={"download_slot": "example.gov", "download_latency": latency},
+    )
+    middleware.process_response(request, Response(request.url, status=status), None)
+
+
+def test_not_configured():
+    with pytest.raises(NotConfigured):
+        AdaptiveConcurrencyMiddleware.from_crawler(get_crawler())
+
+
+def test_increases_up_to_max(middleware, slot):
+    for _ in range(5):
+        respond(middleware)
+    assert slot.concurrency == 6
+
+
+def test_halves_on_high_latency(middleware, slot):
+    respond(middleware, latency=5)
+    assert slot.concurrency == 2
+
+
+def test_halves_on_errors(middleware, slot):
+    for _ in range(3):
+        respond(middleware, status=503)
+    assert slot.concurrency == 1
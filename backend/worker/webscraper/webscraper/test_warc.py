@@ -0,0 +1,138 @@
+import glob
+import os
+import pytest
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse, Request, Response, TextResponse
+from scrapy.utils.test import get_crawler
+from .warc import (
+    CdxIndex,
+    WarcRecorderMiddleware,
+    WarcReplayDownloadHandler,
+    WarcWriter,
+    index_warc,
+    read_records,
+    url_key,
+)
+
+
+def page(url, body, status=200, **kwargs):
+    return HtmlResponse(
+        url,
+        status=status,
+        headers={"Content-Type": "text/html; charset=utf-8"},
+        body=body.encode(),
+        **kwargs,
+    )
+
+
+def replay(handler, url):
+    result = []
+    handler.download_request(Request(url), None).addBoth(result.append)
+    return result[0]
+
+
+def test_url_key():
+    assert (
+        url_key("https://WWW.CISA.gov/about?b=2&a=1#x") == "gov,cisa,www)/about?a=1&b=2"
+    )
+    assert url_key("http://127.0.0.1:8000") == "1,0,0,127:8000)/"
+
+
+def test_record_and_replay(tmp_path):
+    writer = WarcWriter(str(tmp_path), max_size=2000)
+    for i in range(20):
+        writer.write(page("https://a.gov/%d" % i, "page %d " % i * 50))
+    writer.write(page("https://a.gov/missing", "", status=404))
+    writer.write(
+        Response(
+            "https://a.gov/file",
+            headers={"Content-Type": "application/pdf", "Transfer-Encoding": "chunked"},
+            body=b"%PDF",
+        ),
+        truncated=True,
+    )
+    writer.close()
+    # The files were rotated, and each has its own index.
+    assert len(glob.glob(str(tmp_path / "*.warc.gz"))) > 1
+    assert len(glob.glob(str(tmp_path / "*.cdxj"))) > 1
+
+    handler = WarcReplayDownloadHandler(str(tmp_path))
+    response = replay(handler, "https://a.gov/7")
+    assert isinstance(response, TextResponse)
+    assert response.status == 200
+    assert response.text == "page 7 " * 50
+    assert response.headers["Content-Type"] == b"text/html; charset=utf-8"
+    assert response.flags == ["replayed"]
+    assert replay(handler, "https://a.gov/missing").status == 404
+
+    response = replay(handler, "https://a.gov/file")
+    assert response.body == b"%PDF"
+    assert "download_stopped" in response.flags
+    assert b"Transfer-Encoding" not in response.headers
+
+    failure = replay(handler, "https://a.gov/20")
+    assert failure.check(IgnoreRequest)
+    handler.close()
+
+
+def test_lookup_prefers_exact_url_then_latest(tmp_path):
+    writer = WarcWriter(str(tmp_path))
+    writer.write(page("http://a.gov/", "http"))
+    writer.write(page("https://a.gov/", "first"))
+    writer.write(page("https://a.gov/", "second"))
+    writer.write(page("https://a.gov/a", "a"))
+    writer.close()
+    index = CdxIndex(str(tmp_path))
+    assert index.lookup("http://a.gov/")["url"] == "http://a.gov/"
+    assert (
+        index.lookup("https://a.gov/")["offset"]
+        > index.lookup("http://a.gov/")["offset"]
+    )
+    handler = WarcReplayDownloadHandler(str(tmp_path))
+    assert replay(handler, "https://a.gov/").text == "second"
+    assert replay(handler, "https://a.gov/a").text == "a"
+    assert index.lookup("https://a.gov/b") is None
+    assert index.lookup("https://b.gov/") is None
+
+
+def test_index_rebuilt_from_interrupted_file(tmp_path):
+    writer = WarcWriter(str(tmp_path))
+    for i in range(5):
+        writer.write(page("https://a.gov/%d" % i, "page %d" % i))
+    writer.close()
+    (path,) = glob.glob(str(tmp_path / "*.warc.gz"))
+    with open(path + ".cdxj", "rb") as f:
+        recorded = f.read()
+    assert index_warc(path) == 5
+    with open(path + ".cdxj", "rb") as f:
+        # Only the timestamps could differ, and they're rounded to seconds.
+        assert [l.split(b" ")[0] for l in f] == [
+            l.split(b" ")[0] for l in recorded.splitlines(True)
+        ]
+
+    # A crawl killed while writing leaves a truncated last record.
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.truncate(size - 10)
+    assert len(list(read_records(path, chunk_size=64))) == 5
+    assert index_warc(path) == 4
+    handler = WarcReplayDownloadHandler(str(tmp_path))
+    assert replay(handler, "https://a.gov/3").text == "page 3"
+    assert replay(handler, "https://a.gov/4").check(IgnoreRequest)
+
+
+def test_writers_in_one_process_use_different_files(tmp_path):
+    writers = [WarcWriter(str(tmp_path)) for _ in range(2)]
+    for i, writer in enumerate(writers):
+        writer.write(page("https://a.gov/%d" % i, "page %d" % i))
+    for writer in writers:
+        writer.close()
+    assert len(glob.glob(str(tmp_path / "*.warc.gz"))) == 2
+    handler = WarcReplayDownloadHandler(str(tmp_path))
+    assert replay(handler, "https://a.gov/0").text == "page 0"
+    assert replay(handler, "https://a.gov/1").text == "page 1"
+
+
+def test_recorder_requires_a_directory():
+    with pytest.raises(NotConfigured):
+        WarcRecorderMiddleware.from_crawler(get_crawler())
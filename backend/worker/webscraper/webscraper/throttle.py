@@ -0,0 +1,97 @@
+"""
+Adaptive per-host concurrency.
+
+AutoThrottle only adjusts the delay between requests. AdaptiveConcurrencyMiddleware
+also adjusts each downloader slot's concurrency from the latency and error rate
+it observes, using additive increase / multiplicative decrease:
+
+- if the error rate is above ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE, or the
+  latency is above ADAPTIVE_CONCURRENCY_TARGET_LATENCY, concurrency is halved;
+- otherwise concurrency grows by one, up to ADAPTIVE_CONCURRENCY_MAX.
+
+Latency and error rate are exponentially weighted moving averages, and the
+concurrency is re-evaluated every ADAPTIVE_CONCURRENCY_WINDOW responses.
+"""
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+
+SMOOTHING = 0.2
+
+
+class HostState:
+    __slots__ = ("latency", "error_rate", "responses")
+
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.responses = 0
+
+
+class AdaptiveConcurrencyMiddleware:
+    def __init__(
+        self,
+        crawler,
+        min_concurrency=1,
+        max_concurrency=8,
+        target_latency=2.0,
+        max_error_rate=0.2,
+        window=5,
+    ):
+        self.crawler = crawler
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.hosts = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+        return cls(
+            crawler,
+            min_concurrency=s.getint("ADAPTIVE_CONCURRENCY_MIN", 1),
+            max_concurrency=s.getint(
+                "ADAPTIVE_CONCURRENCY_MAX", s.getint("CONCURRENT_REQUESTS_PER_DOMAIN")
+            ),
+            target_latency=s.getfloat("ADAPTIVE_CONCURRENCY_TARGET_LATENCY", 2.0),
+            max_error_rate=s.getfloat("ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE", 0.2),
+            window=s.getint("ADAPTIVE_CONCURRENCY_WINDOW", 5),
+        )
+
+    def process_response(self, request, response, spider):
+        error = response.status == 429 or response.status >= 500
+        self.observe(request, request.meta.get("download_latency"), error)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, IgnoreRequest):
+            self.observe(request, None, True)
+
+    def observe(self, request, latency, error):
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        state = self.hosts.get(key)
+        if state is None:
+            state = self.hosts[key] = HostState()
+        if latency is not None:
+            state.latency = (
+                latency
+                if state.latency is None
+                else (1 - SMOOTHING) * state.latency + SMOOTHING * latency
+            )
+        state.error_rate = (1 - SMOOTHING) * state.error_rate + SMOOTHING * error
+        state.responses += 1
+        if state.responses % self.window == 0:
+            slot.concurrency = self.adjust(slot.concurrency, state)
+
+    def adjust(self, concurrency, state):
+        overloaded = state.error_rate > self.max_error_rate or (
+            state.latency is not None and state.latency > self.target_latency
+        )
+        if overloaded:
+            return max(self.min_concurrency, concurrency // 2)
+        return min(self.max_concurrency, concurrency + 1)
@@ -0,0 +1,458 @@
+"""
+WARC recording and offline replay of crawls.
+
+When WARC_RECORD_DIR is set, WarcRecorderMiddleware writes every response, as
+it came from the network (before redirects, decompression and the rest of
+the downloader middlewares), to gzipped WARC 1.1 files in that directory:
+
+    <WARC_PREFIX>-<timestamp>-<pid>-<writer id>-<serial>.warc.gz
+
+where the writer id is random, so that crawls in the same process (jobs of
+the crawl daemon) never pick the same name.
+
+Each record is a separate gzip member, and a file is closed once it's larger
+than WARC_MAX_SIZE bytes. Its records are then listed, sorted by URL, in a
+CDXJ index next to it (`<file>.cdxj`), one line per record:
+
+    <url key> <timestamp> {"url": ..., "status": ..., "mime": ..., "digest": ...,
+                           "offset": ..., "length": ..., "filename": ...}
+
+where the URL key is the canonical URL with the host reversed (as in SURT,
+e.g. "gov,cisa)/about"), and offset and length locate the record's gzip
+member. Responses cut off by ContentTypeFilter are recorded with
+`WARC-Truncated: length`.
+
+WarcReplayDownloadHandler serves requests from the WARC files in
+WARC_REPLAY_DIR instead of the network. URLs are looked up by binary search
+in the CDXJ indexes, and only the matching record is read and decompressed,
+so replaying part of a crawl doesn't read the whole archive. Requests for URLs
+that weren't recorded are ignored. settings.py installs the handler, and turns
+off throttling, when the WEBSCRAPER_WARC_REPLAY_DIR environment variable is
+set.
+
+Indexes of files from interrupted crawls can be rebuilt with:
+
+    python -m webscraper.warc index FILE.warc.gz ...
+"""
+import argparse
+import base64
+import glob
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import time
+import uuid
+import zlib
+from http import HTTPStatus
+from ipaddress import ip_address
+from urllib.parse import urlsplit
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.url import canonicalize_url
+from twisted.internet import defer
+
+WARCINFO = b"software: crossfeed-webscraper\r\nformat: WARC File Format 1.1\r\n"
+# Hop-by-hop headers that no longer describe the recorded body.
+SKIPPED_HEADERS = {b"transfer-encoding", b"connection", b"keep-alive"}
+
+
+def url_key(url):
+    """Returns the SURT-style key of a URL, e.g. "gov,cisa)/about?a=1"."""
+    parts = urlsplit(canonicalize_url(url))
+    host = ",".join(reversed((parts.hostname or "").split(".")))
+    if parts.port:
+        host += ":%d" % parts.port
+    key = host + ")" + (parts.path or "/")
+    return key + "?" + parts.query if parts.query else key
+
+
+def warc_date(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+def payload_digest(body):
+    return "sha1:" + base64.b32encode(hashlib.sha1(body).digest()).decode()
+
+
+def http_block(response):
+    """Returns the HTTP status line, headers and body of a response as bytes."""
+    try:
+        reason = HTTPStatus(response.status).phrase
+    except ValueError:
+        reason = ""
+    status_line = "%s %d %s" % (
+        response.protocol or "HTTP/1.1",
+        response.status,
+        reason,
+    )
+    block = [status_line.encode()]
+    for name, values in response.headers.items():
+        if name.lower() in SKIPPED_HEADERS:
+            continue
+        block.extend(name + b": " + value for value in values)
+    return b"\r\n".join(block) + b"\r\n\r\n" + response.body
+
+
+def warc_record(warc_type, fields, block):
+    headers = [b"WARC/1.1", b"WARC-Type: " + warc_type.encode()]
+    headers.append(("WARC-Record-ID: <urn:uuid:%s>" % uuid.uuid4()).encode())
+    headers.extend(("%s: %s" % field).encode() for field in fields)
+    headers.append(b"Content-Length: %d" % len(block))
+    return b"\r\n".join(headers) + b"\r\n\r\n" + block + b"\r\n\r\n"
+
+
+class WarcWriter:
+    """Writes responses to rotating .warc.gz files, each with a CDXJ index."""
+
+    def __init__(self, directory, prefix="crossfeed", max_size=1 << 30, stats=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        self.stats = stats
+        self.serial = 0
+        self.writer_id = uuid.uuid4().hex[:8]
+        self.file = None
+        self.path = None
+        self.index = []
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self):
+        now = time.time()
+        self.path = os.path.join(
+            self.directory,
+            "%s-%s-%d-%s-%05d.warc.gz"
+            % (
+                self.prefix,
+                time.strftime("%Y%m%d%H%M%S", time.gmtime(now)),
+                os.getpid(),
+                self.writer_id,
+                self.serial,
+            ),
+        )
+        self.serial += 1
+        # Never append to, or overwrite, another writer's file.
+        self.file = open(self.path, "xb")
+        self.index = []
+        self._append(
+            warc_record(
+                "warcinfo",
+                [
+                    ("WARC-Date", warc_date(now)),
+                    ("Content-Type", "application/warc-fields"),
+                ],
+                WARCINFO,
+            )
+        )
+        self._inc_stat("warc/files")
+
+    def write(self, response, truncated=False):
+        if self.file is None:
+            self.open()
+        now = time.time()
+        fields = [("WARC-Date", warc_date(now)), ("WARC-Target-URI", response.url)]
+        if response.ip_address:
+            fields.append(("WARC-IP-Address", str(response.ip_address)))
+        digest = payload_digest(response.body)
+        fields.append(("WARC-Payload-Digest", digest))
+        if truncated:
+            fields.append(("WARC-Truncated", "length"))
+        fields.append(("Content-Type", "application/http;msgtype=response"))
+        offset, length = self._append(
+            warc_record("response", fields, http_block(response))
+        )
+        self.index.append(
+            index_entry(
+                response.url,
+                time.gmtime(now),
+                response.status,
+                response.headers,
+                digest,
+                (self.path, offset, length),
+            )
+        )
+        self._inc_stat("warc/records")
+        if self.file.tell() >= self.max_size:
+            self.close()
+
+    def _append(self, record):
+        offset = self.file.tell()
+        data = gzip.compress(record, compresslevel=6)
+        self.file.write(data)
+        self._inc_stat("warc/bytes", len(data))
+        return offset, len(data)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        write_index(self.path + ".cdxj", self.index)
+        self.file = None
+        self.index = []
+
+    def _inc_stat(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count)
+
+
+def index_entry(url, date, status, headers, digest, location):
+    """Returns (key, timestamp, fields) of the CDXJ line of a response record.
+
+    location is (WARC file path, offset, length) of its gzip member.
+    """
+    path, offset, length = location
+    content_type = headers.get("Content-Type", b"").decode("latin-1")
+    return (
+        url_key(url),
+        time.strftime("%Y%m%d%H%M%S", date),
+        {
+            "url": url,
+            "status": status,
+            "mime": content_type.split(";")[0].strip(),
+            "digest": digest,
+            "offset": offset,
+            "length": length,
+            "filename": os.path.basename(path),
+        },
+    )
+
+
+def write_index(path, entries):
+    lines = sorted(
+        ("%s %s %s\n" % (key, timestamp, json.dumps(fields))).encode()
+        for key, timestamp, fields in entries
+    )
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.writelines(lines)
+    os.replace(tmp, path)
+
+
+def read_records(path, chunk_size=1 << 20):
+    """Yields (offset, length, WARC headers, block) for each record of a .warc.gz file.
+
+    Stops at a truncated last record, as left by an interrupted crawl.
+    """
+    with open(path, "rb") as f:
+        offset, data = 0, f.read(chunk_size)
+        while data:
+            decompressor = zlib.decompressobj(wbits=31)
+            record, length = [], 0
+            while True:
+                record.append(decompressor.decompress(data))
+                if decompressor.eof:
+                    length += len(data) - len(decompressor.unused_data)
+                    data = decompressor.unused_data or f.read(chunk_size)
+                    break
+                length += len(data)
+                data = f.read(chunk_size)
+                if not data:
+                    return
+            yield (offset, length) + parse_record(b"".join(record))
+            offset += length
+
+
+def parse_record(record):
+    """Returns (WARC headers, block) of an uncompressed WARC record."""
+    head, _, rest = record.partition(b"\r\n\r\n")
+    headers = {}
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.decode("utf-8").partition(":")
+        headers[name.strip()] = value.strip()
+    return headers, rest[: int(headers["Content-Length"])]
+
+
+def parse_http_block(block):
+    """Returns (status, Headers, body) of a recorded HTTP response."""
+    head, _, body = block.partition(b"\r\n\r\n")
+    lines = head.split(b"\r\n")
+    status = int(lines[0].split(b" ", 2)[1])
+    headers = Headers()
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        headers.appendlist(name.strip(), value.strip())
+    return status, headers, body
+
+
+def index_warc(path):
+    """Writes the CDXJ index of a .warc.gz file. Returns the number of responses."""
+    entries = []
+    for offset, length, headers, block in read_records(path):
+        if headers.get("WARC-Type") != "response":
+            continue
+        status, http_headers, _ = parse_http_block(block)
+        entries.append(
+            index_entry(
+                headers["WARC-Target-URI"],
+                time.strptime(headers["WARC-Date"], "%Y-%m-%dT%H:%M:%SZ"),
+                status,
+                http_headers,
+                headers.get("WARC-Payload-Digest"),
+                (path, offset, length),
+            )
+        )
+    write_index(path + ".cdxj", entries)
+    return len(entries)
+
+
+class CdxIndex:
+    """Binary search over the sorted CDXJ files in a directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.maps = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.cdxj"))):
+            if os.path.getsize(path):
+                with open(path, "rb") as f:
+                    self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def lookup(self, url):
+        """Returns the index fields of the latest capture of url, or None.
+
+        Captures of exactly that URL are preferred over those that only share
+        its key (e.g. http:// instead of https://).
+        """
+        key = url_key(url).encode()
+        captures = [line for m in self.maps for line in self._lines(m, key)]
+        if not captures:
+            return None
+        captures = [json.loads(line.split(b" ", 2)[2]) for line in sorted(captures)]
+        exact = [c for c in captures if c["url"] == url]
+        return (exact or captures)[-1]
+
+    @staticmethod
+    def _lines(m, key):
+        """Returns the lines of m whose key is key."""
+        lo, hi = 0, len(m)
+        # Find the start of the first line with a key >= key.
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = m.rfind(b"\n", 0, mid) + 1
+            end = m.find(b"\n", mid)
+            end = len(m) if end < 0 else end
+            if m[start:end].split(b" ", 1)[0] < key:
+                lo = end + 1
+            else:
+                hi = start
+        lines = []
+        while lo < len(m):
+            end = m.find(b"\n", lo)
+            end = len(m) if end < 0 else end
+            line = m[lo:end]
+            if line.split(b" ", 1)[0] != key:
+                break
+            lines.append(line)
+            lo = end + 1
+        return lines
+
+    def close(self):
+        for m in self.maps:
+            m.close()
+        self.maps = []
+
+
+class WarcRecorderMiddleware:
+    def __init__(self, writer):
+        self.writer = writer
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.get("WARC_RECORD_DIR"):
+            raise NotConfigured
+        middleware = cls(
+            WarcWriter(
+                s.get("WARC_RECORD_DIR"),
+                prefix=s.get("WARC_PREFIX", "crossfeed"),
+                max_size=s.getint("WARC_MAX_SIZE", 1 << 30),
+                stats=crawler.stats,
+            )
+        )
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_response(self, request, response, spider):
+        if "replayed" not in response.flags:
+            self.writer.write(response, truncated="download_stopped" in response.flags)
+        return response
+
+    def spider_closed(self, spider):
+        self.writer.close()
+
+
+class WarcReplayDownloadHandler:
+    def __init__(self, directory, stats=None):
+        self.directory = directory
+        self.index = CdxIndex(directory)
+        self.stats = stats
+        self.files = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get("WARC_REPLAY_DIR")
+        if not directory:
+            raise NotConfigured
+        return cls(directory, crawler.stats)
+
+    def download_request(self, request, spider):
+        capture = self.index.lookup(request.url)
+        if capture is None:
+            self._inc_stat("warc/replay/miss")
+            return defer.fail(IgnoreRequest("Not in WARC_REPLAY_DIR: %s" % request.url))
+        self._inc_stat("warc/replay/hit")
+        headers, block = self.read(capture)
+        status, http_headers, body = parse_http_block(block)
+        flags = ["replayed"]
+        if headers.get("WARC-Truncated"):
+            flags.append("download_stopped")
+        respcls = responsetypes.from_args(
+            headers=http_headers, url=request.url, body=body
+        )
+        return defer.succeed(
+            respcls(
+                url=request.url,
+                status=status,
+                headers=http_headers,
+                body=body,
+                flags=flags,
+                request=request,
+                ip_address=ip_address(headers["WARC-IP-Address"])
+                if "WARC-IP-Address" in headers
+                else None,
+            )
+        )
+
+    def read(self, capture):
+        """Returns (WARC headers, block) of the record of an index entry."""
+        f = self.files.get(capture["filename"])
+        if f is None:
+            f = self.files[capture["filename"]] = open(
+                os.path.join(self.directory, capture["filename"]), "rb"
+            )
+        f.seek(capture["offset"])
+        return parse_record(zlib.decompress(f.read(capture["length"]), wbits=31))
+
+    def close(self):
+        self.index.close()
+        for f in self.files.values():
+            f.close()
+
+    def _inc_stat(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild CDXJ indexes of WARC files.")
+    parser.add_argument("command", choices=["index"])
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+    for path in args.files:
+        print("%s: %d responses" % (path, index_warc(path)))
+
+
+if __name__ == "__main__":
+    main()
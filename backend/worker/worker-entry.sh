@@ -4,8 +4,18 @@ set -e
 
 PROXY_PORT=8080
 
+# Optionally serve repeated GETs from a response cache. It's loaded before the
+# signing addon, so that only requests that go upstream are signed. Streamed
+# bodies can't be cached, so only bodies too large to cache are streamed.
+PROXY_SCRIPTS="-s worker/mitmproxy_sign_requests.py"
+STREAM_LARGE_BODIES=1
+if [ -n "$WORKER_RESPONSE_CACHE" ]; then
+  PROXY_SCRIPTS="-s worker/mitmproxy_response_cache.py $PROXY_SCRIPTS"
+  STREAM_LARGE_BODIES=${WORKER_RESPONSE_CACHE_MAX_ENTRY_BYTES:-8388608}
+fi
+
 # Reduce some long and unnecessary tabular output from pm2 with grep
-pm2 start --interpreter none --error ~/pm2-error.log mitmdump -- -s worker/mitmproxy_sign_requests.py --set stream_large_bodies=1 --listen-port $PROXY_PORT | grep "^\[PM2\]"
+pm2 start --interpreter none --error ~/pm2-error.log mitmdump -- $PROXY_SCRIPTS --set stream_large_bodies=$STREAM_LARGE_BODIES --listen-port $PROXY_PORT | grep "^\[PM2\]"
 
 wait-port $PROXY_PORT -t 5000 || pm2 logs
 